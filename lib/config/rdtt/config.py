@@ -52,14 +52,28 @@ cfg.TRAIN.PRINT_INTERVAL = 50
 cfg.TRAIN.VAL_EPOCH_INTERVAL = 20
 cfg.TRAIN.GRAD_CLIP_NORM = 0.1
 cfg.TRAIN.AMP = False
+cfg.TRAIN.PRECISION = "fp32"  # fp32, bf16 or fp16 autocast (AMP = True is the same as fp16)
 ## TRAIN save cfgs
 cfg.TRAIN.FIX_BN = True
 cfg.TRAIN.SAVE_EPOCH_INTERVAL = 1 # 1 means save model each epoch
 cfg.TRAIN.SAVE_LAST_N_EPOCH = 1 # besides, last n epoch model will be saved
+cfg.TRAIN.DELTA_CKPT = False # only save the trainable parameters and a hash of the frozen base (OSTrack) weights
+cfg.TRAIN.KEEP_LAST_N_CKPT = 0 # remove older checkpoints, 0 keeps all of them
 
 cfg.TRAIN.CE_START_EPOCH = 20  # candidate elimination start epoch
 cfg.TRAIN.CE_WARM_EPOCH = 80  # candidate elimination warm up epoch
 cfg.TRAIN.DROP_PATH_RATE = 0.1  # drop path rate for ViT backbone
+cfg.TRAIN.GRAD_CHECKPOINT_BLOCKS = []  # backbone layers recomputed in backward (activation checkpointing)
+cfg.TRAIN.ACCUM_STEPS = 1  # number of micro-batches each batch is split into (gradient accumulation)
+# per-iteration timings of the training loop, written to logs/<script>-<config>-telemetry.jsonl and tensorboard
+cfg.TRAIN.TELEMETRY = edict()
+cfg.TRAIN.TELEMETRY.ENABLE = False
+cfg.TRAIN.TELEMETRY.SYNC = False  # synchronize the device at each stage for exact device timings (slower)
+cfg.TRAIN.TELEMETRY.DATA_WAIT_ALERT = 0.2  # alert when waiting for data takes more than this fraction of the time
+cfg.TRAIN.TELEMETRY.WINDOW = 50  # number of iterations the data wait is checked on
+# torch.profiler trace of the training steps 'start:stop' (e.g. "50:60"), written to <save_dir>/profiles. Overridden
+# by the --profile-steps argument
+cfg.TRAIN.PROFILE_STEPS = ""
 
 # TRAIN.SCHEDULER
 cfg.TRAIN.SCHEDULER = edict()
@@ -72,6 +86,13 @@ cfg.DATA.SAMPLER_MODE = "causal"  # sampling methods
 cfg.DATA.MEAN = [0.485, 0.456, 0.406]
 cfg.DATA.STD = [0.229, 0.224, 0.225]
 cfg.DATA.MAX_SAMPLE_INTERVAL = 200
+cfg.DATA.CROP_ON_DEVICE = False  # workers return image ROIs, the crops of a batch are extracted on the device
+cfg.DATA.UINT8_TRANSPORT = False  # workers return uint8 crops, jitter/flip/normalization are applied on the device
+# DATA.MULTI_CROP: several jittered samples per decoded template/search pair
+cfg.DATA.MULTI_CROP = edict()
+cfg.DATA.MULTI_CROP.NUM = 1  # samples per decoded pair (1: disabled)
+cfg.DATA.MULTI_CROP.EXTRA_SEARCH = 0  # extra search frames decoded from the same window (causal mode)
+cfg.DATA.MULTI_CROP.MAX_PER_BATCH = 4  # maximum number of samples of a pair in one batch
 # DATA.TRAIN
 cfg.DATA.TRAIN = edict()
 cfg.DATA.TRAIN.DATASETS_NAME = ["LASOT", "GOT10K_vottrain"]
@@ -104,6 +125,18 @@ cfg.TEST.TEMPLATE_SIZE = 128
 cfg.TEST.SEARCH_FACTOR = 5.0
 cfg.TEST.SEARCH_SIZE = 320
 cfg.TEST.EPOCH = 500
+cfg.TEST.DEVICE = "cuda"
+cfg.TEST.PRECISION = "fp32"  # fp32, bf16 or fp16 autocast
+cfg.TEST.COMPILE = False  # static-shape torch.compile of the network, compiled and warmed up once per configuration
+cfg.TEST.COMPILE_MODE = "default"  # torch.compile mode: default, reduce-overhead or max-autotune
+cfg.TEST.FUSE_HEAD = False  # fold the BatchNorms and fuse the branches of the center head (FusedCenterPredictor)
+cfg.TEST.HEAD_CHANNELS_LAST = False  # channels last convolutions in the fused head, faster on CPU
+cfg.TEST.SPARSE_HEAD = False  # size/offset branches only around the score peak (SparseCenterPredictor), over FUSE_HEAD
+cfg.TEST.CROP_BACKEND = "opencv"  # tracker crops: opencv (sample_target), warp (single cv.warpAffine) or torch
+cfg.TEST.SPECULATIVE_CROP = False  # crop the next frame around a predicted state during the current forward
+cfg.TEST.SPECULATIVE_TOLERANCE = 0.05  # accepted state shift and crop size change, relative to the crop size
+cfg.TEST.STAGE_TIMERS = False  # per-stage latency histograms of each sequence, <seq>_stage_times.json
+cfg.TEST.PROFILE_STEPS = ""  # torch.profiler trace of the frames 'start:stop' of each sequence, --profile-steps
 
 
 def _edict2dict(dest_dict, src_edict):
@@ -44,11 +44,11 @@ def candidate_elimination(attn: torch.Tensor, tokens: torch.Tensor, lens_t: int,
     attn_t = attn[:, :, :lens_t, lens_t:]
 
     if box_mask_z is not None:
-        box_mask_z = box_mask_z.unsqueeze(1).unsqueeze(-1).expand(-1, attn_t.shape[1], -1, attn_t.shape[-1])
-        # attn_t = attn_t[:, :, box_mask_z, :]
-        attn_t = attn_t[box_mask_z]
-        attn_t = attn_t.view(bs, hn, -1, lens_s)
-        attn_t = attn_t.mean(dim=2).mean(dim=1)  # B, H, L-T, L_s --> B, L_s
+        # mean over the template tokens of the mask, as a masked sum instead of boolean indexing so that the shapes do
+        # not depend on the mask (static shapes for torch.compile)
+        box_mask_z = box_mask_z.to(attn_t.dtype).unsqueeze(1).unsqueeze(-1)  # B, 1, L_t, 1
+        attn_t = (attn_t * box_mask_z).sum(dim=2) / box_mask_z.sum(dim=2)
+        attn_t = attn_t.mean(dim=1)  # B, H, L-T, L_s --> B, L_s
     else:
         attn_t = attn_t.mean(dim=2).mean(dim=1)  # B, H, L-T, L_s --> B, L_s
 
@@ -126,6 +126,12 @@ class CenterPredictor(nn.Module, ):
         for p in self.parameters():
             if p.dim() > 1:
                 nn.init.xavier_uniform_(p)
+        self.register_buffer('score_window', None, persistent=False)
+
+    def set_score_window(self, score_window):
+        """ Weight of the score map (e.g. the hann window of the tracker) for the boxes decoded in forward, None for
+        no weight. """
+        self.score_window = score_window
 
     def forward(self, x, gt_score_map=None):
         """ Forward pass with input x. """
@@ -133,13 +139,16 @@ class CenterPredictor(nn.Module, ):
 
         # assert gt_score_map is None
         if gt_score_map is None:
-            bbox = self.cal_bbox(score_map_ctr, size_map, offset_map)
+            response = score_map_ctr if self.score_window is None else self.score_window * score_map_ctr
+            bbox = self.cal_bbox(response, size_map, offset_map)
         else:
             bbox = self.cal_bbox(gt_score_map.unsqueeze(1), size_map, offset_map)
 
         return score_map_ctr, bbox, size_map, offset_map
 
     def cal_bbox(self, score_map_ctr, size_map, offset_map, return_score=False):
+        # boxes are always computed in fp32 (the maps may come from an autocast region)
+        score_map_ctr, size_map, offset_map = score_map_ctr.float(), size_map.float(), offset_map.float()
         max_score, idx = torch.max(score_map_ctr.flatten(1), dim=1, keepdim=True)
         idx_y = idx // self.feat_sz
         idx_x = idx % self.feat_sz
@@ -175,7 +184,8 @@ class CenterPredictor(nn.Module, ):
     def get_score_map(self, x):
 
         def _sigmoid(x):
-            y = torch.clamp(x.sigmoid_(), min=1e-4, max=1 - 1e-4)
+            # in fp32 under autocast, 1 - 1e-4 rounds to 1 in bf16
+            y = torch.clamp(x.float().sigmoid_(), min=1e-4, max=1 - 1e-4)
             return y
 
         # ctr branch
@@ -201,6 +211,127 @@ class CenterPredictor(nn.Module, ):
         return _sigmoid(score_map_ctr), _sigmoid(score_map_size), score_map_offset
 
 
+def fold_conv_bn(conv_bn):
+    """ (weight, bias) of the Conv2d of a conv() block with its (eval mode) BatchNorm folded in. """
+    conv, bn = conv_bn[0], conv_bn[1]
+    # FrozenBatchNorm2d has no eps attribute, it uses 1e-5 as BatchNorm2d
+    scale = bn.weight * (bn.running_var + getattr(bn, 'eps', 1e-5)).rsqrt()
+    bias = conv.bias if conv.bias is not None else torch.zeros_like(bn.running_mean)
+    return conv.weight * scale.reshape(-1, 1, 1, 1), (bias - bn.running_mean) * scale + bn.bias
+
+
+class FusedCenterPredictor(CenterPredictor):
+    """ Inference version of a CenterPredictor with the BatchNorms folded into the convolutions and the three branches
+    (ctr, offset, size) fused: one conv reading the input for the first layers of the branches, grouped convs for the
+    following layers and a block diagonal 1x1 conv for the output layers. The outputs are those of the CenterPredictor
+    up to float rounding. With channels_last, the convs run in the channels last memory format (faster on CPU). """
+
+    def __init__(self, head: CenterPredictor, channels_last=False):
+        nn.Module.__init__(self)
+        self.feat_sz = head.feat_sz
+        self.stride = head.stride
+        self.img_sz = head.img_sz
+        self.channels_last = channels_last
+        self.register_buffer('score_window', head.score_window, persistent=False)
+
+        branches = ('ctr', 'offset', 'size')
+        layers = []
+        with torch.no_grad():
+            for i in range(1, 5):
+                weights, biases = zip(*[fold_conv_bn(getattr(head, 'conv%d_%s' % (i, b))) for b in branches])
+                ref = getattr(head, 'conv%d_ctr' % i)[0]
+                # the first layers read the same input, the following ones their own branch (group)
+                groups = 1 if i == 1 else len(branches)
+                layer = nn.Conv2d(ref.in_channels * groups, ref.out_channels * len(branches), ref.kernel_size,
+                                  stride=ref.stride, padding=ref.padding, dilation=ref.dilation, groups=groups)
+                layer.weight.copy_(torch.cat(weights))
+                layer.bias.copy_(torch.cat(biases))
+                layers += [layer, nn.ReLU(inplace=True)]
+            self.branches = nn.Sequential(*layers)
+
+            outs = [getattr(head, 'conv5_%s' % b) for b in branches]
+            in_channels = outs[0].in_channels
+            self.conv5 = nn.Conv2d(in_channels * len(outs), sum(o.out_channels for o in outs), kernel_size=1)
+            self.conv5.weight.zero_()
+            start = 0
+            for i, o in enumerate(outs):
+                self.conv5.weight[start:start + o.out_channels, i * in_channels:(i + 1) * in_channels] = o.weight
+                self.conv5.bias[start:start + o.out_channels] = o.bias
+                start += o.out_channels
+        self.out_channels = [o.out_channels for o in outs]
+        if channels_last:
+            self.to(memory_format=torch.channels_last)
+
+    def get_score_map(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        # back to contiguous (NCHW) maps as the CenterPredictor
+        score_maps = self.conv5(self.branches(x)).contiguous()
+        score_map_ctr, score_map_offset, score_map_size = torch.split(score_maps, self.out_channels, dim=1)
+        # in fp32 under autocast, 1 - 1e-4 rounds to 1 in bf16
+        return (torch.clamp(score_map_ctr.float().sigmoid(), min=1e-4, max=1 - 1e-4),
+                torch.clamp(score_map_size.float().sigmoid(), min=1e-4, max=1 - 1e-4),
+                score_map_offset.contiguous())
+
+
+class SparseCenterPredictor(CenterPredictor):
+    """ Inference version of a CenterPredictor (sharing its layers) that runs the ctr branch densely and the size and
+    offset branches only on their receptive field around the peak of the score map weighted by the score_window of
+    the head (the hann window of the tracker, see set_score_window). The size and offset maps are zero but at the peak,
+    so cal_bbox on the same weighted score map gives the boxes of the dense head (up to float rounding of the
+    convolutions). """
+
+    def __init__(self, head: CenterPredictor):
+        nn.Module.__init__(self)
+        self.feat_sz = head.feat_sz
+        self.stride = head.stride
+        self.img_sz = head.img_sz
+        for name, module in head.named_children():
+            self.add_module(name, module)
+        self.register_buffer('score_window', head.score_window, persistent=False)
+        # receptive field radius of an output of the branches on the input (the output convs are 1x1)
+        self.radius = sum(getattr(self, 'conv%d_size' % i)[0].padding[0] for i in range(1, 5))
+
+    def get_score_map(self, x):
+        x_ctr = x
+        for i in range(1, 5):
+            x_ctr = getattr(self, 'conv%d_ctr' % i)(x_ctr)
+        # in fp32 under autocast, 1 - 1e-4 rounds to 1 in bf16
+        score_map_ctr = torch.clamp(self.conv5_ctr(x_ctr).float().sigmoid_(), min=1e-4, max=1 - 1e-4)
+        response = score_map_ctr if self.score_window is None else self.score_window * score_map_ctr
+        _, idx = torch.max(response.flatten(1), dim=1)
+
+        # (2r+1)x(2r+1) input windows centered on the peaks, zero outside the feature map as the padding of the convs
+        r, bs = self.radius, x.shape[0]
+        steps = torch.arange(-r, r + 1, device=x.device)
+        rows = (idx // self.feat_sz)[:, None] + steps  # (B, 2r+1)
+        cols = (idx % self.feat_sz)[:, None] + steps
+        inside = (((rows >= 0) & (rows < self.feat_sz))[:, :, None] &
+                  ((cols >= 0) & (cols < self.feat_sz))[:, None, :]).unsqueeze(1)  # (B, 1, 2r+1, 2r+1)
+        x_pad = F.pad(x, (r, r, r, r))
+        batch = torch.arange(bs, device=x.device)[:, None, None]
+        window = x_pad[batch, :, (rows + r)[:, :, None], (cols + r)[:, None, :]].permute(0, 3, 1, 2).contiguous()
+
+        size = self._window_branch(window, inside, 'size')
+        offset = self._window_branch(window, inside, 'offset')
+        size = torch.clamp(size.float().sigmoid_(), min=1e-4, max=1 - 1e-4)
+        index = idx[:, None, None].expand(bs, 2, 1)
+        size_map = size.new_zeros(bs, 2, self.feat_sz * self.feat_sz).scatter_(2, index, size[:, :, None])
+        offset_map = offset.new_zeros(bs, 2, self.feat_sz * self.feat_sz).scatter_(2, index, offset[:, :, None])
+        shape = (bs, 2, self.feat_sz, self.feat_sz)
+        return score_map_ctr, size_map.view(shape), offset_map.view(shape)
+
+    def _window_branch(self, x, inside, branch):
+        """ Output (B, C) of a branch at the center of the input windows x (B, C, 2r+1, 2r+1). """
+        for i in range(1, 5):
+            conv, bn, relu = getattr(self, 'conv%d_%s' % (i, branch))
+            x = relu(bn(F.conv2d(x, conv.weight, conv.bias, conv.stride, 0, conv.dilation)))
+            # the activations outside the feature map are the zero padding of the next layer
+            crop = (inside.shape[-1] - x.shape[-1]) // 2
+            x = x * inside[:, :, crop:inside.shape[-1] - crop, crop:inside.shape[-1] - crop].to(x.dtype)
+        return getattr(self, 'conv5_%s' % branch)(x).flatten(1)
+
+
 class MLP(nn.Module):
     """ Very simple multi-layer perceptron (also called FFN)"""
 
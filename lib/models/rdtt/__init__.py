@@ -1,2 +1,3 @@
 from .ostrack import build_ostrack
-from .ostrack_prompt import build_rdttrack
\ No newline at end of file
+from .ostrack_prompt import build_rdttrack
+from .multi_adapter import MultiAdapterRDTTrack, get_multi_adapter_rdttrack
\ No newline at end of file
@@ -0,0 +1,167 @@
+"""
+Serving several RDTTrack fine-tunes with one frozen backbone.
+
+The fine-tunes only differ in their prompt adapter (patch_embed_prompt, prompt_blocks, prompt_norms and DepthIR_ORT),
+the OSTrack ViT and the box head are frozen. MultiAdapterRDTTrack keeps one copy of the shared weights and the adapter
+modules of every fine-tune, and swaps the adapter modules into the backbone before running it.
+"""
+import copy
+import threading
+from collections import OrderedDict
+
+import torch
+from torch import nn
+
+from lib.models.rdtt.ostrack_prompt import build_rdttrack
+from lib.utils import ckpt_utils
+
+ADAPTER_MODULES = ('patch_embed_prompt', 'prompt_blocks', 'prompt_norms', 'DepthIR_ORT')
+
+
+def is_adapter_key(key):
+    return any(key.startswith('backbone.{}.'.format(m)) for m in ADAPTER_MODULES)
+
+
+class MultiAdapterRDTTrack(nn.Module):
+    """ RDTTrack with several named prompt adapters on top of one shared backbone and box head.
+
+    forward() takes the same arguments as RDTTrack.forward() plus adapter, the name of the adapter for the whole batch or
+    a list with the adapter of each sample. Mixed batches are run as one sub-batch per adapter and the outputs are put
+    back in the input order.
+    """
+
+    def __init__(self, net):
+        """
+        args:
+            net - RDTTrack holding the shared weights. Its own adapter is not used.
+        """
+        super().__init__()
+        self.net = net
+        self.adapters = nn.ModuleDict()
+        self.active_adapter = None
+        # the adapter swap changes self.net, forward calls from different threads must not interleave
+        self._lock = threading.RLock()
+        self._base_hashes = {}
+
+    @property
+    def box_head(self):
+        return self.net.box_head
+
+    @property
+    def backbone(self):
+        return self.net.backbone
+
+    def _check_shared_weights(self, name, checkpoint_dict):
+        """ The weights of the checkpoint outside the adapter have to be the shared ones. """
+        shared_state = self.net.state_dict()
+        if 'net_delta' in checkpoint_dict:
+            state = checkpoint_dict['net_delta']
+            base_keys = tuple(k for k in shared_state.keys() if k not in state)
+            if base_keys not in self._base_hashes:
+                self._base_hashes[base_keys] = ckpt_utils.state_dict_hash(shared_state, base_keys)
+            if self._base_hashes[base_keys] != checkpoint_dict['base_hash']:
+                raise ValueError("Adapter '{}' was trained on top of other base weights ({})".format(
+                    name, checkpoint_dict.get('base_file')))
+        else:
+            state = checkpoint_dict['net']
+        for k, v in state.items():
+            if is_adapter_key(k):
+                continue
+            if k not in shared_state or not torch.equal(shared_state[k].cpu(), v.cpu()):
+                raise ValueError("Adapter '{}' does not share the weight '{}'".format(name, k))
+        return state
+
+    def add_adapter(self, name, checkpoint_dict):
+        """ Add the adapter of a full or delta RDTTrack checkpoint dict under name. """
+        state = self._check_shared_weights(name, checkpoint_dict)
+        backbone = self.net.backbone
+        adapter = nn.ModuleDict()
+        for m in ADAPTER_MODULES:
+            if not hasattr(backbone, m):
+                continue
+            module = copy.deepcopy(getattr(backbone, m))
+            prefix = 'backbone.{}.'.format(m)
+            module.load_state_dict({k[len(prefix):]: v for k, v in state.items() if k.startswith(prefix)},
+                                   strict=True)
+            adapter[m] = module
+        device = next(self.net.parameters()).device
+        self.adapters[name] = adapter.to(device)
+        if self.active_adapter is None:
+            self.set_adapter(name)
+
+    def load_adapter(self, name, checkpoint_path):
+        self.add_adapter(name, torch.load(checkpoint_path, map_location='cpu'))
+
+    def set_adapter(self, name):
+        """ Swap the modules of the adapter name into the backbone. No weights are copied. """
+        if name == self.active_adapter:
+            return
+        if name not in self.adapters:
+            raise KeyError("Unknown adapter '{}', available: {}".format(name, list(self.adapters.keys())))
+        for m, module in self.adapters[name].items():
+            setattr(self.net.backbone, m, module)
+        self.active_adapter = name
+
+    def _forward_adapter(self, name, *args, **kwargs):
+        with self._lock:
+            self.set_adapter(name)
+            return self.net(*args, **kwargs)
+
+    def forward(self, template: torch.Tensor, search: torch.Tensor, ce_template_mask=None, ce_keep_rate=None,
+                return_last_attn=False, adapter=None):
+        if adapter is None:
+            adapter = self.active_adapter
+        if isinstance(adapter, str):
+            return self._forward_adapter(adapter, template, search, ce_template_mask=ce_template_mask,
+                                         ce_keep_rate=ce_keep_rate, return_last_attn=return_last_attn)
+
+        if len(adapter) != search.shape[0]:
+            raise ValueError("Got {} adapter names for a batch of {}".format(len(adapter), search.shape[0]))
+        groups = OrderedDict()
+        for i, name in enumerate(adapter):
+            groups.setdefault(name, []).append(i)
+        if len(groups) == 1:
+            return self.forward(template, search, ce_template_mask, ce_keep_rate, return_last_attn,
+                                adapter=adapter[0])
+
+        outputs = []
+        for name, ids in groups.items():
+            ids = torch.tensor(ids, device=search.device)
+            mask = ce_template_mask.index_select(0, ids) if ce_template_mask is not None else None
+            outputs.append(self._forward_adapter(name, template.index_select(0, ids), search.index_select(0, ids),
+                                                 ce_template_mask=mask, ce_keep_rate=ce_keep_rate,
+                                                 return_last_attn=return_last_attn))
+        order = torch.tensor([i for ids in groups.values() for i in ids], device=search.device)
+        return _merge_outputs(outputs, torch.argsort(order))
+
+
+def _merge_outputs(outputs, inverse_order):
+    """ Concatenate the outputs of the sub-batches along the batch dimension and restore the input order. """
+    first = outputs[0]
+    if torch.is_tensor(first):
+        return torch.cat(outputs, dim=0).index_select(0, inverse_order)
+    if isinstance(first, dict):
+        return {k: _merge_outputs([o[k] for o in outputs], inverse_order) for k in first}
+    if isinstance(first, (list, tuple)):
+        return type(first)(_merge_outputs(list(o), inverse_order) for o in zip(*outputs))
+    return first
+
+
+_shared_networks = {}
+
+
+def get_multi_adapter_rdttrack(cfg, adapters, base_checkpoint=None):
+    """ MultiAdapterRDTTrack with the adapters of the checkpoints {name: path}. The shared weights are those of the
+    first checkpoint (plus base_checkpoint for a delta). The network is cached, so that the trackers of a process share
+    it. """
+    # by value, the parameters of all the yamls share (and update) the same cfg object
+    key = (repr(cfg), tuple(adapters.items()), base_checkpoint)
+    if key not in _shared_networks:
+        net = build_rdttrack(cfg, training=False)
+        checkpoint_paths = list(adapters.values())
+        ckpt_utils.load_network(net, checkpoint_paths[0], base_checkpoint)
+        multi_net = MultiAdapterRDTTrack(net)
+        for name, path in adapters.items():
+            multi_net.load_adapter(name, path)
+        _shared_networks[key] = multi_net
+    return _shared_networks[key]
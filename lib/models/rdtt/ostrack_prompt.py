@@ -10,6 +10,7 @@ from lib.models.layers.head import build_box_head
 from lib.models.rdtt.vit_prompt import vit_base_patch16_224_prompt
 from lib.models.rdtt.vit_ce_prompt import vit_base_patch16_224_ce_prompt
 from lib.utils.box_ops import box_xyxy_to_cxcywh
+from lib.utils import stage_timer
 
 class RDTTrack(nn.Module):
     """ This is the base class for RDTTrack """
@@ -47,7 +48,8 @@ class RDTTrack(nn.Module):
         feat_last = x
         if isinstance(x, list):
             feat_last = x[-1]
-        out = self.forward_head(feat_last, None)
+        with stage_timer.timed('forward_head'):
+            out = self.forward_head(feat_last, None)
 
         out.update(aux_dict)
         out['backbone_feat'] = x
@@ -114,6 +116,8 @@ def build_rdttrack(cfg, training=True):
                                            new_patch_size=cfg.MODEL.BACKBONE.STRIDE,
                                            prompt_type=cfg.TRAIN.PROMPT.TYPE
                                            )
+        if training:
+            backbone.set_grad_checkpoint_blocks(getattr(cfg.TRAIN, "GRAD_CHECKPOINT_BLOCKS", []))
         hidden_dim = backbone.embed_dim
         patch_start_index = 1
 
@@ -4,14 +4,18 @@ import pdb
 from functools import partial
 from collections import OrderedDict
 from copy import deepcopy
+import inspect
 
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+import torch.utils.checkpoint
 
 from timm.models.layers import to_2tuple
 
 from lib.models.layers.patch_embed import PatchEmbed
+from lib.utils import stage_timer
+from lib.utils.amp_utils import fp32_region
 from .utils import combine_tokens, recover_tokens, token2feature, feature2token
 from .vit import VisionTransformer
 from ..layers.attn_blocks import CEBlock, candidate_elimination_prompt
@@ -19,6 +23,28 @@ from ..layers.attn_blocks import CEBlock, candidate_elimination_prompt
 _logger = logging.getLogger(__name__)
 
 
+def _restore_search_tokens(x, global_index_s, removed_indexes_s, lens_x):
+    """ Search tokens x (B, kept, C) back at their original position among lens_x tokens, the eliminated ones being
+    zero. The eliminated indices are those of the layers which did eliminate (the others returned None), which is fixed
+    by the configuration, so the shapes are static. """
+    removed_indexes_s = [index for index in removed_indexes_s if index is not None]
+    if not removed_indexes_s:
+        return x
+    B, lens_x_new, C = x.shape
+    pad_x = x.new_zeros([B, lens_x - lens_x_new, C])
+    x = torch.cat([x, pad_x], dim=1)
+    index_all = torch.cat([global_index_s] + removed_indexes_s, dim=1)
+    return torch.zeros_like(x).scatter_(dim=1, index=index_all.unsqueeze(-1).expand(B, -1, C).to(torch.int64), src=x)
+
+
+def _checkpoint(function, *args):
+    """ Activation checkpointing. The non-reentrant implementation (when available) supports non-tensor inputs and
+    outputs, and recomputes with the same RNG state (dropout / drop path). """
+    if 'use_reentrant' in inspect.signature(torch.utils.checkpoint.checkpoint).parameters:
+        return torch.utils.checkpoint.checkpoint(function, *args, use_reentrant=False)
+    return torch.utils.checkpoint.checkpoint(function, *args)
+
+
 class Fovea(nn.Module):
 
     def __init__(self, smooth=False):
@@ -26,6 +52,8 @@ class Fovea(nn.Module):
 
         self.softmax = nn.Softmax(dim=-1)
 
+        # python flag, the branch in forward must not depend on the value of the parameter (torch.compile)
+        self.use_smooth = smooth
         self.smooth = smooth
         if smooth:
             self.smooth = nn.Parameter(torch.zeros(1) + 10.0)
@@ -37,7 +65,7 @@ class Fovea(nn.Module):
         b, c, h, w = x.shape
         x = x.contiguous().view(b, c, h*w)
 
-        if self.smooth:
+        if self.use_smooth:
             mask = self.softmax(x * self.smooth)
         else:
             mask = self.softmax(x)
@@ -87,17 +115,20 @@ class DepthIR_ort_block(nn.Module, ):
         """ Forward pass with input x. """
         depth0 = self.conv0_0_ort(depth)
         infrared0 = self.conv0_1_ort(infrared)
-        f_lg_depth_on_infrared = depth0 * infrared0
-        f_g_norm_infrared = torch.norm(infrared0, p=2, dim=1, keepdim=True)
-        f_proj_depth_on_infrared = (f_lg_depth_on_infrared / (f_g_norm_infrared + 1e-6)) * infrared0
-        f_lg_infrared_on_depth = infrared0 * depth0
-        f_g_norm_depth = torch.norm(depth0, p=2, dim=1, keepdim=True)
-        f_proj_infrared_on_depth = (f_lg_infrared_on_depth / (f_g_norm_depth + 1e-6)) * depth0
-        alpha = torch.sigmoid(self.alpha)
-        beta = torch.sigmoid(self.beta)
-        x_depth_orth = depth0 - alpha * f_proj_depth_on_infrared
-        x_infrared_orth = infrared0 - beta * f_proj_infrared_on_depth
-        x_dt = torch.cat((x_depth_orth, x_infrared_orth), dim=1)
+        # the norms and the divisions by them are computed in fp32, also under autocast
+        with fp32_region(depth0):
+            depth0, infrared0 = depth0.float(), infrared0.float()
+            f_lg_depth_on_infrared = depth0 * infrared0
+            f_g_norm_infrared = torch.norm(infrared0, p=2, dim=1, keepdim=True)
+            f_proj_depth_on_infrared = (f_lg_depth_on_infrared / (f_g_norm_infrared + 1e-6)) * infrared0
+            f_lg_infrared_on_depth = infrared0 * depth0
+            f_g_norm_depth = torch.norm(depth0, p=2, dim=1, keepdim=True)
+            f_proj_infrared_on_depth = (f_lg_infrared_on_depth / (f_g_norm_depth + 1e-6)) * depth0
+            alpha = torch.sigmoid(self.alpha)
+            beta = torch.sigmoid(self.beta)
+            x_depth_orth = depth0 - alpha * f_proj_depth_on_infrared
+            x_infrared_orth = infrared0 - beta * f_proj_infrared_on_depth
+            x_dt = torch.cat((x_depth_orth, x_infrared_orth), dim=1)
         return self.conv1_1_ort(x_dt)
 
 
@@ -207,10 +238,18 @@ class VisionTransformerCE(VisionTransformer):
             )
 
         self.blocks = nn.Sequential(*blocks)
+        # stage timer names of the blocks, formatted once
+        self._block_timer_names = ['ce_block%02d' % i for i in range(depth)]
         self.norm = norm_layer(embed_dim)
+        # indices of the layers (prompt block + CEBlock) whose activations are recomputed in backward
+        self.grad_checkpoint_blocks = set()
 
         self.init_weights(weight_init)
 
+    def set_grad_checkpoint_blocks(self, blocks):
+        """ Enable activation checkpointing (in training) for the given layer indices. """
+        self.grad_checkpoint_blocks = set(blocks)
+
     def forward_features(self, z, x, mask_z=None, mask_x=None,
                          ce_template_mask=None, ce_keep_rate=None,
                          return_last_attn=False):
@@ -228,39 +267,41 @@ class VisionTransformerCE(VisionTransformer):
         # overwrite x & z
         x, z = x_rgb, z_rgb
 
-        z = self.patch_embed(z)
-        x = self.patch_embed(x)
+        with stage_timer.timed('patch_embed'):
+            z = self.patch_embed(z)
+            x = self.patch_embed(x)
 
-        z_depth = self.patch_embed_prompt(z_depth)
-        x_depth = self.patch_embed_prompt(x_depth)
+            z_depth = self.patch_embed_prompt(z_depth)
+            x_depth = self.patch_embed_prompt(x_depth)
 
-        z_thermal = self.patch_embed_prompt(z_thermal)
-        x_thermal = self.patch_embed_prompt(x_thermal)
+            z_thermal = self.patch_embed_prompt(z_thermal)
+            x_thermal = self.patch_embed_prompt(x_thermal)
 
         '''input prompt: by adding to rgb tokens'''
-        if self.prompt_type in ['rdtt_shaw', 'rdtt_deep']:
-            z_feat = token2feature(self.prompt_norms[0](z))
-            x_feat = token2feature(self.prompt_norms[0](x))
-            z_depth_feat = token2feature(self.prompt_norms[0](z_depth))
-            x_depth_feat = token2feature(self.prompt_norms[0](x_depth))
-            z_thermal_feat = token2feature(self.prompt_norms[0](z_thermal))
-            x_thermal_feat = token2feature(self.prompt_norms[0](x_thermal))
-            # # rgbdt
-            z_depthir_feat = self.DepthIR_ORT(z_depth_feat, z_thermal_feat)
-            x_depthir_feat = self.DepthIR_ORT(x_depth_feat, x_thermal_feat)
-            z_feat = torch.cat([z_feat, z_depthir_feat], dim=1)
-            x_feat = torch.cat([x_feat, x_depthir_feat], dim=1)
-            z_feat = self.prompt_blocks[0](z_feat)
-            x_feat = self.prompt_blocks[0](x_feat)
-            z_dte = feature2token(z_feat)
-            x_dte = feature2token(x_feat)
-            z_prompted, x_prompted = z_dte, x_dte
-
-            z = z + z_dte
-            x = x + x_dte
-        else:
-            z = z + z_dte
-            x = x + x_dte
+        with stage_timer.timed('prompt_blocks'):
+            if self.prompt_type in ['rdtt_shaw', 'rdtt_deep']:
+                z_feat = token2feature(self.prompt_norms[0](z))
+                x_feat = token2feature(self.prompt_norms[0](x))
+                z_depth_feat = token2feature(self.prompt_norms[0](z_depth))
+                x_depth_feat = token2feature(self.prompt_norms[0](x_depth))
+                z_thermal_feat = token2feature(self.prompt_norms[0](z_thermal))
+                x_thermal_feat = token2feature(self.prompt_norms[0](x_thermal))
+                # # rgbdt
+                z_depthir_feat = self.DepthIR_ORT(z_depth_feat, z_thermal_feat)
+                x_depthir_feat = self.DepthIR_ORT(x_depth_feat, x_thermal_feat)
+                z_feat = torch.cat([z_feat, z_depthir_feat], dim=1)
+                x_feat = torch.cat([x_feat, x_depthir_feat], dim=1)
+                z_feat = self.prompt_blocks[0](z_feat)
+                x_feat = self.prompt_blocks[0](x_feat)
+                z_dte = feature2token(z_feat)
+                x_dte = feature2token(x_feat)
+                z_prompted, x_prompted = z_dte, x_dte
+
+                z = z + z_dte
+                x = x + x_dte
+            else:
+                z = z + z_dte
+                x = x + x_dte
 
         # attention mask handling
         # B, H, W
@@ -303,26 +344,60 @@ class VisionTransformerCE(VisionTransformer):
         removed_indexes_s = []
         removed_flag = False
         for i, blk in enumerate(self.blocks):
-            '''
-            add parameters prompt from 1th layer
-            '''
-            #PROMPT
-            if i >= 1:
+            if self.training and i in self.grad_checkpoint_blocks and torch.is_grad_enabled():
+                # removed_indexes_s is copied, the recomputation in backward must not see the later layers
+                x, z_prompted, x_prompted, global_index_t, global_index_s, removed_index_s, attn = _checkpoint(
+                    self.forward_layer, i, x, z_prompted, x_prompted, global_index_t, global_index_s,
+                    list(removed_indexes_s), mask_x, ce_template_mask, ce_keep_rate)
+            else:
+                x, z_prompted, x_prompted, global_index_t, global_index_s, removed_index_s, attn = self.forward_layer(
+                    i, x, z_prompted, x_prompted, global_index_t, global_index_s, removed_indexes_s, mask_x,
+                    ce_template_mask, ce_keep_rate)
+
+            if self.ce_loc is not None and i in self.ce_loc:
+                removed_indexes_s.append(removed_index_s)
+
+        x = self.norm(x)
+        lens_z_new = global_index_t.shape[1]
+
+        z = x[:, :lens_z_new]
+        x = x[:, lens_z_new:]
+
+        # recover original token order
+        x = _restore_search_tokens(x, global_index_s, removed_indexes_s, lens_x)
+
+        x = recover_tokens(x, lens_z_new, lens_x, mode=self.cat_mode)
+
+        # re-concatenate with the template, which may be further used by other modules
+        x = torch.cat([z, x], dim=1)
+
+        aux_dict = {
+            "attn": attn,
+            "removed_indexes_s": removed_indexes_s,  # used for visualization
+        }
+
+        return x, aux_dict
+
+    def forward_layer(self, i, x, z_prompted, x_prompted, global_index_t, global_index_s, removed_indexes_s,
+                      mask_x=None, ce_template_mask=None, ce_keep_rate=None):
+        """ Layer i of the backbone: the prompt block (from the 1th layer) followed by the CEBlock. The candidate
+        elimination state (global_index_t/s, removed_indexes_s) is passed in and returned explicitly, so that the
+        layer can be recomputed by activation checkpointing. """
+        lens_z = self.pos_embed_z.shape[1]
+        lens_x = self.pos_embed_x.shape[1]
+        '''
+        add parameters prompt from 1th layer
+        '''
+        #PROMPT
+        if i >= 1:
+            with stage_timer.timed('prompt_blocks'):
                 if self.prompt_type in ['rdtt_deep']:
                     x_ori = x
                     # recover x to go through prompt blocks
                     lens_z_new = global_index_t.shape[1]
-                    lens_x_new = global_index_s.shape[1]
                     z = x[:, :lens_z_new]
                     x = x[:, lens_z_new:]
-                    if removed_indexes_s and removed_indexes_s[0] is not None:
-                        removed_indexes_cat = torch.cat(removed_indexes_s, dim=1)
-                        pruned_lens_x = lens_x - lens_x_new
-                        pad_x = torch.zeros([B, pruned_lens_x, x.shape[2]], device=x.device)
-                        x = torch.cat([x, pad_x], dim=1)
-                        index_all = torch.cat([global_index_s, removed_indexes_cat], dim=1)
-                        C = x.shape[-1]
-                        x = torch.zeros_like(x).scatter_(dim=1, index=index_all.unsqueeze(-1).expand(B, -1, C).to(torch.int64), src=x)
+                    x = _restore_search_tokens(x, global_index_s, removed_indexes_s, lens_x)
                     x = recover_tokens(x, lens_z_new, lens_x, mode=self.cat_mode)
                     x = torch.cat([z, x], dim=1)
 
@@ -351,41 +426,10 @@ class VisionTransformerCE(VisionTransformer):
                     # re-conduct CE
                     x = x_ori + candidate_elimination_prompt(x, global_index_t.shape[1], global_index_s)
 
+        with stage_timer.timed(self._block_timer_names[i]):
             x, global_index_t, global_index_s, removed_index_s, attn = \
-                blk(x, global_index_t, global_index_s, mask_x, ce_template_mask, ce_keep_rate)
-
-            if self.ce_loc is not None and i in self.ce_loc:
-                removed_indexes_s.append(removed_index_s)
-
-        x = self.norm(x)
-        lens_x_new = global_index_s.shape[1]
-        lens_z_new = global_index_t.shape[1]
-
-        z = x[:, :lens_z_new]
-        x = x[:, lens_z_new:]
-
-        if removed_indexes_s and removed_indexes_s[0] is not None:
-            removed_indexes_cat = torch.cat(removed_indexes_s, dim=1)
-
-            pruned_lens_x = lens_x - lens_x_new
-            pad_x = torch.zeros([B, pruned_lens_x, x.shape[2]], device=x.device)
-            x = torch.cat([x, pad_x], dim=1)
-            index_all = torch.cat([global_index_s, removed_indexes_cat], dim=1)
-            # recover original token order
-            C = x.shape[-1]
-            x = torch.zeros_like(x).scatter_(dim=1, index=index_all.unsqueeze(-1).expand(B, -1, C).to(torch.int64), src=x)
-
-        x = recover_tokens(x, lens_z_new, lens_x, mode=self.cat_mode)
-
-        # re-concatenate with the template, which may be further used by other modules
-        x = torch.cat([z, x], dim=1)
-
-        aux_dict = {
-            "attn": attn,
-            "removed_indexes_s": removed_indexes_s,  # used for visualization
-        }
-
-        return x, aux_dict
+                self.blocks[i](x, global_index_t, global_index_s, mask_x, ce_template_mask, ce_keep_rate)
+        return x, z_prompted, x_prompted, global_index_t, global_index_s, removed_index_s, attn
 
     def forward(self, z, x, ce_template_mask=None, ce_keep_rate=None,
                 tnc_keep_rate=None,
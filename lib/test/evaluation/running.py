@@ -1,5 +1,6 @@
 import numpy as np
 import multiprocessing
+import json
 import os
 import sys
 from itertools import product
@@ -100,6 +101,16 @@ def _save_tracker_output(seq: Sequence, tracker: Tracker, output: dict):
                 timings_file = '{}_time.txt'.format(base_results_path)
                 save_time(timings_file, data)
 
+        if key == 'stage_times':
+            # per-stage latency statistics and histograms of the sequence, next to the _time.txt
+            with open('{}_stage_times.json'.format(base_results_path), 'w') as f:
+                json.dump(data, f, indent=2)
+
+        if key == 'speculation':
+            # hits and re-crops of the speculative search crops (TEST.SPECULATIVE_CROP)
+            with open('{}_speculation.json'.format(base_results_path), 'w') as f:
+                json.dump(data, f, indent=2)
+
 
 def run_sequence(seq: Sequence, tracker: Tracker, debug=False, num_gpu=8):
     """Runs a tracker on a sequence."""
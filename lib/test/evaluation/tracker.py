@@ -1,11 +1,14 @@
 import importlib
 import os
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from lib.test.evaluation.environment import env_settings
 import time
 import cv2 as cv
 from pathlib import Path
 import numpy as np
+from lib.utils import stage_timer
+from lib.utils.profiling import StepProfiler
 
 def trackerlist(name: str, parameter_name: str, dataset_name: str, run_ids = None, display_name: str = None,
                 result_only=False):
@@ -122,33 +125,70 @@ class Tracker:
             init_default['all_boxes'] = out['all_boxes']
             init_default['all_scores'] = out['all_scores']
         _store_outputs(out, init_default)
-        for frame_num, frame_path in enumerate(seq.frames[1:], start=1):
-            image = self._read_rgbdt_image(frame_path)
-            start_time = time.time()
-            info = seq.frame_info(frame_num)
-            info['previous_output'] = prev_output
-            if len(seq.ground_truth_rect) > 1:
-                info['gt_bbox'] = seq.ground_truth_rect[frame_num]
-            out = self.tracker.track(image, info)
-            prev_output = OrderedDict(out)
-            _store_outputs(out, {'time': time.time() - start_time})
-
-            pred_bbox = out['target_bbox']
-            pred_bbox = list(map(int, pred_bbox))
-            im_vis = cv.cvtColor(image[:,:,:3], cv.COLOR_BGR2RGB)
-            pred_bbox = list(map(int, pred_bbox))
-            cv.rectangle(im_vis, (int(pred_bbox[0]), int(pred_bbox[1])),
-                         (int(pred_bbox[0] + pred_bbox[2]), int(pred_bbox[1] + pred_bbox[3])), (0, 0, 255), 3)
-            # print(pred_bbox[0], pred_bbox[1], pred_bbox[0] + pred_bbox[2], pred_bbox[1] + pred_bbox[3])
-            cv.putText(im_vis, str(frame_num), (40, 40), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
-            cv.imshow('UnTrack', cv.resize(im_vis, (640, 480)))
-            cv.waitKey(1)
+        # stage latencies of the tracked frames only
+        stage_timer.pop_records()
+        # torch.profiler capture of the frames params.profile_steps ('start:stop') of the sequence
+        profiler = StepProfiler(getattr(self.params, 'profile_steps', None),
+                                os.path.join(self.results_dir, 'profiles'), seq.name.replace('/', '_'))
+        # pipelined mode: the next frame is read and cropped around the predicted state in a worker thread during
+        # the tracking of the current frame, see RDTTrack.speculate
+        executor = ThreadPoolExecutor(max_workers=1) if getattr(self.tracker, 'speculative_crop', False) else None
+        try:
+            pending = None
+            for frame_num, frame_path in enumerate(seq.frames[1:], start=1):
+                profiler.step(frame_num)
+                if pending is not None:
+                    image, speculative = pending.result()
+                else:
+                    image, speculative = self._read_rgbdt_image(frame_path), None
+                start_time = time.time()
+                info = seq.frame_info(frame_num)
+                info['previous_output'] = prev_output
+                if len(seq.ground_truth_rect) > 1:
+                    info['gt_bbox'] = seq.ground_truth_rect[frame_num]
+                if executor is not None:
+                    pending = None
+                    if frame_num + 1 < len(seq.frames):
+                        pending = executor.submit(self._speculate, seq.frames[frame_num + 1], self.tracker.predict_state())
+                    out = self.tracker.track(image, info, speculative=speculative)
+                else:
+                    out = self.tracker.track(image, info)
+                prev_output = OrderedDict(out)
+                _store_outputs(out, {'time': time.time() - start_time})
+
+                pred_bbox = out['target_bbox']
+                pred_bbox = list(map(int, pred_bbox))
+                im_vis = cv.cvtColor(image[:,:,:3], cv.COLOR_BGR2RGB)
+                pred_bbox = list(map(int, pred_bbox))
+                cv.rectangle(im_vis, (int(pred_bbox[0]), int(pred_bbox[1])),
+                             (int(pred_bbox[0] + pred_bbox[2]), int(pred_bbox[1] + pred_bbox[3])), (0, 0, 255), 3)
+                # print(pred_bbox[0], pred_bbox[1], pred_bbox[0] + pred_bbox[2], pred_bbox[1] + pred_bbox[3])
+                cv.putText(im_vis, str(frame_num), (40, 40), cv.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 255), 2)
+                cv.imshow('UnTrack', cv.resize(im_vis, (640, 480)))
+                cv.waitKey(1)
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        profiler.close()
+        if executor is not None:
+            stats = dict(self.tracker.speculation_stats)
+            stats['hit_rate'] = stats['hits'] / max(1, stats['hits'] + stats['recrops'])
+            output['speculation'] = stats
+            print('%s speculative crops: %d hits, %d re-crops (hit rate %.1f%%)' % (
+                seq.name, stats['hits'], stats['recrops'], 100 * stats['hit_rate']))
 
         for key in ['target_bbox', 'all_boxes', 'all_scores']:
             if key in output and len(output[key]) <= 1:
                 output.pop(key)
+        if getattr(self.tracker, 'stage_timers', False):
+            output['stage_times'] = stage_timer.report(stage_timer.pop_records())
         return output
 
+    def _speculate(self, frame_path, box):
+        image = self._read_rgbdt_image(frame_path)
+        return image, self.tracker.speculate(image, box)
+
     def run_video(self, videofilepath, optional_box=None, debug=None, visdom_info=None, save_results=False):
         """Run the tracker with the vieofile.
         args:
@@ -276,13 +316,19 @@ class Tracker:
         image = cv.imread(image_file['color'])
         color_image = cv.cvtColor(image, cv.COLOR_BGR2RGB)
         depth_image = cv.imread(image_file['depth'], -1)
-        depth_image = cv.normalize(depth_image, None, alpha=0, beta=255, norm_type=cv.NORM_MINMAX, dtype=cv.CV_32F)
-        depth_image = np.asarray(depth_image, dtype=np.uint8)
-        depth_image = cv.applyColorMap(depth_image, cv.COLORMAP_JET)
         infrared_image = cv.imread(image_file['infrared'], -1)
         infrared_image = cv.cvtColor(infrared_image, cv.COLOR_BGR2RGB)
-        img = cv.merge((color_image, depth_image, infrared_image))
-        return img
+        return merge_rgbdt_image(color_image, depth_image, infrared_image)
+
+
+def merge_rgbdt_image(color_image, depth_image, infrared_image):
+    """ 9-channel tracker input of the RGB colour, the raw depth and the RGB infrared images of a frame. The depth is
+    min-max normalized and colour mapped. """
+    depth_image = cv.normalize(depth_image, None, alpha=0, beta=255, norm_type=cv.NORM_MINMAX, dtype=cv.CV_32F)
+    depth_image = np.asarray(depth_image, dtype=np.uint8)
+    depth_image = cv.applyColorMap(depth_image, cv.COLORMAP_JET)
+    img = cv.merge((color_image, depth_image, infrared_image))
+    return img
 
 
 
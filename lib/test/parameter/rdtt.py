@@ -23,6 +23,13 @@ def parameters(yaml_name: str, epoch=None):
     # Network checkpoint path
     # params.checkpoint = os.path.join(save_dir, "checkpoints/train/rdtt/%s/RDTTrack_ep%04d.pth.tar" % (yaml_name, epoch))
     params.checkpoint = os.path.join(save_dir, "RDTTrack.pth.tar")
+    # base (OSTrack) weights of a delta checkpoint, None uses the path stored in the checkpoint
+    params.base_checkpoint = None
+    # serve several fine-tunes with one backbone: {adapter name: checkpoint path}, and the adapter of this tracker
+    params.adapters = None
+    params.adapter = None
+    # torch.profiler capture of the frames 'start:stop' of each sequence
+    params.profile_steps = getattr(cfg.TEST, "PROFILE_STEPS", "")
 
 
     params.save_all_boxes = False
@@ -13,16 +13,21 @@ class Preprocessor(object):
         return img_tensor_norm
 
 class PreprocessorMM(object):
-    def __init__(self):
-        self.mean = torch.tensor([0.485, 0.456, 0.406, 0.485, 0.456, 0.406, 0.485, 0.456, 0.406]).view((1, 9, 1, 1)).cuda()
-        self.std = torch.tensor([0.229, 0.224, 0.225, 0.229, 0.224, 0.225, 0.229, 0.224, 0.225]).view((1, 9, 1, 1)).cuda()
+    def __init__(self, device='cuda'):
+        self.device = torch.device(device)
+        self.mean = torch.tensor([0.485, 0.456, 0.406, 0.485, 0.456, 0.406, 0.485, 0.456, 0.406]).view((1, 9, 1, 1)).to(self.device)
+        self.std = torch.tensor([0.229, 0.224, 0.225, 0.229, 0.224, 0.225, 0.229, 0.224, 0.225]).view((1, 9, 1, 1)).to(self.device)
 
     def process(self, img_arr: np.ndarray):
         # Deal with the image patch
-        img_tensor = torch.tensor(img_arr).cuda().float().permute((2,0,1)).unsqueeze(dim=0)
+        img_tensor = torch.tensor(img_arr).to(self.device).float().permute((2,0,1)).unsqueeze(dim=0)
         img_tensor_norm = ((img_tensor / 255.0) - self.mean) / self.std  # (1,6,H,W)
         return img_tensor_norm
 
+    def process_tensor(self, img_tensor: torch.Tensor):
+        # Deal with an image patch already on the device, (1,C,H,W) float in [0, 255]
+        return ((img_tensor / 255.0) - self.mean) / self.std
+
 
 class PreprocessorX(object):
     def __init__(self):
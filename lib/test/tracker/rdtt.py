@@ -1,32 +1,69 @@
 import math
 import os
+import time
 
-from lib.models.rdtt import build_rdttrack
+import numpy as np
+
+from lib.models.rdtt import build_rdttrack, get_multi_adapter_rdttrack
+from lib.models.layers.head import CenterPredictor, FusedCenterPredictor, SparseCenterPredictor
 from lib.test.tracker.basetracker import BaseTracker
 import torch
 from lib.test.tracker.vis_utils import gen_visualization
 from lib.test.utils.hann import hann2d
-from lib.train.data.processing_utils import sample_target
+from lib.train.data.processing_utils import sample_target, sample_target_torch, sample_target_warp
 import cv2
 from lib.test.tracker.data_utils import PreprocessorMM
-from lib.utils.box_ops import clip_box
+from lib.utils.box_ops import clip_box_tensor
 from lib.utils.ce_utils import generate_mask_cond
+from lib.utils import amp_utils, ckpt_utils, stage_timer
+
+
+# compiled networks of the process by configuration (TEST.COMPILE)
+_compiled_networks = {}
 
 
 class RDTTrack(BaseTracker):
     def __init__(self, params):
         super(RDTTrack, self).__init__(params)
-        network = build_rdttrack(params.cfg, training=False)
-        network.load_state_dict(torch.load(self.params.checkpoint, map_location='cpu')['net'], strict=True)
         self.cfg = params.cfg
-        self.network = network.cuda()
-        self.network.eval()
-        self.preprocessor = PreprocessorMM()
-        self.state = None
-
+        self.device = torch.device(getattr(self.cfg.TEST, "DEVICE", "cuda"))
+        # autocast precision of the network, the box decoding stays in fp32
+        self.precision = amp_utils.check_precision(getattr(self.cfg.TEST, "PRECISION", "fp32"))
+        self.preprocessor = PreprocessorMM(self.device)
+        # opencv: sample_target, warp: sample_target_warp on the host, torch: sample_target_torch on the device
+        self.crop_backend = getattr(self.cfg.TEST, "CROP_BACKEND", "opencv")
+        if self.crop_backend not in ('opencv', 'warp', 'torch'):
+            raise ValueError("Unknown crop backend '{}', expected opencv, warp or torch".format(self.crop_backend))
+        self._search_buffer = None
+        # speculative search crops of the next frame around a predicted state (see speculate), accepted if the state
+        # moved by at most SPECULATIVE_TOLERANCE times the crop size
+        self.speculative_crop = getattr(self.cfg.TEST, "SPECULATIVE_CROP", False)
+        self.speculative_tolerance = getattr(self.cfg.TEST, "SPECULATIVE_TOLERANCE", 0.05)
+        self.speculation_stats = {'hits': 0, 'recrops': 0}
+        adapters = getattr(params, 'adapters', None)
+        # several fine-tunes served with one backbone, this tracker runs the adapter params.adapter
+        self.adapter = (getattr(params, 'adapter', None) or next(iter(adapters))) if adapters else None
+        self.forward_kwargs = {'adapter': self.adapter} if adapters else {}
         self.feat_sz = self.cfg.TEST.SEARCH_SIZE // self.cfg.MODEL.BACKBONE.STRIDE
         # motion constrain
-        self.output_window = hann2d(torch.tensor([self.feat_sz, self.feat_sz]).long(), centered=True).cuda()
+        self.output_window = hann2d(torch.tensor([self.feat_sz, self.feat_sz]).long(), centered=True).to(self.device)
+        # static-shape torch.compile of the network. The compiled network is built, compiled and warmed up once per
+        # configuration, then shared by the trackers of the process (i.e. of all the sequences)
+        self.compile_mode = None
+        if getattr(self.cfg.TEST, "COMPILE", False):
+            self.compile_mode = getattr(self.cfg.TEST, "COMPILE_MODE", "default")
+            key = (repr(self.cfg), params.checkpoint, getattr(params, 'base_checkpoint', None),
+                   tuple(adapters.items()) if adapters else None, str(self.device), self.precision, self.compile_mode)
+            if key not in _compiled_networks:
+                _compiled_networks[key] = self._compile_network(self._build_network(params))
+            self.network = _compiled_networks[key]
+        else:
+            self.network = self._build_network(params)
+        self.state = None
+        # per-stage latency records (lib.utils.stage_timer), collected per sequence by the evaluation
+        self.stage_timers = getattr(self.cfg.TEST, "STAGE_TIMERS", False)
+        if self.stage_timers:
+            stage_timer.enable(sync_device=self.device)
 
         # for debug
         if getattr(params, 'debug', None) is None:
@@ -37,12 +74,54 @@ class RDTTrack(BaseTracker):
         # for save boxes from all queries
         self.save_all_boxes = params.save_all_boxes
 
+    def _build_network(self, params):
+        adapters = getattr(params, 'adapters', None)
+        if adapters:
+            network = get_multi_adapter_rdttrack(params.cfg, adapters, getattr(params, 'base_checkpoint', None))
+        else:
+            network = build_rdttrack(params.cfg, training=False)
+            # full checkpoint, or base weights + delta checkpoint. Without checkpoint (benchmarks) the weights stay
+            # as initialized
+            if params.checkpoint:
+                ckpt_utils.load_network(network, params.checkpoint, getattr(params, 'base_checkpoint', None))
+        # the multi-adapter networks share the box head of their base network
+        base_network = network.net if adapters else network
+        if type(base_network.box_head) is CenterPredictor:
+            # motion constrain on the boxes decoded in the forward
+            base_network.box_head.set_score_window(self.output_window.cpu())
+            if getattr(self.cfg.TEST, "SPARSE_HEAD", False):
+                base_network.box_head = SparseCenterPredictor(base_network.box_head)
+            elif getattr(self.cfg.TEST, "FUSE_HEAD", False):
+                base_network.box_head = FusedCenterPredictor(base_network.box_head,
+                                                             getattr(self.cfg.TEST, "HEAD_CHANNELS_LAST", False))
+        network = network.to(self.device)
+        network.eval()
+        return network
+
+    def _compile_network(self, network):
+        """ torch.compile the network with static shapes and run it on dummy template and search crops, so that the
+        graph is compiled before the first frame. Other batch sizes (track_batch) are compiled on their first call. """
+        network = torch.compile(network, mode=self.compile_mode, dynamic=False)
+        template = self.preprocessor.process(np.zeros((self.params.template_size, self.params.template_size, 9),
+                                                      dtype=np.uint8))
+        search = self.preprocessor.process(np.zeros((self.params.search_size, self.params.search_size, 9),
+                                                    dtype=np.uint8))
+        box_mask_z = None
+        if self.cfg.MODEL.BACKBONE.CE_LOC:
+            box_mask_z = generate_mask_cond(self.cfg, 1, self.device,
+                                            torch.tensor([[0.25, 0.25, 0.5, 0.5]], device=self.device))
+        with torch.no_grad(), amp_utils.autocast(self.device, self.precision):
+            for _ in range(2):
+                network.forward(template=template, search=search, ce_template_mask=box_mask_z, **self.forward_kwargs)
+        return network
+
     def initialize(self, image, info: dict):
         # forward the template once
-        z_patch_arr, resize_factor, z_amask_arr  = sample_target(image, info['init_bbox'], self.params.template_factor,
-                                                    output_sz=self.params.template_size)
-        self.z_patch_arr = z_patch_arr
-        template = self.preprocessor.process(z_patch_arr)
+        template, resize_factor = self.sample_patch(image, info['init_bbox'], self.params.template_factor,
+                                                    self.params.template_size)
+        if self.crop_backend == 'warp':
+            self._search_buffer = np.empty((self.params.search_size, self.params.search_size, image.shape[2]),
+                                           dtype=image.dtype)
         with torch.no_grad():
             self.z_tensor = template
 
@@ -54,37 +133,103 @@ class RDTTrack(BaseTracker):
 
         # save states
         self.state = info['init_bbox']
+        self.prev_state = self.state
         self.frame_id = 0
+        self.speculation_stats = {'hits': 0, 'recrops': 0}
         if self.save_all_boxes:
             '''save all predicted boxes'''
             all_boxes_save = info['init_bbox'] * self.cfg.MODEL.NUM_OBJECT_QUERIES
             return {"all_boxes": all_boxes_save}
 
-    def track(self, image, info: dict = None):
-        H, W, _ = image.shape
-        self.frame_id += 1
-        x_patch_arr, resize_factor, x_amask_arr = sample_target(image, self.state, self.params.search_factor,
-                                                                output_sz=self.params.search_size)  # (x1, y1, w, h)
-        search = self.preprocessor.process(x_patch_arr)
+    def track(self, image, info: dict = None, speculative=None):
+        search, resize_factor = self.crop_search(image, speculative)
 
-        with torch.no_grad():
+        with torch.no_grad(), amp_utils.autocast(self.device, self.precision):
             x_tensor = search
             # merge the template and the search
             # run the transformer
-            out_dict = self.network.forward(
-                template=self.z_tensor, search=x_tensor, ce_template_mask=self.box_mask_z)
-
-        # add hann windows
-        pred_score_map = out_dict['score_map']
-        response = self.output_window * pred_score_map
-        pred_boxes, best_score = self.network.box_head.cal_bbox(response, out_dict['size_map'], out_dict['offset_map'], return_score=True)
-        max_score = best_score[0][0].item()
-        pred_boxes = pred_boxes.view(-1, 4)
-        # Baseline: Take the mean of all pred boxes as the final result
-        pred_box = (pred_boxes.mean(
-            dim=0) * self.params.search_size / resize_factor).tolist()  # (cx, cy, w, h) [0,1]
-        # get the final box result
-        self.state = clip_box(self.map_box_back(pred_box, resize_factor), H, W, margin=10)
+            with stage_timer.timed('network'):
+                out_dict = self.network.forward(
+                    template=self.z_tensor, search=x_tensor, ce_template_mask=self.box_mask_z, **self.forward_kwargs)
+
+        return self.update_state(image, out_dict, resize_factor)
+
+    def crop_search(self, image, speculative=None):
+        """ Search region of the next frame around the current state, or the speculative crop of the frame (see
+        speculate) if it is close enough. returns the search tensor (1, C, H, W) and the resize factor of the crop. """
+        self.frame_id += 1
+        if speculative is not None:
+            box, search, resize_factor, crop_time = speculative
+            # recorded here, the stage timer records are not shared with the thread of speculate
+            stage_timer.add_record('speculative_crop', crop_time)
+            if self._accept_speculation(box):
+                self.speculation_stats['hits'] += 1
+                # the boxes of the frame are mapped back from the crop around the predicted box
+                self.crop_state = box
+                return search, resize_factor
+            self.speculation_stats['recrops'] += 1
+        self.crop_state = self.state
+        search, resize_factor = self.sample_patch(image, self.state, self.params.search_factor,
+                                                  self.params.search_size, self._search_buffer)
+        return search, resize_factor
+
+    def predict_state(self):
+        """ Constant velocity guess of the state after the next frame, from the two last states. """
+        (x0, y0, w0, h0), (x1, y1, w1, h1) = self.prev_state, self.state
+        return [2 * x1 - x0 + 0.5 * (w1 - w0), 2 * y1 - y0 + 0.5 * (h1 - h0), w1, h1]
+
+    def speculate(self, image, box):
+        """ Speculative search crop of image around box (predict_state), to be passed to track with image. It can run
+        in another thread than track, e.g. to crop the next frame during the forward of the current one, so it does
+        not use the stage timers (nor synchronize the device): its host time is recorded by track. """
+        start = time.perf_counter()
+        patch, resize_factor = self._crop(image, box, self.params.search_factor, self.params.search_size)
+        search = self._preprocess(patch)
+        return box, search, resize_factor, time.perf_counter() - start
+
+    def _accept_speculation(self, box):
+        crop_sz = math.sqrt(self.state[2] * self.state[3]) * self.params.search_factor
+        box_crop_sz = math.sqrt(box[2] * box[3]) * self.params.search_factor
+        shift = max(abs(self.state[0] + 0.5 * self.state[2] - box[0] - 0.5 * box[2]),
+                    abs(self.state[1] + 0.5 * self.state[3] - box[1] - 0.5 * box[3]))
+        tolerance = self.speculative_tolerance * crop_sz
+        return shift <= tolerance and abs(box_crop_sz - crop_sz) <= tolerance
+
+    def sample_patch(self, image, box, factor, output_sz, out=None):
+        """ Normalized (1, C, output_sz, output_sz) crop of image around box on the device, with the crop backend
+        TEST.CROP_BACKEND, and its resize factor. out is an optional preallocated crop buffer of the warp backend. """
+        with stage_timer.timed('sample_target'):
+            patch, resize_factor = self._crop(image, box, factor, output_sz, out)
+        with stage_timer.timed('preprocess'):
+            return self._preprocess(patch), resize_factor
+
+    def _crop(self, image, box, factor, output_sz, out=None):
+        if self.crop_backend == 'torch':
+            return sample_target_torch(image, box, factor, output_sz, device=self.device)
+        if self.crop_backend == 'warp':
+            return sample_target_warp(image, box, factor, output_sz, out=out)
+        patch, resize_factor, _ = sample_target(image, box, factor, output_sz=output_sz)
+        return patch, resize_factor
+
+    def _preprocess(self, patch):
+        if self.crop_backend == 'torch':
+            return self.preprocessor.process_tensor(patch)
+        return self.preprocessor.process(patch)
+
+    def update_state(self, image, out_dict, resize_factor):
+        """ Decode the box of the network outputs of the search region of image and update the state. """
+        H, W, _ = image.shape
+        with stage_timer.timed('cal_bbox'):
+            # boxes decoded by the head on the hann weighted score map (set_score_window), in fp32 on the device
+            pred_boxes = out_dict['pred_boxes'].view(-1, 4).float()
+            # Baseline: Take the mean of all pred boxes as the final result
+            pred_box = pred_boxes.mean(dim=0) * self.params.search_size / resize_factor  # (cx, cy, w, h)
+        # get the final box result, the only transfer to the host of the frame
+        with stage_timer.timed('map_box_back'):
+            state = clip_box_tensor(self.map_box_back_batch(pred_box, resize_factor), H, W, margin=10)
+            self.prev_state, self.state = self.state, state.tolist()
+        if self.debug == 1 or self.save_all_boxes:
+            max_score = (self.output_window * out_dict['score_map']).flatten(1).max().item()
 
         # for debug
         if self.debug == 1:
@@ -108,7 +253,8 @@ class RDTTrack(BaseTracker):
             return {"target_bbox": self.state}
 
     def map_box_back(self, pred_box: list, resize_factor: float):
-        cx_prev, cy_prev = self.state[0] + 0.5 * self.state[2], self.state[1] + 0.5 * self.state[3]
+        cx_prev = self.crop_state[0] + 0.5 * self.crop_state[2]
+        cy_prev = self.crop_state[1] + 0.5 * self.crop_state[3]
         cx, cy, w, h = pred_box
         half_side = 0.5 * self.params.search_size / resize_factor
         cx_real = cx + (cx_prev - half_side)
@@ -116,7 +262,8 @@ class RDTTrack(BaseTracker):
         return [cx_real - 0.5 * w, cy_real - 0.5 * h, w, h]
 
     def map_box_back_batch(self, pred_box: torch.Tensor, resize_factor: float):
-        cx_prev, cy_prev = self.state[0] + 0.5 * self.state[2], self.state[1] + 0.5 * self.state[3]
+        cx_prev = self.crop_state[0] + 0.5 * self.crop_state[2]
+        cy_prev = self.crop_state[1] + 0.5 * self.crop_state[3]
         cx, cy, w, h = pred_box.unbind(-1) # (N,4) --> (N,)
         half_side = 0.5 * self.params.search_size / resize_factor
         cx_real = cx + (cx_prev - half_side)
@@ -124,5 +271,35 @@ class RDTTrack(BaseTracker):
         return torch.stack([cx_real - 0.5 * w, cy_real - 0.5 * h, w, h], dim=-1)
 
 
+def track_batch(trackers, images):
+    """ Track one frame per tracker with a single batched forward of the network. The trackers share the network (and
+    its configuration), e.g. shallow copies of an initialized tracker.
+    args:
+        trackers - list of initialized RDTTrack.
+        images - the next frame of each tracker.
+    returns:
+        list of the outputs of the trackers, as returned by track.
+    """
+    tracker = trackers[0]
+    crops = [t.crop_search(image) for t, image in zip(trackers, images)]
+    template = torch.cat([t.z_tensor for t in trackers])
+    search = torch.cat([x_tensor for x_tensor, _ in crops])
+    box_mask_z = None if tracker.box_mask_z is None else torch.cat([t.box_mask_z for t in trackers])
+    forward_kwargs = {'adapter': [t.adapter for t in trackers]} if tracker.adapter is not None else {}
+
+    with torch.no_grad(), amp_utils.autocast(tracker.device, tracker.precision):
+        with stage_timer.timed('network'):
+            out_dict = tracker.network.forward(template=template, search=search, ce_template_mask=box_mask_z,
+                                               **forward_kwargs)
+
+    batch_size = len(trackers)
+    outputs = []
+    for i, (t, image, (_, resize_factor)) in enumerate(zip(trackers, images, crops)):
+        out_i = {k: v[i:i + 1] for k, v in out_dict.items()
+                 if torch.is_tensor(v) and v.dim() > 0 and v.shape[0] == batch_size}
+        outputs.append(t.update_state(image, out_i, resize_factor))
+    return outputs
+
+
 def get_tracker_class():
     return RDTTrack
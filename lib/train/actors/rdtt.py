@@ -91,8 +91,7 @@ class RDTTActor(BaseActor):
 
         # Get boxes
         pred_boxes = pred_dict['pred_boxes']
-        if torch.isnan(pred_boxes).any():
-            raise ValueError("Network outputs is NAN! Stop Training")
+        # NaN outputs give a non-finite loss, which the trainer checks when it reads the statistics back
         num_queries = pred_boxes.size(1)
         pred_boxes_vec = box_cxcywh_to_xyxy(pred_boxes).view(-1, 4)  # (B,N,4) --> (BN,4) (x1,y1,x2,y2)
         gt_boxes_vec = box_xywh_to_xyxy(gt_bbox)[:, None, :].repeat((1, num_queries, 1)).view(-1, 4).clamp(min=0.0,
@@ -101,7 +100,7 @@ class RDTTActor(BaseActor):
         try:
             giou_loss, iou = self.objective['giou'](pred_boxes_vec, gt_boxes_vec)  # (BN,4) (BN,4)
         except:
-            giou_loss, iou = torch.tensor(0.0).cuda(), torch.tensor(0.0).cuda()
+            giou_loss, iou = torch.tensor(0.0, device=pred_boxes.device), torch.tensor(0.0, device=pred_boxes.device)
         # compute l1 loss
         l1_loss = self.objective['l1'](pred_boxes_vec, gt_boxes_vec)  # (BN,4) (BN,4)
         # compute location loss
@@ -112,13 +111,13 @@ class RDTTActor(BaseActor):
         # weighted sum
         loss = self.loss_weight['giou'] * giou_loss + self.loss_weight['l1'] * l1_loss + self.loss_weight['focal'] * location_loss
         if return_status:
-            # status for log
+            # status for log, kept on the device (no .item() sync, see LTRTrainer._update_stats)
             mean_iou = iou.detach().mean()
-            status = {"Loss/total": loss.item(),
-                      "Loss/giou": giou_loss.item(),
-                      "Loss/l1": l1_loss.item(),
-                      "Loss/location": location_loss.item(),
-                      "IoU": mean_iou.item()}
+            status = {"Loss/total": loss.detach(),
+                      "Loss/giou": giou_loss.detach(),
+                      "Loss/l1": l1_loss.detach(),
+                      "Loss/location": location_loss.detach(),
+                      "IoU": mean_iou}
             return loss, status
         else:
             return loss
\ No newline at end of file
@@ -1,3 +1,5 @@
 from .environment import env_settings, create_default_local_file_train
 from .tensorboard import TensorboardWriter
-from .stats import AverageMeter, StatValue
\ No newline at end of file
+from .stats import AverageMeter, StatValue
+from .async_writer import AsyncWriter
+from .telemetry import Telemetry, loader_queue_depth
@@ -0,0 +1,54 @@
+import queue
+import threading
+
+
+def _append_text(path, text):
+    with open(path, 'a') as f:
+        f.write(text)
+
+
+class AsyncWriter:
+    """ Runs file writes in a background thread, so that the training loop does not wait for the disk.
+
+    The jobs are run in submission order. flush() blocks until all the submitted jobs are done. An exception raised by
+    a job is re-raised by the next call to submit() or flush().
+    """
+
+    def __init__(self, max_pending=0):
+        """
+        args:
+            max_pending - Maximum number of queued jobs, submit() blocks when it is reached. 0 means unbounded.
+        """
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def submit(self, fn, *args, **kwargs):
+        """ Queue the call fn(*args, **kwargs). """
+        self._raise_error()
+        self._queue.put((fn, args, kwargs))
+
+    def append_text(self, path, text):
+        """ Queue the appending of text to the file path. """
+        self.submit(_append_text, path, text)
+
+    def flush(self):
+        """ Wait for all the queued jobs. """
+        self._queue.join()
+        self._raise_error()
@@ -63,6 +63,7 @@ def create_default_local_file_train(workspace_dir, data_dir):
         'lasher_dir': os.path.join(data_dir, 'lasher/trainingset'),
         'visevent_dir': os.path.join(data_dir, 'visevent/train'),
         'rgbdt_dir': os.path.join(data_dir, 'rgbdt_dir/train'),
+        'rgbdt_lmdb_dir': os.path.join(data_dir, 'rgbdt_lmdb/train'),
     })
 
     comment = {'workspace_dir': 'Base directory for saving network checkpoints.',
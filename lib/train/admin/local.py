@@ -16,3 +16,4 @@ class EnvironmentSettings:
         self.lasher_dir = '/data_A/xuefeng/2025NeurIPS/RDTTrack/data/lasher/trainingset'
         self.visevent_dir = '/data_A/xuefeng/2025NeurIPS/RDTTrack/data/visevent/train'
         self.rgbdt_dir = '/data_A/xuefeng/RGBDT500/Train_400'
+        self.rgbdt_lmdb_dir = '/data_A/xuefeng/RGBDT500/Train_400_lmdb'
@@ -0,0 +1,134 @@
+import collections
+import json
+import os
+import time
+
+import torch
+
+
+STAGES = ('data', 'h2d', 'forward', 'backward', 'optimizer', 'log')
+
+
+def loader_queue_depth(loader_iter):
+    """ Number of batches prefetched by the workers of a DataLoader iterator and not consumed yet. None for a
+    single-process loader, or when the queue size is not available (multiprocessing queues on macOS). """
+    data_queue = getattr(loader_iter, '_data_queue', None)
+    if data_queue is None or getattr(loader_iter, '_num_workers', 0) == 0:
+        return None
+    try:
+        depth = data_queue.qsize()
+    except NotImplementedError:
+        return None
+    # batches received out of order wait in _task_info until their turn
+    task_info = getattr(loader_iter, '_task_info', {})
+    return depth + sum(1 for info in task_info.values() if len(info) == 2)
+
+
+class Telemetry:
+    """ Per-iteration timings of the training loop, written as JSON lines and to tensorboard.
+
+    The loop calls begin() once, mark(stage) at the end of each stage (the time since the previous mark is added to the
+    stage) and end_iteration() at the end of each iteration. Stages are 'data' (waiting for the loader), 'h2d' (copy to
+    the device and device-side processing), 'forward', 'backward', 'optimizer' and 'log'. Without sync, the device
+    stages measure the time of the host, which waits for the device at the synchronizing calls only.
+
+    A data wait alert is raised when the 'data' stage takes more than data_wait_alert of the time of the last window
+    iterations. A disabled Telemetry does nothing.
+    """
+
+    def __init__(self, jsonl_path, log_writer, tensorboard_writer=None, enabled=True, sync=False, device=None,
+                 data_wait_alert=0.2, window=50, alert_file=None):
+        """
+        args:
+            jsonl_path - File the records are appended to.
+            log_writer - AsyncWriter used for the file writes.
+            tensorboard_writer - TensorboardWriter, or None.
+            enabled - Bool, a disabled Telemetry does nothing.
+            sync - Synchronize the device at each mark, so that the device stages are measured exactly (slower).
+            device - Device of the training.
+            data_wait_alert - Fraction of the time spent waiting for data above which an alert is raised. <= 0 disables.
+            window - Number of iterations the data wait fraction is computed on.
+            alert_file - Text file the alerts are also written to (the training log).
+        """
+        self.enabled = enabled
+        self.jsonl_path = jsonl_path
+        self.log_writer = log_writer
+        self.tensorboard_writer = tensorboard_writer
+        self.sync = sync and device is not None and torch.device(device).type == 'cuda'
+        self.device = device
+        self.data_wait_alert = data_wait_alert
+        self.window = window
+        self.alert_file = alert_file
+
+        self._last = None
+        self._times = None
+        self._recent = collections.deque(maxlen=window)
+        self._since_alert_check = 0
+        if self.enabled:
+            os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+
+    def begin(self):
+        """ Start timing, at the beginning of the loop before the first batch is requested. """
+        if not self.enabled:
+            return
+        self._times = dict.fromkeys(STAGES, 0.0)
+        self._last = time.perf_counter()
+
+    def mark(self, stage):
+        """ Add the time since the previous mark to stage. """
+        if not self.enabled:
+            return
+        if self.sync:
+            torch.cuda.synchronize(self.device)
+        now = time.perf_counter()
+        self._times[stage] += now - self._last
+        self._last = now
+
+    def end_iteration(self, loader_name, epoch, iteration, step, batch_size, queue_depth=None):
+        """ Write the record of the iteration and start timing the next one.
+        args:
+            step - Global iteration number, the tensorboard step.
+        """
+        if not self.enabled:
+            return
+        times = self._times
+        total = sum(times.values())
+        record = {'time': time.time(), 'loader': loader_name, 'epoch': epoch, 'iter': iteration, 'step': step,
+                  'batch_size': batch_size, 'queue_depth': queue_depth, 'total': total,
+                  'samples_per_s': batch_size / total if total > 0 else None}
+        record.update(times)
+        self.log_writer.append_text(self.jsonl_path, json.dumps(record) + '\n')
+
+        if self.tensorboard_writer is not None:
+            scalars = {'Time/' + stage: t for stage, t in times.items()}
+            if queue_depth is not None:
+                scalars['Loader/queue_depth'] = queue_depth
+            self.tensorboard_writer.write_scalars(loader_name, scalars, step)
+
+        self._recent.append((times['data'], total))
+        self._since_alert_check += 1
+        if self._since_alert_check >= self.window:
+            self._since_alert_check = 0
+            self._check_data_wait(loader_name, epoch, iteration, queue_depth)
+
+        self._times = dict.fromkeys(STAGES, 0.0)
+        self._last = time.perf_counter()
+
+    def _check_data_wait(self, loader_name, epoch, iteration, queue_depth):
+        if self.data_wait_alert <= 0:
+            return
+        data_time = sum(d for d, _ in self._recent)
+        total_time = sum(t for _, t in self._recent)
+        if total_time <= 0 or data_time / total_time <= self.data_wait_alert:
+            return
+        fraction = data_time / total_time
+        message = ('WARNING: [%s: %d, %d] the %s waited for data %.1f%% of the last %d iterations '
+                   '(threshold %.1f%%, loader queue depth %s). Add workers, use faster storage or change the batch '
+                   'size.' % (loader_name, epoch, iteration, 'GPU' if torch.device(self.device or 'cpu').type == 'cuda'
+                              else 'CPU', 100 * fraction, len(self._recent), 100 * self.data_wait_alert, queue_depth))
+        print(message)
+        alert = {'time': time.time(), 'alert': 'data_wait', 'loader': loader_name, 'epoch': epoch, 'iter': iteration,
+                 'fraction': fraction, 'threshold': self.data_wait_alert, 'queue_depth': queue_depth}
+        self.log_writer.append_text(self.jsonl_path, json.dumps(alert) + '\n')
+        if self.alert_file is not None:
+            self.log_writer.append_text(self.alert_file, message + '\n')
@@ -24,4 +24,8 @@ class TensorboardWriter:
                 continue
             for var_name, val in loader_stats.items():
                 if hasattr(val, 'history') and getattr(val, 'has_new_data', True):
-                    self.writer[loader_name].add_scalar(var_name, val.history[ind], epoch)
\ No newline at end of file
+                    self.writer[loader_name].add_scalar(var_name, val.history[ind], epoch)
+
+    def write_scalars(self, loader_name, scalars: dict, step: int):
+        for var_name, val in scalars.items():
+            self.writer[loader_name].add_scalar(var_name, val, step)
\ No newline at end of file
@@ -1,7 +1,10 @@
+import math
+import random
+import numpy as np
 import torch
 from torch.utils.data.distributed import DistributedSampler
 # datasets related
-from lib.train.dataset import RGBDT
+from lib.train.dataset import RGBDT, RGBDT_lmdb
 from lib.train.data import sampler, opencv_loader, processing, LTRLoader
 import lib.train.data.transforms as tfm
 from lib.utils.misc import is_main_process
@@ -22,6 +25,8 @@ def update_settings(settings, cfg):
     settings.batchsize = cfg.TRAIN.BATCH_SIZE
     settings.scheduler_type = cfg.TRAIN.SCHEDULER.TYPE
     settings.fix_bn = getattr(cfg.TRAIN, "FIX_BN", False) # add for fixing base model bn layer
+    settings.accum_steps = getattr(cfg.TRAIN, "ACCUM_STEPS", 1)
+    settings.telemetry = dict(getattr(cfg.TRAIN, "TELEMETRY", {}))
 
 
 def names2datasets(name_list: list, settings, image_loader):
@@ -31,7 +36,11 @@ def names2datasets(name_list: list, settings, image_loader):
         assert name in ["rgbdt"]
 
         if name == "rgbdt":
-            datasets.append(RGBDT(settings.env.rgbdt_dir, dtype='rgbcolormap'))
+            if getattr(settings, "use_lmdb", False):
+                print("Building rgbdt dataset from lmdb")
+                datasets.append(RGBDT_lmdb(settings.env.rgbdt_lmdb_dir, dtype='rgbcolormap'))
+            else:
+                datasets.append(RGBDT(settings.env.rgbdt_dir, dtype='rgbcolormap'))
 
     return datasets
 
@@ -53,23 +62,68 @@ def build_dataloaders(cfg, settings):
     output_sz = settings.output_sz
     search_area_factor = settings.search_area_factor
 
-    data_processing_train = processing.ViPTProcessing(search_area_factor=search_area_factor,
-                                                       output_sz=output_sz,
-                                                       center_jitter_factor=settings.center_jitter_factor,
-                                                       scale_jitter_factor=settings.scale_jitter_factor,
-                                                       mode='sequence',
-                                                       transform=transform_train,
-                                                       joint_transform=transform_joint,
-                                                       settings=settings)
-
-    data_processing_val = processing.ViPTProcessing(search_area_factor=search_area_factor,
-                                                     output_sz=output_sz,
-                                                     center_jitter_factor=settings.center_jitter_factor,
-                                                     scale_jitter_factor=settings.scale_jitter_factor,
-                                                     mode='sequence',
-                                                     transform=transform_val,
-                                                     joint_transform=transform_joint,
-                                                     settings=settings)
+    crop_on_device = getattr(cfg.DATA, "CROP_ON_DEVICE", False)
+    if crop_on_device:
+        # Workers only cut out the image regions, the crops/augmentations of a batch are done on the device
+        data_processing_train = processing.ViPTRoiProcessing(search_area_factor=search_area_factor,
+                                                              output_sz=output_sz,
+                                                              center_jitter_factor=settings.center_jitter_factor,
+                                                              scale_jitter_factor=settings.scale_jitter_factor,
+                                                              mode='sequence',
+                                                              brightness_jitter=0.2,
+                                                              joint_transform=transform_joint,
+                                                              settings=settings)
+
+        data_processing_val = processing.ViPTRoiProcessing(search_area_factor=search_area_factor,
+                                                            output_sz=output_sz,
+                                                            center_jitter_factor=settings.center_jitter_factor,
+                                                            scale_jitter_factor=settings.scale_jitter_factor,
+                                                            mode='sequence',
+                                                            joint_transform=transform_joint,
+                                                            settings=settings)
+        device_processing_train = processing.DeviceCropProcessing(output_sz, mean=cfg.DATA.MEAN, std=cfg.DATA.STD,
+                                                                  flip_probability=0.5)
+        device_processing_val = processing.DeviceCropProcessing(output_sz, mean=cfg.DATA.MEAN, std=cfg.DATA.STD)
+    elif getattr(cfg.DATA, "UINT8_TRANSPORT", False):
+        # Workers send uint8 crops, the jitter/flip/normalization is done on the device
+        data_processing_train = processing.ViPTUint8Processing(search_area_factor=search_area_factor,
+                                                                output_sz=output_sz,
+                                                                center_jitter_factor=settings.center_jitter_factor,
+                                                                scale_jitter_factor=settings.scale_jitter_factor,
+                                                                mode='sequence',
+                                                                brightness_jitter=0.2,
+                                                                joint_transform=transform_joint,
+                                                                settings=settings)
+
+        data_processing_val = processing.ViPTUint8Processing(search_area_factor=search_area_factor,
+                                                              output_sz=output_sz,
+                                                              center_jitter_factor=settings.center_jitter_factor,
+                                                              scale_jitter_factor=settings.scale_jitter_factor,
+                                                              mode='sequence',
+                                                              joint_transform=transform_joint,
+                                                              settings=settings)
+        device_processing_train = processing.DeviceProcessing(mean=cfg.DATA.MEAN, std=cfg.DATA.STD,
+                                                              flip_probability=0.5)
+        device_processing_val = processing.DeviceProcessing(mean=cfg.DATA.MEAN, std=cfg.DATA.STD)
+    else:
+        data_processing_train = processing.ViPTProcessing(search_area_factor=search_area_factor,
+                                                           output_sz=output_sz,
+                                                           center_jitter_factor=settings.center_jitter_factor,
+                                                           scale_jitter_factor=settings.scale_jitter_factor,
+                                                           mode='sequence',
+                                                           transform=transform_train,
+                                                           joint_transform=transform_joint,
+                                                           settings=settings)
+
+        data_processing_val = processing.ViPTProcessing(search_area_factor=search_area_factor,
+                                                         output_sz=output_sz,
+                                                         center_jitter_factor=settings.center_jitter_factor,
+                                                         scale_jitter_factor=settings.scale_jitter_factor,
+                                                         mode='sequence',
+                                                         transform=transform_val,
+                                                         joint_transform=transform_joint,
+                                                         settings=settings)
+        device_processing_train, device_processing_val = None, None
 
     # Train sampler and loader
     settings.num_template = getattr(cfg.DATA.TEMPLATE, "NUMBER", 1)
@@ -77,18 +131,26 @@ def build_dataloaders(cfg, settings):
     sampler_mode = getattr(cfg.DATA, "SAMPLER_MODE", "causal")
     train_cls = getattr(cfg.TRAIN, "TRAIN_CLS", False)
     print("sampler_mode", sampler_mode)
+    multi_crop_cfg = getattr(cfg.DATA, "MULTI_CROP", {})
+    num_crops_per_pair = multi_crop_cfg.get("NUM", 1)
+    num_extra_search = multi_crop_cfg.get("EXTRA_SEARCH", 0)
+    # Keep enough pairs alive so that one pair fills at most MAX_PER_BATCH samples of a batch
+    crop_pool_size = math.ceil(cfg.TRAIN.BATCH_SIZE / max(1, multi_crop_cfg.get("MAX_PER_BATCH", 4)))
     dataset_train = sampler.TrackingSampler(datasets=names2datasets(cfg.DATA.TRAIN.DATASETS_NAME, settings, opencv_loader),
                                             p_datasets=cfg.DATA.TRAIN.DATASETS_RATIO,
                                             samples_per_epoch=cfg.DATA.TRAIN.SAMPLE_PER_EPOCH,
                                             max_gap=cfg.DATA.MAX_SAMPLE_INTERVAL, num_search_frames=settings.num_search,
                                             num_template_frames=settings.num_template, processing=data_processing_train,
-                                            frame_sample_mode=sampler_mode, train_cls=train_cls)
+                                            frame_sample_mode=sampler_mode, train_cls=train_cls,
+                                            num_crops_per_pair=num_crops_per_pair, num_extra_search=num_extra_search,
+                                            crop_pool_size=crop_pool_size)
 
     train_sampler = DistributedSampler(dataset_train) if settings.local_rank != -1 else None
     shuffle = False if settings.local_rank != -1 else True
 
     loader_train = LTRLoader('train', dataset_train, training=True, batch_size=cfg.TRAIN.BATCH_SIZE, shuffle=shuffle,
-                             num_workers=cfg.TRAIN.NUM_WORKER, drop_last=True, stack_dim=1, sampler=train_sampler)
+                             num_workers=cfg.TRAIN.NUM_WORKER, drop_last=True, stack_dim=1, sampler=train_sampler,
+                             worker_init_fn=seed_worker, device_processing=device_processing_train)
 
     # Validation samplers and loaders(visevent no val split)
     if cfg.DATA.VAL.DATASETS_NAME[0] is None:
@@ -103,14 +165,36 @@ def build_dataloaders(cfg, settings):
         val_sampler = DistributedSampler(dataset_val) if settings.local_rank != -1 else None
         loader_val = LTRLoader('val', dataset_val, training=False, batch_size=cfg.TRAIN.BATCH_SIZE,
                             num_workers=cfg.TRAIN.NUM_WORKER, drop_last=True, stack_dim=1, sampler=val_sampler,
-                            epoch_interval=cfg.TRAIN.VAL_EPOCH_INTERVAL)
+                            epoch_interval=cfg.TRAIN.VAL_EPOCH_INTERVAL, worker_init_fn=seed_worker,
+                            device_processing=device_processing_val)
 
     return loader_train, loader_val
 
 
+def seed_worker(worker_id):
+    """ Seed python and numpy in the dataloader workers. The TrackingSampler ignores the indices of the
+    (distributed) sampler and draws its samples with these generators, so every worker of every rank needs its own
+    seed. torch.initial_seed() of a worker is derived from the (rank seeded) generator of the main process. """
+    seed = torch.initial_seed() % 2 ** 32
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def is_prompt_tuning(cfg):
+    return 'rdtt' in getattr(cfg.TRAIN.PROMPT, "TYPE", "")
+
+
+def freeze_parameters(net, cfg):
+    """ In prompt tuning, only the prompt and DepthIR_ORT parameters are trained. Done before the DDP wrapping, so that
+    DDP only handles the trained parameters. """
+    if is_prompt_tuning(cfg):
+        for n, p in net.named_parameters():
+            if "prompt" not in n and "DepthIR_ORT" not in n:
+                p.requires_grad = False
+
+
 def get_optimizer_scheduler(net, cfg):
-    train_type = getattr(cfg.TRAIN.PROMPT, "TYPE", "")
-    if 'rdtt' in train_type:
+    if is_prompt_tuning(cfg):
         # print("Only training prompt parameters. They are: ")
         param_dicts = [
             {"params": [p for n, p in net.named_parameters() if ("prompt" in n or "DepthIR_ORT" in n) and p.requires_grad]}
@@ -20,12 +20,28 @@ def _check_use_shared_memory():
     return torch.utils.data.get_worker_info() is not None
 
 
+def _pad_to_same_shape(batch):
+    """Zero pads the tensors of a batch at the end of each dimension if their shapes differ (e.g. variable sized ROIs)"""
+    shapes = [x.shape for x in batch]
+    if all(shape == shapes[0] for shape in shapes):
+        return batch
+    max_shape = [max(sizes) for sizes in zip(*shapes)]
+    padded = []
+    for x in batch:
+        pad = []
+        for size, max_size in zip(reversed(x.shape), reversed(max_shape)):
+            pad += [0, max_size - size]
+        padded.append(torch.nn.functional.pad(x, pad))
+    return padded
+
+
 def ltr_collate(batch):
     """Puts each data field into a tensor with outer dimension batch size"""
 
     error_msg = "batch must contain tensors, numbers, dicts or lists; found {}"
     elem_type = type(batch[0])
     if isinstance(batch[0], torch.Tensor):
+        batch = _pad_to_same_shape(batch)
         out = None
         if _check_use_shared_memory():
             # If we're in a background process, concatenate directly into a
@@ -77,6 +93,7 @@ def ltr_collate_stack1(batch):
     error_msg = "batch must contain tensors, numbers, dicts or lists; found {}"
     elem_type = type(batch[0])
     if isinstance(batch[0], torch.Tensor):
+        batch = _pad_to_same_shape(batch)
         out = None
         if _check_use_shared_memory():
             # If we're in a background process, concatenate directly into a
@@ -157,6 +174,8 @@ class LTRLoader(torch.utils.data.dataloader.DataLoader):
         worker_init_fn (callable, optional): If not None, this will be called on each
             worker subprocess with the worker id (an int in ``[0, num_workers - 1]``) as
             input, after seeding and before data loading. (default: None)
+        device_processing (callable, optional): Applied by the trainer to each batch after it has been moved to the
+            device, e.g. DeviceCropProcessing. (default: None)
 
     .. note:: By default, each worker will have its PyTorch seed set to
               ``base_seed + worker_id``, where ``base_seed`` is a long generated
@@ -176,7 +195,7 @@ class LTRLoader(torch.utils.data.dataloader.DataLoader):
 
     def __init__(self, name, dataset, training=True, batch_size=1, shuffle=False, sampler=None, batch_sampler=None,
                  num_workers=0, epoch_interval=1, collate_fn=None, stack_dim=0, pin_memory=False, drop_last=False,
-                 timeout=0, worker_init_fn=None):
+                 timeout=0, worker_init_fn=None, device_processing=None):
         if collate_fn is None:
             if stack_dim == 0:
                 collate_fn = ltr_collate
@@ -193,3 +212,4 @@ class LTRLoader(torch.utils.data.dataloader.DataLoader):
         self.training = training
         self.epoch_interval = epoch_interval
         self.stack_dim = stack_dim
+        self.device_processing = device_processing
@@ -5,6 +5,8 @@ import torchvision.transforms as transforms
 from lib.utils import TensorDict
 import lib.train.data.processing_utils as prutils
 import torch.nn.functional as F
+import numpy as np
+from lib.utils import stage_timer
 
 
 def stack_tensors(x):
@@ -97,10 +99,11 @@ class ViPTProcessing(BaseProcessing):
         """
         # Apply joint transforms
         if self.transform['joint'] is not None:
-            data['template_images'], data['template_anno'] = self.transform['joint'](
-                image=data['template_images'], bbox=data['template_anno'])
-            data['search_images'], data['search_anno'] = self.transform['joint'](
-                image=data['search_images'], bbox=data['search_anno'], new_roll=False)
+            with stage_timer.timed('transform'):
+                data['template_images'], data['template_anno'] = self.transform['joint'](
+                    image=data['template_images'], bbox=data['template_anno'])
+                data['search_images'], data['search_anno'] = self.transform['joint'](
+                    image=data['search_images'], bbox=data['search_anno'], new_roll=False)
 
         for s in ['template', 'search']:
             assert self.mode == 'sequence' or len(data[s + '_images']) == 1, \
@@ -121,12 +124,93 @@ class ViPTProcessing(BaseProcessing):
 
             # Crop image region centered at jittered_anno box
             # Here, we normalize anno to 0-1
+            with stage_timer.timed('crop'):
+                crops, boxes, _, _ = prutils.jittered_center_crop(data[s + '_images'], jittered_anno,
+                                                                data[s + '_anno'], self.search_area_factor[s],
+                                                                self.output_sz[s])
+
+            # Apply transforms
+            with stage_timer.timed('transform'):
+                data[s + '_images'], data[s + '_anno'] = self.transform[s](image=crops, bbox=boxes, joint=False)
+
+        data['valid'] = True
+        # Prepare output
+        if self.mode == 'sequence':
+            data = data.apply(stack_tensors)
+        else:
+            data = data.apply(lambda x: x[0] if isinstance(x, list) else x)
+
+        return data
+
+
+class ViPTUint8Processing(ViPTProcessing):
+    """ Worker side of the uint8 transport (DATA.UINT8_TRANSPORT). The crops are extracted as in ViPTProcessing but
+    are returned as uint8 tensors together with the rolled brightness jitter factor, which is 4x less data to move
+    through shared memory than float32 crops. The brightness jitter, the flip and the normalization are applied on
+    the device by DeviceProcessing after the batch arrives.
+    """
+
+    def __init__(self, search_area_factor, output_sz, center_jitter_factor, scale_jitter_factor,
+                 mode='pair', settings=None, brightness_jitter=0.0, *args, **kwargs):
+        """
+        args:
+            brightness_jitter - Amount of brightness jittering. The factor is rolled here and applied on the device.
+            For the other arguments, see ViPTProcessing.
+        """
+        super().__init__(search_area_factor, output_sz, center_jitter_factor, scale_jitter_factor,
+                         mode, settings, *args, **kwargs)
+        self.brightness_jitter = brightness_jitter
+
+    def _roll_brightness(self):
+        return np.random.uniform(max(0, 1 - self.brightness_jitter), 1 + self.brightness_jitter)
+
+    def _crop(self, s, data, jittered_anno):
+        """ Returns the uint8 images (N, C, H, W), the boxes in normalized crop co-ordinates and extra fields. """
+        with stage_timer.timed('crop'):
             crops, boxes, _, _ = prutils.jittered_center_crop(data[s + '_images'], jittered_anno,
                                                             data[s + '_anno'], self.search_area_factor[s],
                                                             self.output_sz[s])
+            images = torch.stack([torch.from_numpy(c.transpose((2, 0, 1))) for c in crops])
+        return images, boxes, {}
 
-            # Apply transforms
-            data[s + '_images'], data[s + '_anno'] = self.transform[s](image=crops, bbox=boxes, joint=False)
+    def __call__(self, data: TensorDict):
+        """
+        args:
+            data - The input data, should contain the following fields:
+                'template_images', search_images', 'template_anno', 'search_anno'
+        returns:
+            TensorDict - output data block with following fields:
+                'template_images', 'search_images' - uint8 images (N, C, H, W)
+                'template_anno', 'search_anno' - boxes in normalized crop co-ordinates
+                'template_jitter', 'search_jitter' - brightness factors (N,)
+        """
+        # Apply joint transforms
+        if self.transform['joint'] is not None:
+            with stage_timer.timed('transform'):
+                data['template_images'], data['template_anno'] = self.transform['joint'](
+                    image=data['template_images'], bbox=data['template_anno'])
+                data['search_images'], data['search_anno'] = self.transform['joint'](
+                    image=data['search_images'], bbox=data['search_anno'], new_roll=False)
+
+        for s in ['template', 'search']:
+            assert self.mode == 'sequence' or len(data[s + '_images']) == 1, \
+                "In pair mode, num train/test frames must be 1"
+
+            jittered_anno = [self._get_jittered_box(a, s) for a in data[s + '_anno']]
+
+            w, h = torch.stack(jittered_anno, dim=0)[:, 2], torch.stack(jittered_anno, dim=0)[:, 3]
+
+            crop_sz = torch.ceil(torch.sqrt(w * h) * self.search_area_factor[s])
+            if (crop_sz < 1).any():
+                data['valid'] = False
+                return data
+
+            images, boxes, extra = self._crop(s, data, jittered_anno)
+
+            data[s + '_images'] = images
+            data[s + '_anno'] = boxes
+            data[s + '_jitter'] = [torch.tensor(self._roll_brightness(), dtype=torch.float32) for _ in boxes]
+            data.update(extra)
 
         data['valid'] = True
         # Prepare output
@@ -134,5 +218,103 @@ class ViPTProcessing(BaseProcessing):
             data = data.apply(stack_tensors)
         else:
             data = data.apply(lambda x: x[0] if isinstance(x, list) else x)
+            for s in ['template', 'search']:
+                data[s + '_images'] = data[s + '_images'][0]
+
+        return data
+
+
+class ViPTRoiProcessing(ViPTUint8Processing):
+    """ Worker side of the on-device cropping pipeline (DATA.CROP_ON_DEVICE). The boxes are jittered as in
+    ViPTProcessing, but instead of cropping and resizing every frame with OpenCV, only the image region covered by
+    the crop (ROI) is cut out and returned as a uint8 tensor together with the crop box ('template_crop_box',
+    'search_crop_box', see prutils.sample_target_roi). The crops of the whole batch are then extracted on the device
+    by DeviceCropProcessing, which also applies the brightness jitter, the flip and the normalization.
+    """
+
+    def __init__(self, search_area_factor, output_sz, center_jitter_factor, scale_jitter_factor,
+                 mode='pair', settings=None, brightness_jitter=0.0, max_roi_scale=2, *args, **kwargs):
+        """
+        args:
+            max_roi_scale - ROIs larger than max_roi_scale * output_sz are subsampled with an integer stride.
+            For the other arguments, see ViPTUint8Processing.
+        """
+        super().__init__(search_area_factor, output_sz, center_jitter_factor, scale_jitter_factor,
+                         mode, settings, brightness_jitter, *args, **kwargs)
+        self.max_roi_scale = max_roi_scale
+
+    def _crop(self, s, data, jittered_anno):
+        with stage_timer.timed('crop'):
+            rois, boxes, crop_boxes = prutils.jittered_center_crop_roi(data[s + '_images'], jittered_anno,
+                                                                       data[s + '_anno'], self.search_area_factor[s],
+                                                                       self.output_sz[s], self.max_roi_scale)
+
+            # Pad the ROIs of the frames to the same size, the collate function pads across the batch
+            roi_h, roi_w = max(r.shape[0] for r in rois), max(r.shape[1] for r in rois)
+            images = torch.zeros((len(rois), rois[0].shape[2], roi_h, roi_w), dtype=torch.uint8)
+            for i, roi in enumerate(rois):
+                images[i, :, :roi.shape[0], :roi.shape[1]] = torch.from_numpy(roi.transpose((2, 0, 1)))
+        return images, boxes, {s + '_crop_box': list(crop_boxes)}
+
+
+class DeviceProcessing:
+    """ Trainer side of the uint8 transport, applied to a collated batch after it has been moved to the device.
+    Applies the brightness jitter, the random horizontal flip and the per-modality normalization to the uint8
+    template and search crops (the device equivalent of ToTensorAndJitter, RandomHorizontalFlip_Norm and Normalize).
+    """
+
+    def __init__(self, mean, std, flip_probability=0.0):
+        """
+        args:
+            mean, std - per-channel normalization of one 3-channel modality, applied to every modality.
+            flip_probability - probability of flipping each crop horizontally.
+        """
+        self.mean = torch.tensor(mean, dtype=torch.float32)
+        self.std = torch.tensor(std, dtype=torch.float32)
+        self.flip_probability = flip_probability
 
+    def _augment(self, images, anno, brightness):
+        """ images (N, C, H, W) in [0, 255], anno (N, 4) normalized, brightness (N,) """
+        images = (images.float() * (brightness.float() / 255.0).view(-1, 1, 1, 1)).clamp_(0.0, 1.0)
+
+        if self.flip_probability > 0:
+            do_flip = torch.rand(images.shape[0], device=images.device) < self.flip_probability
+            images = torch.where(do_flip.view(-1, 1, 1, 1), images.flip((-1,)), images)
+            flipped_x = 1 - anno[:, 0] - anno[:, 2]
+            anno = torch.cat((torch.where(do_flip, flipped_x, anno[:, 0])[:, None], anno[:, 1:]), dim=1)
+
+        num_modalities = images.shape[1] // self.mean.numel()
+        mean = self.mean.to(images.device).repeat(num_modalities).view(1, -1, 1, 1)
+        std = self.std.to(images.device).repeat(num_modalities).view(1, -1, 1, 1)
+        return (images - mean) / std, anno
+
+    def _get_images(self, data, s):
+        return data[s + '_images'].flatten(0, 1)
+
+    def __call__(self, data: TensorDict):
+        for s in ['template', 'search']:
+            num_frames, batch = data[s + '_images'].shape[:2]
+            images, anno = self._augment(self._get_images(data, s), data[s + '_anno'].flatten(0, 1).float(),
+                                         data[s + '_jitter'].flatten(0, 1))
+            data[s + '_images'] = images.view(num_frames, batch, *images.shape[1:])
+            data[s + '_anno'] = anno.view(num_frames, batch, 4)
         return data
+
+
+class DeviceCropProcessing(DeviceProcessing):
+    """ Trainer side of the on-device cropping pipeline. Extracts the template and search crops of the whole batch
+    from the ROIs with prutils.batched_crop, then augments them as DeviceProcessing.
+    """
+
+    def __init__(self, output_sz, mean, std, flip_probability=0.0):
+        """
+        args:
+            output_sz - dict with the template and search crop sizes.
+            For the other arguments, see DeviceProcessing.
+        """
+        super().__init__(mean, std, flip_probability)
+        self.output_sz = output_sz
+
+    def _get_images(self, data, s):
+        return prutils.batched_crop(data[s + '_images'].flatten(0, 1), data[s + '_crop_box'].flatten(0, 1),
+                                    self.output_sz[s])
@@ -83,6 +83,103 @@ def sample_target(im, target_bb, search_area_factor, output_sz=None, mask=None):
 
 
 
+def crop_geometry(target_bb, search_area_factor):
+    """ (x1, y1, crop_sz) of the square crop of sample_target, its top-left corner and size in the image. """
+    if not isinstance(target_bb, list):
+        x, y, w, h = target_bb.tolist()
+    else:
+        x, y, w, h = target_bb
+    crop_sz = math.ceil(math.sqrt(w * h) * search_area_factor)
+
+    if crop_sz < 1:
+        raise Exception('Too small bounding box.')
+
+    x1 = round(x + 0.5 * w - crop_sz * 0.5)
+    y1 = round(y + 0.5 * h - crop_sz * 0.5)
+    return x1, y1, crop_sz
+
+
+def crop_att_mask(x1, y1, crop_sz, im_h, im_w, output_sz, device=None):
+    """ Attention mask of a crop of sample_target, True on the padding outside of the image. A numpy array, or a
+    tensor on device if it is set. """
+    # centers of the output pixels in the image, as sampled by the crop
+    steps = (np.arange(output_sz) + 0.5) * crop_sz / output_sz - 0.5
+    outside_x = (x1 + steps < 0) | (x1 + steps > im_w - 1)
+    outside_y = (y1 + steps < 0) | (y1 + steps > im_h - 1)
+    att_mask = outside_y[:, None] | outside_x[None, :]
+    if device is not None:
+        return torch.from_numpy(att_mask).to(device)
+    return att_mask
+
+
+def sample_target_warp(im, target_bb, search_area_factor, output_sz, out=None, return_att_mask=False):
+    """ Same crop as sample_target, without the padded copy of the crop nor the attention mask (unless requested).
+    A crop inside of the image is resized from a view of the image, as sample_target. A crop crossing the image border
+    is cut out and resized in a single cv.warpAffine, zero outside of the image.
+
+    args:
+        im - cv image
+        target_bb - target box [x, y, w, h]
+        search_area_factor - Ratio of crop size to target size
+        output_sz - (int) Size to which the extracted crop is resized (always square)
+        out - optional preallocated (output_sz, output_sz, C) array of the dtype of im, the crop is written into it
+        return_att_mask - also return the attention mask (crop_att_mask), which is only computed if requested
+
+    returns:
+        cv image - extracted crop
+        float - the factor by which the crop has been resized to make the crop size equal output_size
+        np.array - attention mask, if return_att_mask
+    """
+    x1, y1, crop_sz = crop_geometry(target_bb, search_area_factor)
+    resize_factor = output_sz / crop_sz
+    if x1 >= 0 and y1 >= 0 and x1 + crop_sz < im.shape[1] and y1 + crop_sz < im.shape[0]:
+        im_crop = cv.resize(im[y1:y1 + crop_sz, x1:x1 + crop_sz], (output_sz, output_sz), dst=out)
+    else:
+        # output pixel centers u map to the image at x1 + (u + 0.5) / resize_factor - 0.5, as with cv.resize
+        M = np.array([[resize_factor, 0, resize_factor * (0.5 - x1) - 0.5],
+                      [0, resize_factor, resize_factor * (0.5 - y1) - 0.5]], dtype=np.float64)
+        im_crop = cv.warpAffine(im, M, (output_sz, output_sz), dst=out, flags=cv.INTER_LINEAR,
+                                borderMode=cv.BORDER_CONSTANT, borderValue=0)
+    if return_att_mask:
+        return im_crop, resize_factor, crop_att_mask(x1, y1, crop_sz, im.shape[0], im.shape[1], output_sz)
+    return im_crop, resize_factor
+
+
+def sample_target_torch(im, target_bb, search_area_factor, output_sz, device='cpu', return_att_mask=False):
+    """ Same crop as sample_target, but only the part of the image under the crop is copied to device, where the crop
+    is cut out and resized with grid_sample (batched_crop).
+
+    args:
+        im - cv image
+        target_bb - target box [x, y, w, h]
+        search_area_factor - Ratio of crop size to target size
+        output_sz - (int) Size to which the extracted crop is resized (always square)
+        device - device of the crop
+        return_att_mask - also return the attention mask (crop_att_mask) on device
+
+    returns:
+        torch.Tensor - (1, C, output_sz, output_sz) float crop on device, zero outside of the image
+        float - the factor by which the crop has been resized to make the crop size equal output_size
+        torch.Tensor - attention mask, if return_att_mask
+    """
+    x1, y1, crop_sz = crop_geometry(target_bb, search_area_factor)
+    # one more pixel on each side for the interpolation at the border of the crop
+    roi_x1, roi_x2 = min(max(0, x1 - 1), im.shape[1]), max(min(x1 + crop_sz + 1, im.shape[1]), 0)
+    roi_y1, roi_y2 = min(max(0, y1 - 1), im.shape[0]), max(min(y1 + crop_sz + 1, im.shape[0]), 0)
+    roi = im[roi_y1:roi_y2, roi_x1:roi_x2, :]
+    if roi.shape[0] == 0 or roi.shape[1] == 0:
+        # The crop is completely outside of the image
+        roi = np.zeros((1, 1, im.shape[2]), dtype=im.dtype)
+    roi = torch.from_numpy(np.ascontiguousarray(roi)).to(device).permute(2, 0, 1).unsqueeze(0)
+    crop_box = torch.tensor([[x1 - roi_x1, y1 - roi_y1, crop_sz, 1]], dtype=torch.float32)
+    im_crop = batched_crop(roi, crop_box, output_sz)
+    resize_factor = output_sz / crop_sz
+    if return_att_mask:
+        return im_crop, resize_factor, crop_att_mask(x1, y1, crop_sz, im.shape[0], im.shape[1], output_sz,
+                                                     device=device)
+    return im_crop, resize_factor
+
+
 def transform_image_to_crop(box_in: torch.Tensor, box_extract: torch.Tensor, resize_factor: float,
                             crop_sz: torch.Tensor, normalize=False) -> torch.Tensor:
     """ Transform the box co-ordinates from the original image co-ordinates to the co-ordinates of the cropped image
@@ -147,6 +244,80 @@ def jittered_center_crop(frames, box_extract, box_gt, search_area_factor, output
     return frames_crop, box_crop, att_mask, masks_crop
 
 
+def sample_target_roi(im, target_bb, search_area_factor, output_sz, max_roi_scale=2):
+    """ Same crop geometry as sample_target, but only cuts out the part of the crop that lies inside the image,
+    without padding or resizing. The crop is extracted later for the whole batch with batched_crop.
+    If the crop is much larger than output_sz, the ROI is subsampled with an integer stride so that it is at most
+    about max_roi_scale * output_sz pixels wide.
+
+    args:
+        im - cv image
+        target_bb - target box [x, y, w, h]
+        search_area_factor - Ratio of crop size to target size
+        output_sz - (int) Size to which the crop will be resized
+
+    returns:
+        cv image - the region of the image covered by the crop (subsampled by the stride)
+        float - the factor by which the crop will be resized to make the crop size equal output_size
+        torch.Tensor - crop_box [x, y, crop_sz, stride], the crop position relative to the ROI origin
+    """
+    x1, y1, crop_sz = crop_geometry(target_bb, search_area_factor)
+    roi_x1, roi_x2 = min(max(0, x1), im.shape[1]), max(min(x1 + crop_sz, im.shape[1]), 0)
+    roi_y1, roi_y2 = min(max(0, y1), im.shape[0]), max(min(y1 + crop_sz, im.shape[0]), 0)
+
+    stride = max(1, int(crop_sz // (max_roi_scale * output_sz)))
+    roi = im[roi_y1:roi_y2:stride, roi_x1:roi_x2:stride, :]
+    if roi.shape[0] == 0 or roi.shape[1] == 0:
+        # The crop is completely outside of the image
+        roi = np.zeros((1, 1, im.shape[2]), dtype=im.dtype)
+
+    crop_box = torch.tensor([x1 - roi_x1, y1 - roi_y1, crop_sz, stride], dtype=torch.float32)
+    return roi, output_sz / crop_sz, crop_box
+
+
+def jittered_center_crop_roi(frames, box_extract, box_gt, search_area_factor, output_sz, max_roi_scale=2):
+    """ Like jittered_center_crop, but returns the ROIs of sample_target_roi instead of the resized crops.
+
+    returns:
+        list - list of image ROIs
+        list - box_gt location in the (normalized) crop co-ordinates
+        list - crop boxes, see sample_target_roi
+    """
+    rois, resize_factors, crop_boxes = zip(*[sample_target_roi(f, a, search_area_factor, output_sz, max_roi_scale)
+                                             for f, a in zip(frames, box_extract)])
+    crop_sz = torch.Tensor([output_sz, output_sz])
+    box_crop = [transform_image_to_crop(a_gt, a_ex, rf, crop_sz, normalize=True)
+                for a_gt, a_ex, rf in zip(box_gt, box_extract, resize_factors)]
+
+    return rois, box_crop, crop_boxes
+
+
+def batched_crop(images, crop_boxes, output_sz):
+    """ Extract and resize the crops of a whole batch at once with grid_sample. Works on any device.
+
+    args:
+        images - (N, C, H, W) tensor of (zero padded) ROIs, see sample_target_roi
+        crop_boxes - (N, 4) tensor of crop boxes [x, y, crop_sz, stride] relative to the ROI origin
+        output_sz - (int) output size of the square crops
+
+    returns:
+        torch.Tensor - (N, C, output_sz, output_sz) float crops. Regions outside of the image are zero.
+    """
+    images = images.float()
+    crop_boxes = crop_boxes.to(images.device).float()
+    H, W = images.shape[-2:]
+    steps = (torch.arange(output_sz, device=images.device, dtype=torch.float32) + 0.5) / output_sz
+    x0, y0, crop_sz, stride = crop_boxes.unbind(-1)
+    # pixel index in the (subsampled) ROI, sampling at the same positions as cv.resize(..., INTER_LINEAR)
+    x = (x0[:, None] + steps[None, :] * crop_sz[:, None] - 0.5) / stride[:, None]
+    y = (y0[:, None] + steps[None, :] * crop_sz[:, None] - 0.5) / stride[:, None]
+    # grid_sample (align_corners=False) expects (2 * index + 1) / size - 1
+    grid_x = ((2 * x + 1) / W - 1)[:, None, :].expand(-1, output_sz, -1)
+    grid_y = ((2 * y + 1) / H - 1)[:, :, None].expand(-1, -1, output_sz)
+    grid = torch.stack((grid_x, grid_y), dim=-1)
+    return F.grid_sample(images, grid, mode='bilinear', padding_mode='zeros', align_corners=False)
+
+
 def transform_box_to_crop(box: torch.Tensor, crop_box: torch.Tensor, crop_sz: torch.Tensor, normalize=False) -> torch.Tensor:
     """ Transform the box co-ordinates from the original image co-ordinates to the co-ordinates of the cropped image
     args:
@@ -16,14 +16,18 @@ class TrackingSampler(torch.utils.data.Dataset):
     from that dataset. A base frame is then sampled randomly from the sequence. Next, a set of 'train frames' and
     'test frames' are sampled from the sequence from the range [base_frame_id - max_gap, base_frame_id]  and
     (base_frame_id, base_frame_id + max_gap] respectively. Only the frames in which the target is visible are sampled.
-    If enough visible frames are not found, the 'max_gap' is increased gradually till enough frames are found.
+    If one of the ranges holds no visible frame, it is extended up to the nearest visible frame.
+
+    The visible/valid frame indices of every sequence are precomputed once as sorted arrays, so that sampling inside a
+    range is a binary search. The sequences (and base/search frames) that can produce a sample in frame_sample_mode are
+    precomputed as well, hence the sampling never has to retry.
 
     The sampled frames are then passed through the input 'processing' function for the necessary processing-
     """
 
     def __init__(self, datasets, p_datasets, samples_per_epoch, max_gap,
                  num_search_frames, num_template_frames=1, processing=no_processing, frame_sample_mode='causal',
-                 train_cls=False, pos_prob=0.5):
+                 train_cls=False, pos_prob=0.5, num_crops_per_pair=1, num_extra_search=0, crop_pool_size=1):
         """
         args:
             datasets - List of datasets to be used for training
@@ -35,6 +39,12 @@ class TrackingSampler(torch.utils.data.Dataset):
             processing - An instance of Processing class which performs the necessary processing of the data.
             frame_sample_mode - Either 'causal' or 'interval'. If 'causal', then the test frames are sampled in a causally,
                                 otherwise randomly within the interval.
+            num_crops_per_pair - Number of (independently jittered) samples generated from each decoded frame pair.
+            num_extra_search - Number of additional search frames decoded with each pair (causal mode only). Every
+                               sample of the pair uses one of the decoded search frames.
+            crop_pool_size - Number of decoded pairs kept alive at the same time. Consecutive samples (i.e. the samples
+                             of a batch) cycle through the pool, so that a pair contributes at most
+                             ceil(batch_size / crop_pool_size) samples to a batch.
         """
         self.datasets = datasets
         self.train_cls = train_cls  # whether we are training classification
@@ -55,9 +65,101 @@ class TrackingSampler(torch.utils.data.Dataset):
         self.processing = processing
         self.frame_sample_mode = frame_sample_mode
 
+        self.num_crops_per_pair = num_crops_per_pair
+        self.num_extra_search = num_extra_search
+        self.crop_pool_size = crop_pool_size
+        # Decoded frame pairs of the multi-crop mode. Each dataloader worker has its own copy
+        self._crop_pool = [None] * crop_pool_size
+        self._crop_pool_pos = 0
+
+        self._build_frame_index()
+
     def __len__(self):
         return self.samples_per_epoch
 
+    def _build_frame_index(self):
+        """ Precompute the frame index (see _index_sequence) of every sequence of the video datasets and, per dataset,
+        the list of sequences which can be sampled. """
+        self._dataset_idx = {id(d): i for i, d in enumerate(self.datasets)}
+        self._frame_index = {}
+        self._eligible_seqs = {}
+        for d_idx, dataset in enumerate(self.datasets):
+            if not dataset.is_video_sequence():
+                continue
+            eligible_seqs = []
+            for seq_id in range(dataset.get_num_sequences()):
+                frame_index = self._index_sequence(dataset.get_sequence_info(seq_id))
+                self._frame_index[(d_idx, seq_id)] = frame_index
+                if frame_index['eligible']:
+                    eligible_seqs.append(seq_id)
+            if len(eligible_seqs) == 0:
+                raise ValueError("No sequence of dataset {} can be sampled in '{}' mode".format(
+                    dataset.get_name(), self.frame_sample_mode))
+            self._eligible_seqs[d_idx] = eligible_seqs
+
+    def _index_sequence(self, seq_info_dict):
+        """ Builds the frame index of a sequence: the sorted indices of the visible, invisible and valid frames, and the
+        precomputed candidates of the frame_sample_mode. """
+        visible = seq_info_dict['visible'].numpy().astype(bool)
+        valid = seq_info_dict['valid'].numpy().astype(bool) if 'valid' in seq_info_dict else visible
+        visible_ids = np.flatnonzero(visible)
+        num_frames = len(visible)
+        frame_index = {'seq_info': seq_info_dict,
+                       'num_frames': num_frames,
+                       'visible': visible_ids,
+                       'invisible': np.flatnonzero(~visible),
+                       'valid': np.flatnonzero(valid)}
+
+        eligible = len(visible_ids) > 2 * (self.num_search_frames + self.num_template_frames) and num_frames >= 20
+        if self.frame_sample_mode == 'causal':
+            # Base frames need a later visible frame (search) and, with several templates, an earlier one
+            base_ids = visible_ids[(visible_ids >= self.num_template_frames - 1) &
+                                   (visible_ids < num_frames - self.num_search_frames)]
+            if len(base_ids) > 0:
+                base_ids = base_ids[base_ids < visible_ids[-1]]
+                if self.num_template_frames > 1:
+                    base_ids = base_ids[base_ids > visible_ids[0]]
+            frame_index['base_ids'] = base_ids
+            eligible = eligible and len(base_ids) > 0
+        elif self.frame_sample_mode in ('trident', 'trident_pro', 'stark'):
+            # For every visible search frame, whether the forward/backward windows of the dynamic templates hold a
+            # frame for all the max_gap. The initial template may be any visible frame on an allowed side, so the
+            # search frame is drawn with a probability proportional to the number of such templates.
+            if self.frame_sample_mode == 'trident':
+                extra_ids = visible_ids
+            elif self.frame_sample_mode == 'trident_pro':
+                extra_ids = np.arange(num_frames)
+            else:
+                extra_ids = frame_index['valid']
+            min_gap = min(self.max_gap)
+            lo = np.searchsorted(extra_ids, visible_ids)
+            forward = np.searchsorted(extra_ids, visible_ids + min_gap) > lo
+            backward = np.searchsorted(extra_ids, visible_ids - min_gap) < lo
+            num_before = np.arange(len(visible_ids))
+            weights = np.where(forward, len(visible_ids) - num_before, 0) + np.where(backward, num_before, 0)
+            frame_index['extra_ids'] = extra_ids
+            frame_index['forward'] = forward
+            frame_index['backward'] = backward
+            frame_index['search_cum_weights'] = np.cumsum(weights).tolist()
+            eligible = eligible and weights.sum() > 0
+        frame_index['eligible'] = eligible
+        return frame_index
+
+    @staticmethod
+    def _sample_ids(ids, num_ids=1, min_id=None, max_id=None):
+        """ Samples num_ids entries of the sorted array ids inside [min_id, max_id)
+
+        returns:
+            list - List of sampled frame numbers. None if ids holds no frame in the range.
+        """
+        if num_ids == 0:
+            return []
+        lo = 0 if min_id is None else int(np.searchsorted(ids, min_id))
+        hi = len(ids) if max_id is None else int(np.searchsorted(ids, max_id))
+        if hi <= lo:
+            return None
+        return [int(ids[i]) for i in random.choices(range(lo, hi), k=num_ids)]
+
     def _sample_visible_ids(self, visible, num_ids=1, min_id=None, max_id=None,
                             allow_invisible=False, force_invisible=False):
         """ Samples num_ids frames between min_id and max_id for which target is visible
@@ -71,26 +173,14 @@ class TrackingSampler(torch.utils.data.Dataset):
         returns:
             list - List of sampled frame numbers. None if not sufficient visible frames could be found.
         """
-        if num_ids == 0:
-            return []
-        if min_id is None or min_id < 0:
-            min_id = 0
-        if max_id is None or max_id > len(visible):
-            max_id = len(visible)
-        # get valid ids
+        visible = np.asarray(visible, dtype=bool)
         if force_invisible:
-            valid_ids = [i for i in range(min_id, max_id) if not visible[i]]
+            ids = np.flatnonzero(~visible)
+        elif allow_invisible:
+            ids = np.arange(len(visible))
         else:
-            if allow_invisible:
-                valid_ids = [i for i in range(min_id, max_id)]
-            else:
-                valid_ids = [i for i in range(min_id, max_id) if visible[i]]
-
-        # No visible ids
-        if len(valid_ids) == 0:
-            return None
-
-        return random.choices(valid_ids, k=num_ids)
+            ids = np.flatnonzero(visible)
+        return self._sample_ids(ids, num_ids, min_id, max_id)
 
     def __getitem__(self, index):
         if self.train_cls:
@@ -103,72 +193,112 @@ class TrackingSampler(torch.utils.data.Dataset):
         returns:
             TensorDict - dict containing all the data blocks
         """
+        if self.num_crops_per_pair > 1:
+            return self.getitem_multi_crop()
+
         valid = False
 
         while not valid:
-            # Select a dataset
-            dataset = random.choices(self.datasets, self.p_datasets)[0]
-
-            is_video_dataset = dataset.is_video_sequence()
-
-            # sample a sequence from the given dataset
-            seq_id, visible, seq_info_dict = self.sample_seq_from_dataset(dataset, is_video_dataset)
-
-
-            if is_video_dataset:
-                template_frame_ids = None
-                search_frame_ids = None
-                gap_increase = 0
-
-                if self.frame_sample_mode == 'causal':
-                    # Sample test and train frames in a causal manner, i.e. search_frame_ids > template_frame_ids
-                    while search_frame_ids is None:
-                        base_frame_id = self._sample_visible_ids(visible, num_ids=1, min_id=self.num_template_frames - 1,
-                                                                 max_id=len(visible) - self.num_search_frames)
-                        prev_frame_ids = self._sample_visible_ids(visible, num_ids=self.num_template_frames - 1,
-                                                                  min_id=base_frame_id[0] - self.max_gap - gap_increase,
-                                                                  max_id=base_frame_id[0])
-                        if prev_frame_ids is None:
-                            gap_increase += 5
-                            continue
-                        template_frame_ids = base_frame_id + prev_frame_ids
-                        search_frame_ids = self._sample_visible_ids(visible, min_id=template_frame_ids[0] + 1,
-                                                                  max_id=template_frame_ids[0] + self.max_gap + gap_increase,
-                                                                  num_ids=self.num_search_frames)
-                        # Increase gap until a frame is found
-                        gap_increase += 5
-
-                elif self.frame_sample_mode == "trident" or self.frame_sample_mode == "trident_pro":
-                    template_frame_ids, search_frame_ids = self.get_frame_ids_trident(visible)
-                elif self.frame_sample_mode == "stark":
-                    template_frame_ids, search_frame_ids = self.get_frame_ids_stark(visible, seq_info_dict["valid"])
-                else:
-                    raise ValueError("Illegal frame sample mode")
-            else:
-                # In case of image dataset, just repeat the image to generate synthetic video
-                template_frame_ids = [1] * self.num_template_frames
-                search_frame_ids = [1] * self.num_search_frames
+            # only the decoding and the processing are retried, a sampling error is raised
+            sample = self.sample_frame_ids()
             try:
-                template_frames, template_anno, meta_obj_train = dataset.get_frames(seq_id, template_frame_ids, seq_info_dict)
-                search_frames, search_anno, meta_obj_test = dataset.get_frames(seq_id, search_frame_ids, seq_info_dict)
+                pair = self.decode_pair(sample)
+                data = self.processing(self._pair_to_data(pair))
 
-                data = TensorDict({'template_images': template_frames,
-                                   'template_anno': template_anno['bbox'],
-                                   'search_images': search_frames,
-                                   'search_anno': search_anno['bbox'],
-                                   'dataset': dataset.get_name(),
-                                   'test_class': meta_obj_test.get('object_class_name')})
-                # make data augmentation
+                # check whether data is valid
+                valid = data['valid']
+            except Exception:
+                valid = False
+        return data
 
-                data = self.processing(data)
+    def getitem_multi_crop(self):
+        """ Generates num_crops_per_pair jittered samples from each decoded frame pair. The pairs are kept in a pool
+        of crop_pool_size entries, which is visited in a round-robin manner.
+        returns:
+            TensorDict - dict containing all the data blocks
+        """
+        valid = False
 
+        while not valid:
+            slot = self._crop_pool_pos % self.crop_pool_size
+            self._crop_pool_pos += 1
+            entry = self._crop_pool[slot]
+            sample = self.sample_frame_ids() if entry is None or entry['uses'] <= 0 else None
+            try:
+                if sample is not None:
+                    entry = {'pair': self.decode_pair(sample), 'uses': self.num_crops_per_pair}
+                    self._crop_pool[slot] = entry
+                entry['uses'] -= 1
+                search_idx = random.randrange(len(entry['pair']['search_frames']))
+                data = self.processing(self._pair_to_data(entry['pair'], search_idx))
 
                 # check whether data is valid
                 valid = data['valid']
-            except:
+            except Exception:
+                self._crop_pool[slot] = None
                 valid = False
         return data
 
+    def sample_frame_ids(self):
+        """ Samples the dataset, the sequence and the template and search frame ids of one training pair.
+        returns:
+            tuple - (dataset, seq_id, seq_info_dict, template_frame_ids, search_frame_ids, extra_search_frame_ids)
+        """
+        # Select a dataset
+        dataset = random.choices(self.datasets, self.p_datasets)[0]
+
+        is_video_dataset = dataset.is_video_sequence()
+
+        # sample a sequence from the given dataset
+        seq_id, frame_index, seq_info_dict = self._sample_sequence(dataset, is_video_dataset)
+
+        extra_search_frame_ids = []
+        if is_video_dataset:
+            if self.frame_sample_mode == 'causal':
+                # Sample test and train frames in a causal manner, i.e. search_frame_ids > template_frame_ids
+                template_frame_ids, search_frame_ids, extra_search_frame_ids = self.get_frame_ids_causal(frame_index)
+            elif self.frame_sample_mode == "trident" or self.frame_sample_mode == "trident_pro":
+                template_frame_ids, search_frame_ids = self.get_frame_ids_trident(frame_index)
+            elif self.frame_sample_mode == "stark":
+                template_frame_ids, search_frame_ids = self.get_frame_ids_stark(frame_index)
+            else:
+                raise ValueError("Illegal frame sample mode")
+        else:
+            # In case of image dataset, just repeat the image to generate synthetic video
+            template_frame_ids = [1] * self.num_template_frames
+            search_frame_ids = [1] * self.num_search_frames
+        return dataset, seq_id, seq_info_dict, template_frame_ids, search_frame_ids, extra_search_frame_ids
+
+    def decode_pair(self, sample):
+        """ Decodes the template and search frames of a training pair sampled by sample_frame_ids.
+        returns:
+            dict - the decoded frames and boxes. 'search_frames' and 'search_anno' hold 1 + num_extra_search
+                   (causal mode only) lists of search frames / boxes.
+        """
+        dataset, seq_id, seq_info_dict, template_frame_ids, search_frame_ids, extra_search_frame_ids = sample
+        template_frames, template_anno, meta_obj_train = dataset.get_frames(seq_id, template_frame_ids, seq_info_dict)
+        search_frames, search_anno, meta_obj_test = [], [], None
+        for frame_ids in [search_frame_ids] + extra_search_frame_ids:
+            frames, anno, meta_obj_test = dataset.get_frames(seq_id, frame_ids, seq_info_dict)
+            search_frames.append(frames)
+            search_anno.append(anno['bbox'])
+
+        return {'template_frames': template_frames,
+                'template_anno': template_anno['bbox'],
+                'search_frames': search_frames,
+                'search_anno': search_anno,
+                'dataset': dataset.get_name(),
+                'test_class': meta_obj_test.get('object_class_name')}
+
+    def _pair_to_data(self, pair, search_idx=0):
+        # New lists, the processing replaces the entries of the TensorDict but must not touch the decoded pair
+        return TensorDict({'template_images': list(pair['template_frames']),
+                           'template_anno': list(pair['template_anno']),
+                           'search_images': list(pair['search_frames'][search_idx]),
+                           'search_anno': list(pair['search_anno'][search_idx]),
+                           'dataset': pair['dataset'],
+                           'test_class': pair['test_class']})
+
     def getitem_cls(self):
         # get data for classification
         """
@@ -188,13 +318,13 @@ class TrackingSampler(torch.utils.data.Dataset):
             is_video_dataset = dataset.is_video_sequence()
 
             # sample a sequence from the given dataset
-            seq_id, visible, seq_info_dict = self.sample_seq_from_dataset(dataset, is_video_dataset)
+            seq_id, frame_index, seq_info_dict = self._sample_sequence(dataset, is_video_dataset)
             # sample template and search frame ids
             if is_video_dataset:
                 if self.frame_sample_mode in ["trident", "trident_pro"]:
-                    template_frame_ids, search_frame_ids = self.get_frame_ids_trident(visible)
+                    template_frame_ids, search_frame_ids = self.get_frame_ids_trident(frame_index)
                 elif self.frame_sample_mode == "stark":
-                    template_frame_ids, search_frame_ids = self.get_frame_ids_stark(visible, seq_info_dict["valid"])
+                    template_frame_ids, search_frame_ids = self.get_frame_ids_stark(frame_index)
                 else:
                     raise ValueError("illegal frame sample mode")
             else:
@@ -220,7 +350,7 @@ class TrackingSampler(torch.utils.data.Dataset):
                 else:
                     label = torch.zeros(1,)
                     if is_video_dataset:
-                        search_frame_ids = self._sample_visible_ids(visible, num_ids=1, force_invisible=True)
+                        search_frame_ids = self._sample_ids(frame_index['invisible'], num_ids=1)
                         if search_frame_ids is None:
                             search_frames, search_anno, meta_obj_test = self.get_one_search()
                         else:
@@ -258,22 +388,21 @@ class TrackingSampler(torch.utils.data.Dataset):
         return torch.tensor([int(cx-w/2), int(cy-h/2), int(w), int(h)])
 
     def sample_seq_from_dataset(self, dataset, is_video_dataset):
+        seq_id, frame_index, seq_info_dict = self._sample_sequence(dataset, is_video_dataset)
+        return seq_id, seq_info_dict['visible'], seq_info_dict
 
-        # Sample a sequence with enough visible frames
-        enough_visible_frames = False
-        while not enough_visible_frames:
-            # Sample a sequence
+    def _sample_sequence(self, dataset, is_video_dataset):
+        """ Samples a sequence with enough visible frames.
+        returns:
+            seq_id, frame_index (None for image datasets), seq_info_dict
+        """
+        if not is_video_dataset:
             seq_id = random.randint(0, dataset.get_num_sequences() - 1)
-
-            # Sample frames
-            seq_info_dict = dataset.get_sequence_info(seq_id)
-            visible = seq_info_dict['visible']
-
-            enough_visible_frames = visible.type(torch.int64).sum().item() > 2 * (
-                    self.num_search_frames + self.num_template_frames) and len(visible) >= 20
-
-            enough_visible_frames = enough_visible_frames or not is_video_dataset
-        return seq_id, visible, seq_info_dict
+            return seq_id, None, dataset.get_sequence_info(seq_id)
+        d_idx = self._dataset_idx[id(dataset)]
+        seq_id = random.choice(self._eligible_seqs[d_idx])
+        frame_index = self._frame_index[(d_idx, seq_id)]
+        return seq_id, frame_index, frame_index['seq_info']
 
     def get_one_search(self):
         # Select a dataset
@@ -281,13 +410,13 @@ class TrackingSampler(torch.utils.data.Dataset):
 
         is_video_dataset = dataset.is_video_sequence()
         # sample a sequence
-        seq_id, visible, seq_info_dict = self.sample_seq_from_dataset(dataset, is_video_dataset)
+        seq_id, frame_index, seq_info_dict = self._sample_sequence(dataset, is_video_dataset)
         # sample a frame
         if is_video_dataset:
             if self.frame_sample_mode == "stark":
-                search_frame_ids = self._sample_visible_ids(seq_info_dict["valid"], num_ids=1)
+                search_frame_ids = self._sample_ids(frame_index['valid'], num_ids=1)
             else:
-                search_frame_ids = self._sample_visible_ids(visible, num_ids=1, allow_invisible=True)
+                search_frame_ids = [random.randrange(frame_index['num_frames'])]
         else:
             search_frame_ids = [1]
         # get the image, bounding box and other info
@@ -295,53 +424,55 @@ class TrackingSampler(torch.utils.data.Dataset):
 
         return search_frames, search_anno, meta_obj_test
 
-    def get_frame_ids_trident(self, visible):
-        # get template and search ids in a 'trident' manner
+    def get_frame_ids_causal(self, frame_index):
+        # get template and search ids in a causal manner. A range without visible frame is extended up to the
+        # nearest visible frame (base_ids guarantees that there is one)
+        visible_ids = frame_index['visible']
+        base_frame_id = int(random.choice(frame_index['base_ids']))
+        pos = int(np.searchsorted(visible_ids, base_frame_id))
+
+        min_id = min(base_frame_id - self.max_gap, int(visible_ids[pos - 1])) if pos > 0 else 0
+        prev_frame_ids = self._sample_ids(visible_ids, self.num_template_frames - 1, min_id, base_frame_id)
+        template_frame_ids = [base_frame_id] + prev_frame_ids
+
+        max_id = max(base_frame_id + self.max_gap, int(visible_ids[pos + 1]) + 1)
+        search_frame_ids = self._sample_ids(visible_ids, self.num_search_frames, base_frame_id + 1, max_id)
+        # Additional search frames from the same window
+        extra_search_frame_ids = [self._sample_ids(visible_ids, self.num_search_frames, base_frame_id + 1, max_id)
+                                  for _ in range(self.num_extra_search)]
+        return template_frame_ids, search_frame_ids, extra_search_frame_ids
+
+    def _get_frame_ids_interval(self, frame_index):
+        # first sample the search frame, then the initial template among the visible frames of an allowed side
+        # (see _index_sequence). This draws the (template, search) pairs uniformly among the ones which have dynamic
+        # templates for all the max_gap
+        visible_ids = frame_index['visible']
+        search_pos = random.choices(range(len(visible_ids)), cum_weights=frame_index['search_cum_weights'])[0]
+        num_after = len(visible_ids) - search_pos if frame_index['forward'][search_pos] else 0
+        num_before = search_pos if frame_index['backward'][search_pos] else 0
+        r = random.randrange(num_after + num_before)
+        template_pos = search_pos + r if r < num_after else r - num_after
+        template_frame_id1 = [int(visible_ids[template_pos])]  # the initial template id
+        search_frame_ids = [int(visible_ids[search_pos])]  # the search region id
+
+        # get the dynamic template id
         template_frame_ids_extra = []
-        while None in template_frame_ids_extra or len(template_frame_ids_extra) == 0:
-            template_frame_ids_extra = []
-            # first randomly sample two frames from a video
-            template_frame_id1 = self._sample_visible_ids(visible, num_ids=1)  # the initial template id
-            search_frame_ids = self._sample_visible_ids(visible, num_ids=1)  # the search region id
-            # get the dynamic template id
-            for max_gap in self.max_gap:
-                if template_frame_id1[0] >= search_frame_ids[0]:
-                    min_id, max_id = search_frame_ids[0], search_frame_ids[0] + max_gap
-                else:
-                    min_id, max_id = search_frame_ids[0] - max_gap, search_frame_ids[0]
-                if self.frame_sample_mode == "trident_pro":
-                    f_id = self._sample_visible_ids(visible, num_ids=1, min_id=min_id, max_id=max_id,
-                                                    allow_invisible=True)
-                else:
-                    f_id = self._sample_visible_ids(visible, num_ids=1, min_id=min_id, max_id=max_id)
-                if f_id is None:
-                    template_frame_ids_extra += [None]
-                else:
-                    template_frame_ids_extra += f_id
-
+        for max_gap in self.max_gap:
+            if template_frame_id1[0] >= search_frame_ids[0]:
+                min_id, max_id = search_frame_ids[0], search_frame_ids[0] + max_gap
+            else:
+                min_id, max_id = search_frame_ids[0] - max_gap, search_frame_ids[0]
+            template_frame_ids_extra += self._sample_ids(frame_index['extra_ids'], num_ids=1, min_id=min_id,
+                                                         max_id=max_id)
         template_frame_ids = template_frame_id1 + template_frame_ids_extra
         return template_frame_ids, search_frame_ids
 
-    def get_frame_ids_stark(self, visible, valid):
-        # get template and search ids in a 'stark' manner
-        template_frame_ids_extra = []
-        while None in template_frame_ids_extra or len(template_frame_ids_extra) == 0:
-            template_frame_ids_extra = []
-            # first randomly sample two frames from a video
-            template_frame_id1 = self._sample_visible_ids(visible, num_ids=1)  # the initial template id
-            search_frame_ids = self._sample_visible_ids(visible, num_ids=1)  # the search region id
-            # get the dynamic template id
-            for max_gap in self.max_gap:
-                if template_frame_id1[0] >= search_frame_ids[0]:
-                    min_id, max_id = search_frame_ids[0], search_frame_ids[0] + max_gap
-                else:
-                    min_id, max_id = search_frame_ids[0] - max_gap, search_frame_ids[0]
-                """we require the frame to be valid but not necessary visible"""
-                f_id = self._sample_visible_ids(valid, num_ids=1, min_id=min_id, max_id=max_id)
-                if f_id is None:
-                    template_frame_ids_extra += [None]
-                else:
-                    template_frame_ids_extra += f_id
+    def get_frame_ids_trident(self, frame_index):
+        # get template and search ids in a 'trident' manner. The dynamic templates are visible frames ('trident') or
+        # any frame ('trident_pro')
+        return self._get_frame_ids_interval(frame_index)
 
-        template_frame_ids = template_frame_id1 + template_frame_ids_extra
-        return template_frame_ids, search_frame_ids
+    def get_frame_ids_stark(self, frame_index):
+        # get template and search ids in a 'stark' manner. We require the dynamic templates to be valid but not
+        # necessary visible
+        return self._get_frame_ids_interval(frame_index)
@@ -1,2 +1,2 @@
-
-from .rgbdt import RGBDT
\ No newline at end of file
+from .rgbdt import RGBDT
+from .rgbdt_lmdb import RGBDT_lmdb
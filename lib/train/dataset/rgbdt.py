@@ -9,34 +9,106 @@ from .base_video_dataset import BaseVideoDataset
 from lib.train.data import jpeg4py_loader
 from lib.train.admin import env_settings
 import cv2
+from lib.utils import stage_timer
+
+def get_rgbdt_frame(color_path, depth_path, infrared_path, depth_clip=False, depth_stats=None):
+    with stage_timer.timed('decode'):
+        if color_path:
+            rgb = cv2.imread(color_path)
+            rgb = cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB)
+        else:
+            rgb = None
+
+        if depth_path:
+            dp = cv2.imread(depth_path, -1)
+        else:
+            dp = None
+
+        if infrared_path:
+            infrared = cv2.imread(infrared_path, -1)
+            infrared = cv2.cvtColor(infrared, cv2.COLOR_BGR2RGB)
+        else:
+            infrared = None
+
+    return merge_rgbdt_frame(rgb, dp, infrared, depth_clip=depth_clip, depth_stats=depth_stats)
+
+
+def merge_rgbdt_frame(rgb, dp, infrared, depth_clip=False, depth_stats=None):
+    """ Merge decoded colour (RGB), raw 16-bit depth and infrared (RGB) frames into one 9-channel image.
+    The depth is (optionally) clipped, min-max normalized and converted to a JET colormap.
+    depth_stats - (median, clip, min, max) of the raw depth, see compute_depth_stats. Computed on the fly if None. """
+    with stage_timer.timed('colormap'):
+        if depth_clip:
+            if depth_stats is None:
+                depth_stats = compute_depth_stats(dp)
+            _, clip, min_depth, max_depth = depth_stats
+            dp = np.take(get_depth_lut(clip, min_depth, max_depth), dp)
+        else:
+            dp = cv2.normalize(dp, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+            dp = np.asarray(dp, dtype=np.uint8)
+        colormap = cv2.applyColorMap(dp, cv2.COLORMAP_JET)  # (h,w) -> (h,w,3)
+        img = cv2.merge((rgb, colormap, infrared))
+    return img
 
-def get_rgbdt_frame(color_path, depth_path, infrared_path, depth_clip=False):
-    if color_path:
-        rgb = cv2.imread(color_path)
-        rgb = cv2.cvtColor(rgb, cv2.COLOR_BGR2RGB)
-    else:
-        rgb = None
 
-    if depth_path:
-        dp = cv2.imread(depth_path, -1)
+def compute_depth_stats(dp):
+    """ Median, clip value (min(3 * median, 10000)), min and max of a raw depth frame.
+    Uses a histogram of the uint16 values, which gives the same median as np.median but is much faster. """
+    hist = np.bincount(dp.ravel())
+    cum_hist = np.cumsum(hist)
+    num = cum_hist[-1]
+    # the k-th smallest value is the first value whose cumulative count exceeds k
+    median = (np.searchsorted(cum_hist, (num - 1) // 2, side='right') +
+              np.searchsorted(cum_hist, num // 2, side='right')) / 2.0
+    clip = int(min(median * 3, 10000))
+    min_depth = int(np.searchsorted(cum_hist, 0, side='right'))
+    max_depth = len(hist) - 1
+    return median, clip, min_depth, max_depth
+
+
+def get_depth_lut(clip, min_depth, max_depth):
+    """ uint16 -> uint8 look-up table equivalent to clipping the depth at clip and min-max normalizing to [0, 255]. """
+    clip = int(clip)
+    min_depth, max_depth = min(int(min_depth), clip), min(int(max_depth), clip)
+    # Normalizing the clipped value range with OpenCV keeps the rounding identical to cv2.normalize on the frame
+    values = np.clip(np.arange(65536), min_depth, max_depth).astype(np.uint16)
+    lut = cv2.normalize(values, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
+    return np.asarray(lut, dtype=np.uint8).ravel()
+
+
+def read_depth_stats(depth_stats_file):
+    """ Read a depth_stats.txt file (frame_name,median,clip,min,max per line), see tracking/create_rgbdt_depth_stats.py.
+    Returns a (num_frames, 4) array, frames without statistics are nan. depth_stats_file can be a path or a buffer. """
+    data = pandas.read_csv(depth_stats_file, delimiter=',', header=None, dtype={0: str}, na_filter=False,
+                           low_memory=False)
+    frame_names = data.iloc[:, 0].values.tolist()
+    stats_data = data.iloc[:, 1:5].values.astype(np.float64)
 
-        if depth_clip:
-            max_depth = min(np.median(dp) * 3, 10000)
-            dp[dp > max_depth] = max_depth
-    else:
-        dp = None
+    max_frame_num = max(int(frame_name.split('.')[0]) for frame_name in frame_names)
+    stats = np.full((max_frame_num, 4), np.nan)
+    for i, frame_name in enumerate(frame_names):
+        stats[int(frame_name.split('.')[0]) - 1] = stats_data[i]
+    return stats
 
 
-    if infrared_path:
-        infrared = cv2.imread(infrared_path, -1)
-        infrared = cv2.cvtColor(infrared, cv2.COLOR_BGR2RGB)
+def read_bb_anno(bb_anno_file):
+    """ Read a RGBDT groundtruth file (frame_name,x,y,w,h per line). bb_anno_file can be a path or a buffer. """
+    data = pandas.read_csv(bb_anno_file, delimiter=',', header=None,
+                       dtype={0: str, 1: np.float32, 2: np.float32, 3: np.float32, 4: np.float32}, na_filter=False,
+                       low_memory=False)
+    frame_names = data.iloc[:, 0].values.tolist()
+    gt_data = data.iloc[:, 1:5].values
 
+    max_frame_num = int(frame_names[-1].split('.')[0])
+
+    gt = np.zeros((max_frame_num, 4), dtype=np.float32)
+
+    for i, frame_name in enumerate(frame_names):
+        frame_num = int(frame_name.split('.')[0])
+        gt[frame_num - 1] = gt_data[i]
+
+    return torch.tensor(gt)
 
-    dp = cv2.normalize(dp, None, alpha=0, beta=255, norm_type=cv2.NORM_MINMAX)
-    dp = np.asarray(dp, dtype=np.uint8)
-    colormap = cv2.applyColorMap(dp, cv2.COLORMAP_JET)  # (h,w) -> (h,w,3)
-    img = cv2.merge((rgb, colormap, infrared))
-    return img
 
 class RGBDT(BaseVideoDataset):
     """ DepthTrack dataset.
@@ -63,6 +135,7 @@ class RGBDT(BaseVideoDataset):
         super().__init__('rgbdt', root, image_loader)
 
         self.dtype = dtype  # colormap or depth
+        self.depth_stats = {}  # per-sequence depth statistics, loaded lazily
         self.sequence_list = self._build_sequence_list(root)
 
         self.seq_per_class, self.class_list = self._build_class_list()
@@ -109,21 +182,22 @@ class RGBDT(BaseVideoDataset):
 
     def _read_bb_anno(self, seq_path):
         bb_anno_file = os.path.join(seq_path, "groundtruth.txt")
-        data = pandas.read_csv(bb_anno_file, delimiter=',', header=None,
-                           dtype={0: str, 1: np.float32, 2: np.float32, 3: np.float32, 4: np.float32}, na_filter=False,
-                           low_memory=False)
-        frame_names = data.iloc[:, 0].values.tolist()
-        gt_data = data.iloc[:, 1:5].values
-
-        max_frame_num = int(frame_names[-1].split('.')[0])
-
-        gt = np.zeros((max_frame_num, 4), dtype=np.float32)
-
-        for i, frame_name in enumerate(frame_names):
-            frame_num = int(frame_name.split('.')[0])
-            gt[frame_num - 1] = gt_data[i]
-
-        return torch.tensor(gt)
+        return read_bb_anno(bb_anno_file)
+
+    def _read_depth_stats(self, seq_path):
+        depth_stats_file = os.path.join(seq_path, "depth_stats.txt")
+        if not os.path.isfile(depth_stats_file):
+            return None
+        return read_depth_stats(depth_stats_file)
+
+    def _get_depth_stats(self, seq_path, frame_id):
+        """ Precomputed (median, clip, min, max) of the depth frame, None if not available. """
+        if seq_path not in self.depth_stats:
+            self.depth_stats[seq_path] = self._read_depth_stats(seq_path)
+        stats = self.depth_stats[seq_path]
+        if stats is None or frame_id >= len(stats) or np.isnan(stats[frame_id]).any():
+            return None
+        return stats[frame_id]
 
     def _get_sequence_path(self, seq_id):
         seq_name = self.sequence_list[seq_id]
@@ -157,7 +231,8 @@ class RGBDT(BaseVideoDataset):
         '''
         color_path, depth_path, infrared_path = self._get_frame_path(seq_path, frame_id)
         # if_reshape_matrix = get_infrared_matrix(seq_path, frame_id)
-        img = get_rgbdt_frame(color_path, depth_path, infrared_path, depth_clip=True)
+        img = get_rgbdt_frame(color_path, depth_path, infrared_path, depth_clip=True,
+                              depth_stats=self._get_depth_stats(seq_path, frame_id))
         return img
 
     def _get_class(self, seq_path):
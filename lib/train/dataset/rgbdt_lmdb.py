@@ -0,0 +1,58 @@
+import io
+import cv2
+from .rgbdt import RGBDT, merge_rgbdt_frame, read_bb_anno, read_depth_stats
+from lib.train.data import jpeg4py_loader
+from lib.train.admin import env_settings
+from lib.utils.lmdb_utils import get_lmdb_handle, decode_img, decode_img_unchanged, decode_str
+from lib.utils import stage_timer
+
+
+class RGBDT_lmdb(RGBDT):
+    """ RGBDT dataset read from a packed LMDB (see tracking/create_rgbdt_lmdb.py).
+
+    The LMDB stores the original PNG bytes of every frame under the keys
+    "<seq>/color/<frame>.png", "<seq>/depth/<frame>.png" and "<seq>/infrared/<frame>.png",
+    the annotation under "<seq>/groundtruth.txt", the (optional) depth statistics under "<seq>/depth_stats.txt"
+    and the sequence names under "list.txt".
+    """
+
+    def __init__(self, root=None, dtype='rgbcolormap', image_loader=jpeg4py_loader):
+        """
+        args:
+            root     - path to the packed lmdb.
+            dtype    - see RGBDT.
+        """
+        root = env_settings().rgbdt_lmdb_dir if root is None else root
+        super().__init__(root, dtype, image_loader)
+
+    def _build_sequence_list(self, root):
+        sequence_list = [seq for seq in decode_str(root, 'list.txt').split('\n') if seq]
+        return sequence_list
+
+    def _read_bb_anno(self, seq_path):
+        bb_anno_file = io.StringIO(decode_str(self.root, seq_path + '/groundtruth.txt'))
+        return read_bb_anno(bb_anno_file)
+
+    def _read_depth_stats(self, seq_path):
+        depth_stats_file = get_lmdb_handle(self.root).get((seq_path + '/depth_stats.txt').encode())
+        if depth_stats_file is None:
+            return None
+        return read_depth_stats(io.StringIO(depth_stats_file.decode()))
+
+    def _get_sequence_path(self, seq_id):
+        # Sequence "path" is the key prefix inside the lmdb
+        return self.sequence_list[seq_id]
+
+    def _get_frame_path(self, seq_path, frame_id):
+        frame_name = '{:08}.png'.format(frame_id+1)  # frames start from 1
+        return '/'.join((seq_path, 'color', frame_name)), '/'.join((seq_path, 'depth', frame_name)), \
+               '/'.join((seq_path, 'infrared', frame_name))
+
+    def _get_frame(self, seq_path, frame_id):
+        color_key, depth_key, infrared_key = self._get_frame_path(seq_path, frame_id)
+        with stage_timer.timed('decode'):
+            rgb = decode_img(self.root, color_key)
+            dp = decode_img_unchanged(self.root, depth_key)
+            infrared = cv2.cvtColor(decode_img_unchanged(self.root, infrared_key), cv2.COLOR_BGR2RGB)
+        return merge_rgbdt_frame(rgb, dp, infrared, depth_clip=True,
+                                 depth_stats=self._get_depth_stats(seq_path, frame_id))
@@ -23,12 +23,14 @@ def init_seeds(seed):
 
 def run_training(script_name, config_name, cudnn_benchmark=True, local_rank=-1, save_dir=None, base_seed=None,
                  use_lmdb=False, script_name_prv=None, config_name_prv=None, use_wandb=False,
-                 distill=None, script_teacher=None, config_teacher=None):
+                 distill=None, script_teacher=None, config_teacher=None, device='cuda', profile_steps=None):
     """Run the train script.
     args:
         script_name: Name of emperiment in the "experiments/" folder.
         config_name: Name of the yaml file in the "experiments/<script_name>".
         cudnn_benchmark: Use cudnn benchmark or not (default is True).
+        device: 'cuda' or 'cpu'.
+        profile_steps: 'start:stop' range of training steps profiled with torch.profiler (overrides the yaml).
     """
     if save_dir is None:
         print("save_dir dir is not given. Use the default dir instead.")
@@ -42,7 +44,8 @@ def run_training(script_name, config_name, cudnn_benchmark=True, local_rank=-1,
     '''2021.1.5 set seed for different process'''
     if base_seed is not None:
         if local_rank != -1:
-            init_seeds(base_seed + local_rank)
+            # global rank, the local ranks repeat on every host
+            init_seeds(base_seed + dist.get_rank())
         else:
             init_seeds(base_seed)
 
@@ -53,11 +56,13 @@ def run_training(script_name, config_name, cudnn_benchmark=True, local_rank=-1,
     if script_name_prv is not None and config_name_prv is not None:
         settings.project_path_prv = 'train/{}/{}'.format(script_name_prv, config_name_prv)
     settings.local_rank = local_rank
+    settings.device_type = device
     settings.save_dir = os.path.abspath(save_dir)
     settings.use_lmdb = use_lmdb
     prj_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
     settings.cfg_file = os.path.join(prj_dir, 'experiments/%s/%s.yaml' % (script_name, config_name))
     settings.use_wandb = use_wandb
+    settings.profile_steps = profile_steps
     if distill:
         settings.distill = distill
         settings.script_teacher = script_teacher
@@ -89,18 +94,32 @@ def main():
     parser.add_argument('--distill', type=int, choices=[0, 1], default=0)  # whether to use knowledge distillation
     parser.add_argument('--script_teacher', type=str, help='teacher script name')
     parser.add_argument('--config_teacher', type=str, help='teacher yaml configure file name')
+    # for distributed training on cpu (torchrun ... --backend gloo --device cpu)
+    parser.add_argument('--backend', type=str, choices=['nccl', 'gloo'], default='nccl',
+                        help='torch.distributed backend')
+    parser.add_argument('--device', type=str, choices=['cuda', 'cpu'], default='cuda')
+    parser.add_argument('--num_threads', type=int, default=0, help='torch intra-op threads per process (0: default)')
+    parser.add_argument('--profile-steps', type=str, default=None,
+                        help="profile the training steps 'start:stop' with torch.profiler, e.g. 50:60")
 
     args = parser.parse_args()
+    # torchrun passes the local rank in the environment
+    if args.local_rank == -1 and 'LOCAL_RANK' in os.environ:
+        args.local_rank = int(os.environ['LOCAL_RANK'])
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
     if args.local_rank != -1:
-        dist.init_process_group(backend='nccl')
-        torch.cuda.set_device(args.local_rank)
-    else:
+        dist.init_process_group(backend=args.backend)
+        if args.device == 'cuda':
+            torch.cuda.set_device(args.local_rank)
+    elif args.device == 'cuda':
         torch.cuda.set_device(0)
     run_training(args.script, args.config, cudnn_benchmark=args.cudnn_benchmark,
                  local_rank=args.local_rank, save_dir=args.save_dir, base_seed=args.seed,
                  use_lmdb=args.use_lmdb, script_name_prv=args.script_prv, config_name_prv=args.config_prv,
                  use_wandb=args.use_wandb,
-                 distill=args.distill, script_teacher=args.script_teacher, config_teacher=args.config_teacher)
+                 distill=args.distill, script_teacher=args.script_teacher, config_teacher=args.config_teacher,
+                 device=args.device, profile_steps=args.profile_steps)
 
 
 if __name__ == '__main__':
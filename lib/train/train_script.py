@@ -1,4 +1,5 @@
 import os
+import inspect
 # loss function related
 from lib.utils.box_ops import giou_loss
 from torch.nn.functional import l1_loss
@@ -54,14 +55,25 @@ def run(settings):
     else:
         raise ValueError("illegal script name")
 
+    # freeze the parameters which are not trained before building DDP
+    freeze_parameters(net, cfg)
+
     # wrap networks to distributed one
-    net.cuda()
+    device_type = getattr(settings, "device_type", "cuda")
+    if device_type == "cuda":
+        settings.device = torch.device("cuda:%d" % max(settings.local_rank, 0))
+    else:
+        settings.device = torch.device(device_type)
+    net.to(settings.device)
     if settings.local_rank != -1:
         # net = torch.nn.SyncBatchNorm.convert_sync_batchnorm(net)  # add syncBN converter
-        net = DDP(net, device_ids=[settings.local_rank], find_unused_parameters=True)
-        settings.device = torch.device("cuda:%d" % settings.local_rank)
-    else:
-        settings.device = torch.device("cuda:0")
+        device_ids = [settings.local_rank] if device_type == "cuda" else None
+        if is_prompt_tuning(cfg):
+            # the trained parameters (prompts, DepthIR_ORT) are all used in every iteration
+            static_graph = {'static_graph': True} if 'static_graph' in inspect.signature(DDP).parameters else {}
+            net = DDP(net, device_ids=device_ids, **static_graph)
+        else:
+            net = DDP(net, device_ids=device_ids, find_unused_parameters=True)
     settings.deep_sup = getattr(cfg.TRAIN, "DEEP_SUPERVISION", False)
     settings.distill = getattr(cfg.TRAIN, "DISTILL", False)
     settings.distill_loss_type = getattr(cfg.TRAIN, "DISTILL_LOSS_TYPE", "KL")
@@ -78,13 +90,23 @@ def run(settings):
     # Optimizer, parameters, and learning rates
     optimizer, lr_scheduler = get_optimizer_scheduler(net, cfg)
     use_amp = getattr(cfg.TRAIN, "AMP", False)
+    # TRAIN.AMP is kept as an alias of PRECISION 'fp16'
+    precision = getattr(cfg.TRAIN, "PRECISION", "fp32")
+    if use_amp and precision == "fp32":
+        precision = "fp16"
     settings.save_epoch_interval = getattr(cfg.TRAIN, "SAVE_EPOCH_INTERVAL", 1)
     settings.save_last_n_epoch = getattr(cfg.TRAIN, "SAVE_LAST_N_EPOCH", 1)
+    settings.delta_checkpoint = getattr(cfg.TRAIN, "DELTA_CKPT", False)
+    settings.keep_last_n_ckpt = getattr(cfg.TRAIN, "KEEP_LAST_N_CKPT", 0)
+    settings.base_checkpoint = cfg.MODEL.PRETRAIN_FILE
+    # the command line range has priority over the yaml one
+    settings.profile_steps = getattr(settings, 'profile_steps', None) or getattr(cfg.TRAIN, "PROFILE_STEPS", "")
 
     if loader_val is None:
-        trainer = LTRTrainer(actor, [loader_train], optimizer, settings, lr_scheduler, use_amp=use_amp)
+        trainer = LTRTrainer(actor, [loader_train], optimizer, settings, lr_scheduler, precision=precision)
     else:
-        trainer = LTRTrainer(actor, [loader_train, loader_val], optimizer, settings, lr_scheduler, use_amp=use_amp)
+        trainer = LTRTrainer(actor, [loader_train, loader_val], optimizer, settings, lr_scheduler,
+                             precision=precision)
     
     # train process
     trainer.train(cfg.TRAIN.EPOCH, load_latest=True, fail_safe=True)
@@ -3,6 +3,8 @@ import glob
 import torch
 import traceback
 from lib.train.admin import multigpu
+from lib.train.admin.async_writer import AsyncWriter
+from lib.utils import ckpt_utils
 from torch.utils.data.distributed import DistributedSampler
 
 
@@ -30,6 +32,10 @@ class BaseTrainer:
         self.epoch = 0
         self.stats = {}
 
+        # checkpoints are written in the background from a CPU snapshot
+        self._ckpt_writer = None
+        self._base_hash = None
+
         self.device = getattr(settings, 'device', None)
         if self.device is None:
             self.device = torch.device("cuda:0" if torch.cuda.is_available() and settings.use_gpu else "cpu")
@@ -108,13 +114,19 @@ class BaseTrainer:
                 else:
                     raise
 
+        if self._ckpt_writer is not None:
+            self._ckpt_writer.flush()
         print('Finished training!')
 
     def train_epoch(self):
         raise NotImplementedError
 
     def save_checkpoint(self):
-        """Saves a checkpoint of the network and other variables."""
+        """Saves a checkpoint of the network and other variables.
+
+        With settings.delta_checkpoint, only the trainable parameters and the buffers of the network are saved, with a
+        hash of the frozen base weights (see lib/utils/ckpt_utils.py). The state is copied to the CPU here and written
+        by a background thread. settings.keep_last_n_ckpt > 0 removes the older checkpoints."""
 
         net = self.actor.net.module if multigpu.is_multi_gpu(self.actor.net) else self.actor.net
 
@@ -124,13 +136,22 @@ class BaseTrainer:
             'epoch': self.epoch,
             'actor_type': actor_type,
             'net_type': net_type,
-            'net': net.state_dict(),
             'net_info': getattr(net, 'info', None),
             'constructor': getattr(net, 'constructor', None),
             'optimizer': self.optimizer.state_dict(),
             'stats': self.stats,
             'settings': self.settings
         }
+        if getattr(self.settings, 'delta_checkpoint', False):
+            # the base weights are frozen, hash them once
+            if self._base_hash is None:
+                self._base_hash = ckpt_utils.base_hash(net)
+            state['net_delta'] = ckpt_utils.delta_state_dict(net)
+            state['base_hash'] = self._base_hash
+            state['base_file'] = getattr(self.settings, 'base_checkpoint', None)
+        else:
+            state['net'] = net.state_dict()
+        state = ckpt_utils.cpu_snapshot(state)
 
         directory = '{}/{}'.format(self._checkpoint_dir, self.settings.project_path)
         print(directory)
@@ -138,14 +159,14 @@ class BaseTrainer:
             print("directory doesn't exist. creating...")
             os.makedirs(directory)
 
-        # First save as a tmp file
-        tmp_file_path = '{}/{}_ep{:04d}.tmp'.format(directory, net_type, self.epoch)
-        torch.save(state, tmp_file_path)
-
         file_path = '{}/{}_ep{:04d}.pth.tar'.format(directory, net_type, self.epoch)
 
-        # Now rename to actual checkpoint. os.rename seems to be atomic if files are on same filesystem. Not 100% sure
-        os.rename(tmp_file_path, file_path)
+        if self._ckpt_writer is None:
+            # at most one checkpoint waiting for the disk
+            self._ckpt_writer = AsyncWriter(max_pending=1)
+        self._ckpt_writer.submit(ckpt_utils.save_checkpoint_file, state, file_path)
+        self._ckpt_writer.submit(ckpt_utils.prune_checkpoints, directory, net_type,
+                                 getattr(self.settings, 'keep_last_n_ckpt', 0))
 
     def load_checkpoint(self, checkpoint = None, fields = None, ignore_fields = None, load_constructor = False):
         """Loads a network checkpoint file.
@@ -164,6 +185,9 @@ class BaseTrainer:
         actor_type = type(self.actor).__name__
         net_type = type(net).__name__
 
+        if self._ckpt_writer is not None:
+            self._ckpt_writer.flush()
+
         if checkpoint is None:
             # Load most recent checkpoint
             checkpoint_list = sorted(glob.glob('{}/{}/{}_ep*.pth.tar'.format(self._checkpoint_dir,
@@ -201,7 +225,8 @@ class BaseTrainer:
             ignore_fields = ['settings']
 
             # Never load the scheduler. It exists in older checkpoints.
-        ignore_fields.extend(['lr_scheduler', 'constructor', 'net_type', 'actor_type', 'net_info'])
+        ignore_fields.extend(['lr_scheduler', 'constructor', 'net_type', 'actor_type', 'net_info', 'base_hash',
+                              'base_file'])
 
         # Load all fields
         for key in fields:
@@ -209,6 +234,9 @@ class BaseTrainer:
                 continue
             if key == 'net':
                 net.load_state_dict(checkpoint_dict[key])
+            elif key == 'net_delta':
+                # the network is built with the base weights, check them and load the delta on top
+                ckpt_utils.load_delta(net, checkpoint_dict)
             elif key == 'optimizer':
                 self.optimizer.load_state_dict(checkpoint_dict[key])
             else:
@@ -267,7 +295,8 @@ class BaseTrainer:
 
         assert net_type == checkpoint_dict['net_type'], 'Network is not of correct type.'
 
-        missing_k, unexpected_k = net.load_state_dict(checkpoint_dict["net"], strict=False)
+        net_state = checkpoint_dict["net"] if "net" in checkpoint_dict else checkpoint_dict["net_delta"]
+        missing_k, unexpected_k = net.load_state_dict(net_state, strict=False)
         print("previous checkpoint is loaded.")
         print("missing keys: ", missing_k)
         print("unexpected keys:", unexpected_k)
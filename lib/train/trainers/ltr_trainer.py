@@ -1,19 +1,24 @@
 import os
+import math
 import datetime
+import contextlib
 from collections import OrderedDict
 from lib.train.trainers import BaseTrainer
 from lib.train.admin import AverageMeter, StatValue
-from lib.train.admin import TensorboardWriter
+from lib.train.admin import TensorboardWriter, AsyncWriter, Telemetry, loader_queue_depth
+from lib.train.admin import multigpu
+from lib.utils import TensorDict
 import torch
 import time
 from torch.utils.data.distributed import DistributedSampler
-from torch.cuda.amp import autocast
 from torch.cuda.amp import GradScaler
+from lib.utils import amp_utils
+from lib.utils.profiling import StepProfiler
 from lib.utils.misc import get_world_size
 
 
 class LTRTrainer(BaseTrainer):
-    def __init__(self, actor, loaders, optimizer, settings, lr_scheduler=None, use_amp=False):
+    def __init__(self, actor, loaders, optimizer, settings, lr_scheduler=None, use_amp=False, precision=None):
         """
         args:
             actor - The actor for training the network
@@ -22,6 +27,8 @@ class LTRTrainer(BaseTrainer):
             optimizer - The optimizer used for training, e.g. Adam
             settings - Training settings
             lr_scheduler - Learning rate scheduler
+            use_amp - Legacy switch, same as precision='fp16'
+            precision - 'fp32', 'bf16' or 'fp16', the autocast precision of the forward pass (see lib.utils.amp_utils)
         """
         super().__init__(actor, loaders, optimizer, settings, lr_scheduler)
 
@@ -29,6 +36,11 @@ class LTRTrainer(BaseTrainer):
 
         # Initialize statistics variables
         self.stats = OrderedDict({loader.name: None for loader in self.loaders})
+        # Running sums of the statistics not read back from the device yet, see _update_stats
+        self._pending_stats = {}
+        # DDP with static_graph records the graph in the first step, which must not skip the synchronization
+        self._ddp_synced = False
+        self.log_writer = AsyncWriter()
 
         # Initialize tensorboard
         if settings.local_rank in [-1, 0]:
@@ -42,10 +54,16 @@ class LTRTrainer(BaseTrainer):
                 cur_train_samples = self.loaders[0].dataset.samples_per_epoch * max(0, self.epoch - 1)
                 interval = (world_size * settings.batchsize)  # * interval
 
+        self._init_telemetry()
+        self._init_profiler()
+
         self.move_data_to_gpu = getattr(settings, 'move_data_to_gpu', True)
         self.settings = settings
-        self.use_amp = use_amp
-        if use_amp:
+        if precision is None:
+            precision = 'fp16' if use_amp else 'fp32'
+        self.precision = amp_utils.check_precision(precision)
+        self.use_amp = amp_utils.needs_grad_scaler(self.precision)
+        if self.use_amp:
             self.scaler = GradScaler()
 
     def _set_default_settings(self):
@@ -58,6 +76,32 @@ class LTRTrainer(BaseTrainer):
             if getattr(self.settings, param, None) is None:
                 setattr(self.settings, param, default_value)
 
+    def _init_telemetry(self):
+        """ Per-iteration timings (lib/train/admin/telemetry.py), written next to the training log. Every rank writes
+        its own file, only rank 0 writes to tensorboard. """
+        cfg = getattr(self.settings, 'telemetry', {})
+        rank = max(self.settings.local_rank, 0) if not torch.distributed.is_initialized() \
+            else torch.distributed.get_rank()
+        log_file = getattr(self.settings, 'log_file', None)
+        enabled = cfg.get('ENABLE', False) and log_file is not None
+        jsonl_path = None
+        if enabled:
+            jsonl_path = os.path.splitext(log_file)[0] + ('-telemetry.jsonl' if rank == 0 else
+                                                         '-telemetry-rank{}.jsonl'.format(rank))
+        self.telemetry = Telemetry(jsonl_path, self.log_writer,
+                                   tensorboard_writer=getattr(self, 'tensorboard_writer', None),
+                                   enabled=enabled, sync=cfg.get('SYNC', False), device=self.device,
+                                   data_wait_alert=cfg.get('DATA_WAIT_ALERT', 0.2), window=cfg.get('WINDOW', 50),
+                                   alert_file=log_file)
+
+    def _init_profiler(self):
+        """ torch.profiler capture of the training steps settings.profile_steps ('start:stop', global steps as in the
+        telemetry), exported to <save_dir>/profiles. """
+        rank = torch.distributed.get_rank() if torch.distributed.is_initialized() else 0
+        name = 'train' if rank == 0 else 'train_rank{}'.format(rank)
+        out_dir = os.path.join(getattr(self.settings, 'save_dir', None) or '.', 'profiles')
+        self.profiler = StepProfiler(getattr(self.settings, 'profile_steps', None), out_dir, name)
+
     def cycle_dataset(self, loader):
         """Do a cycle of training or validation."""
 
@@ -70,42 +114,77 @@ class LTRTrainer(BaseTrainer):
 
         self._init_timing()
 
-        for i, data in enumerate(loader, 1):
+        loader_iter = iter(loader)
+        self.telemetry.begin()
+        for i, data in enumerate(loader_iter, 1):
+            if loader.training:
+                self.profiler.step((self.epoch - 1) * len(loader) + i)
             self.data_read_done_time = time.time()
+            self.telemetry.mark('data')
             # get inputs
             if self.move_data_to_gpu:
                 data = data.to(self.device)
+            if getattr(loader, 'device_processing', None) is not None:
+                data = loader.device_processing(data)
 
             self.data_to_gpu_time = time.time()
+            self.telemetry.mark('h2d')
 
             data['epoch'] = self.epoch
             data['settings'] = self.settings
-            # forward pass
-            if not self.use_amp:
-                loss, stats = self.actor(data)
-            else:
-                with autocast():
-                    loss, stats = self.actor(data)
-
-            # backward pass and update weights
+            batch_size = data['template_images'].shape[loader.stack_dim]
+
+            # The batch is split into accum_steps micro-batches, whose gradients are accumulated before the update
+            accum_steps = getattr(self.settings, 'accum_steps', 1) if loader.training else 1
+            micro_batches = self._split_batch(data, accum_steps, loader.stack_dim, batch_size)
             if loader.training:
                 self.optimizer.zero_grad()
+            for j, (micro_data, micro_size) in enumerate(micro_batches):
+                # DDP only all-reduces the gradients of the last micro-batch
+                with self._no_sync_context(last=j == len(micro_batches) - 1):
+                    # forward pass
+                    with amp_utils.autocast(self.device, self.precision):
+                        loss, stats = self.actor(micro_data)
+                    self.telemetry.mark('forward')
+
+                    # backward pass
+                    if loader.training:
+                        loss = loss * (micro_size / batch_size)
+                        if not self.use_amp:
+                            loss.backward()
+                        else:
+                            self.scaler.scale(loss).backward()
+                        self.telemetry.mark('backward')
+
+                # update statistics
+                self._update_stats(stats, micro_size, loader)
+
+            # update weights
+            if loader.training:
                 if not self.use_amp:
-                    loss.backward()
                     if self.settings.grad_clip_norm > 0:
                         torch.nn.utils.clip_grad_norm_(self.actor.net.parameters(), self.settings.grad_clip_norm)
                     self.optimizer.step()
                 else:
-                    self.scaler.scale(loss).backward()
+                    # the gradients are clipped after unscaling. step() skips the update if they are not finite
+                    if self.settings.grad_clip_norm > 0:
+                        self.scaler.unscale_(self.optimizer)
+                        torch.nn.utils.clip_grad_norm_(self.actor.net.parameters(), self.settings.grad_clip_norm)
                     self.scaler.step(self.optimizer)
                     self.scaler.update()
-
-            # update statistics
-            batch_size = data['template_images'].shape[loader.stack_dim]
-            self._update_stats(stats, batch_size, loader)
+                self._ddp_synced = True
+                self.telemetry.mark('optimizer')
 
             # print statistics
             self._print_stats(i, loader, batch_size)
+            self.telemetry.mark('log')
+            self.telemetry.end_iteration(loader.name, self.epoch, i, (self.epoch - 1) * len(loader) + i, batch_size,
+                                         loader_queue_depth(loader_iter))
+
+        # a range not finished in this epoch is cut here, the validation is not profiled
+        if loader.training:
+            self.profiler.close()
+        self._flush_stats(loader)
 
         # calculate ETA after every epoch
         epoch_time = self.prev_time - self.start_time
@@ -114,6 +193,33 @@ class LTRTrainer(BaseTrainer):
         print("Avg GPU Trans Time: %.5f" % (self.avg_gpu_trans_time / self.num_frames * batch_size))
         print("Avg Forward Time: %.5f" % (self.avg_forward_time / self.num_frames * batch_size))
 
+    @staticmethod
+    def _split_batch(data, num_splits, stack_dim, batch_size):
+        """ Split a batch into (at most) num_splits micro-batches. Returns a list of (data, micro_batch_size). """
+        num_splits = max(1, min(num_splits, batch_size))
+        if num_splits == 1:
+            return [(data, batch_size)]
+        bounds = [round(k * batch_size / num_splits) for k in range(num_splits + 1)]
+        micro_batches = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            micro_data = TensorDict()
+            for key, val in data.items():
+                if torch.is_tensor(val) and val.dim() > stack_dim and val.shape[stack_dim] == batch_size:
+                    val = val.narrow(stack_dim, start, end - start)
+                elif torch.is_tensor(val) and val.dim() == 1 and val.shape[0] == batch_size:
+                    val = val[start:end]
+                elif isinstance(val, list) and len(val) == batch_size:
+                    val = val[start:end]
+                micro_data[key] = val
+            micro_batches.append((micro_data, end - start))
+        return micro_batches
+
+    def _no_sync_context(self, last):
+        """ DDP gradient synchronization is skipped for all the micro-batches but the last one. """
+        if not last and multigpu.is_multi_gpu(self.actor.net) and self._ddp_synced:
+            return self.actor.net.no_sync()
+        return contextlib.ExitStack()
+
     def train_epoch(self):
         """Do one epoch for each loader."""
         for loader in self.loaders:
@@ -123,6 +229,7 @@ class LTRTrainer(BaseTrainer):
                     loader.sampler.set_epoch(self.epoch)
                 self.cycle_dataset(loader)
 
+        self.log_writer.flush()
         self._stats_new_epoch()
         if self.settings.local_rank in [-1, 0]:
             self._write_tensorboard()
@@ -149,10 +256,31 @@ class LTRTrainer(BaseTrainer):
                     self.stats[loader.name][var_name] = StatValue()
                 self.stats[loader.name][var_name].update(lr)
 
-        for name, val in new_stats.items():
+        # The statistics (tensors on the device) are summed in a running buffer without synchronizing, they are read
+        # back by _flush_stats when printed
+        names = list(new_stats.keys())
+        values = torch.stack([torch.as_tensor(new_stats[name], dtype=torch.float32, device=self.device)
+                              for name in names]) * batch_size
+        pending = self._pending_stats.get(loader.name)
+        if pending is not None and pending['names'] == names:
+            pending['sum'] += values
+            pending['count'] += batch_size
+        else:
+            self._flush_stats(loader)
+            self._pending_stats[loader.name] = {'names': names, 'sum': values, 'count': batch_size}
+
+    def _flush_stats(self, loader):
+        """ Read the pending statistics back from the device (one copy) and check that they are finite. """
+        pending = self._pending_stats.pop(loader.name, None)
+        if pending is None:
+            return
+        sums = pending['sum'].tolist()
+        if not all(math.isfinite(val) for val in sums):
+            raise ValueError("Network outputs is NAN! Stop Training")
+        for name, val in zip(pending['names'], sums):
             if name not in self.stats[loader.name].keys():
                 self.stats[loader.name][name] = AverageMeter()
-            self.stats[loader.name][name].update(val, batch_size)
+            self.stats[loader.name][name].update(val / pending['count'], pending['count'])
 
     def _print_stats(self, i, loader, batch_size):
         self.num_frames += batch_size
@@ -167,6 +295,7 @@ class LTRTrainer(BaseTrainer):
         self.avg_forward_time += current_time - self.data_to_gpu_time
 
         if i % self.settings.print_interval == 0 or i == loader.__len__():
+            self._flush_stats(loader)
             print_str = '[%s: %d, %d / %d] ' % (loader.name, self.epoch, i, loader.__len__())
             print_str += 'FPS: %.1f (%.1f)  ,  ' % (average_fps, batch_fps)
 
@@ -187,8 +316,7 @@ class LTRTrainer(BaseTrainer):
 
             print(print_str[:-5])
             log_str = print_str[:-5] + '\n'
-            with open(self.settings.log_file, 'a') as f:
-                f.write(log_str)
+            self.log_writer.append_text(self.settings.log_file, log_str)
 
     def _stats_new_epoch(self):
         # Record learning rate
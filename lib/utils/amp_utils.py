@@ -0,0 +1,38 @@
+"""
+Mixed precision helpers shared by the training loop and the trackers.
+
+The precision is one of 'fp32', 'bf16' or 'fp16'. bf16/fp16 run the network under torch.autocast on the device type
+of the inputs (CUDA, or CPU where bf16 is fast on AVX512-BF16/AMX hosts). Numerically sensitive ops are pinned to
+fp32 with fp32_region.
+"""
+import contextlib
+import torch
+
+PRECISIONS = ('fp32', 'bf16', 'fp16')
+_AUTOCAST_DTYPES = {'bf16': torch.bfloat16, 'fp16': torch.float16}
+
+
+def check_precision(precision):
+    if precision not in PRECISIONS:
+        raise ValueError("Unknown precision '{}', expected one of {}".format(precision, PRECISIONS))
+    return precision
+
+
+def autocast(device, precision):
+    """ Autocast context of the given precision for the device (torch.device or str). fp32 is a no-op context. """
+    if check_precision(precision) == 'fp32':
+        return contextlib.ExitStack()
+    return torch.autocast(device_type=torch.device(device).type, dtype=_AUTOCAST_DTYPES[precision])
+
+
+def fp32_region(tensor):
+    """ Context disabling autocast on the device of tensor. The inputs of the region still have to be cast with
+    .float(). """
+    if not hasattr(torch, 'autocast'):
+        return contextlib.ExitStack()
+    return torch.autocast(device_type=tensor.device.type, enabled=False)
+
+
+def needs_grad_scaler(precision):
+    """ Only fp16 needs loss scaling, bf16 has the exponent range of fp32. """
+    return check_precision(precision) == 'fp16'
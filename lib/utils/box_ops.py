@@ -104,3 +104,16 @@ def clip_box(box: list, H, W, margin=0):
     w = max(margin, x2-x1)
     h = max(margin, y2-y1)
     return [x1, y1, w, h]
+
+
+def clip_box_tensor(box: torch.Tensor, H, W, margin=0):
+    """ clip_box of (..., 4) (x1, y1, w, h) boxes, without leaving their device. """
+    x1, y1, w, h = box.unbind(-1)
+    x2, y2 = x1 + w, y1 + h
+    x1 = x1.clamp(min=0, max=W - margin)
+    x2 = x2.clamp(min=margin, max=W)
+    y1 = y1.clamp(min=0, max=H - margin)
+    y2 = y2.clamp(min=margin, max=H)
+    w = (x2 - x1).clamp(min=margin)
+    h = (y2 - y1).clamp(min=margin)
+    return torch.stack([x1, y1, w, h], dim=-1)
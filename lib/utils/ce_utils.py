@@ -6,9 +6,15 @@ import torch.nn.functional as F
 
 def generate_bbox_mask(bbox_mask, bbox):
     b, h, w = bbox_mask.shape
-    for i in range(b):
-        bbox_i = bbox[i].cpu().tolist()
-        bbox_mask[i, int(bbox_i[1]):int(bbox_i[1] + bbox_i[3] - 1), int(bbox_i[0]):int(bbox_i[0] + bbox_i[2] - 1)] = 1
+    # rows [int(y), int(y + h - 1)) and columns [int(x), int(x + w - 1)) of every box, for the whole batch at once
+    bbox = bbox.to(bbox_mask.device)
+    x1, y1 = bbox[:, 0].trunc(), bbox[:, 1].trunc()
+    x2, y2 = (bbox[:, 0] + bbox[:, 2] - 1).trunc(), (bbox[:, 1] + bbox[:, 3] - 1).trunc()
+    rows = torch.arange(h, device=bbox_mask.device, dtype=bbox.dtype)
+    cols = torch.arange(w, device=bbox_mask.device, dtype=bbox.dtype)
+    inside_rows = (rows >= y1[:, None]) & (rows < y2[:, None])
+    inside_cols = (cols >= x1[:, None]) & (cols < x2[:, None])
+    bbox_mask.masked_fill_(inside_rows[:, :, None] & inside_cols[:, None, :], 1)
     return bbox_mask
 
 
@@ -0,0 +1,138 @@
+"""
+Delta checkpoints for prompt tuning.
+
+Only the prompt parameters are trained on top of the frozen OSTrack weights, so a delta checkpoint stores the trainable
+parameters and the buffers of the network ('net_delta'), and a sha256 hash of all the other (frozen) entries of the
+state dict ('base_hash') together with the path of the base weights ('base_file'). Loading a delta checkpoint loads the
+base weights, checks them against the hash and then loads the delta on top.
+"""
+import copy
+import functools
+import glob
+import hashlib
+import os
+
+import torch
+
+
+def delta_keys(net):
+    """ State dict keys stored in a delta checkpoint: the trainable parameters and all the buffers. """
+    state_keys = set(net.state_dict().keys())
+    keys = [name for name, p in net.named_parameters() if p.requires_grad]
+    keys += [name for name, _ in net.named_buffers()]
+    return sorted(k for k in set(keys) if k in state_keys)
+
+
+def delta_state_dict(net):
+    state_dict = net.state_dict()
+    return {k: state_dict[k] for k in delta_keys(net)}
+
+
+def state_dict_hash(state_dict, keys=None):
+    """ sha256 over the names, dtypes, shapes and values of the given entries of state_dict (all by default). """
+    if keys is None:
+        keys = state_dict.keys()
+    h = hashlib.sha256()
+    for k in sorted(keys):
+        if k not in state_dict:
+            raise KeyError("'{}' is missing from the base weights".format(k))
+        t = state_dict[k].detach().cpu().contiguous()
+        h.update(k.encode())
+        h.update(str(t.dtype).encode())
+        h.update(str(tuple(t.shape)).encode())
+        if t.dtype == torch.bfloat16:
+            t = t.float()
+        h.update(t.numpy().tobytes())
+    return h.hexdigest()
+
+
+def base_hash(net):
+    """ Hash of the entries of the network state dict that are not stored in the delta. """
+    delta = set(delta_keys(net))
+    state_dict = net.state_dict()
+    return state_dict_hash(state_dict, [k for k in state_dict.keys() if k not in delta])
+
+
+def cpu_snapshot(obj):
+    """ Copy of obj (nested dicts/lists/tuples of tensors) with all the tensors copied to the CPU. The copy does not
+    share memory with obj, so it can be serialized in the background while training goes on. """
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((k, cpu_snapshot(v)) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(cpu_snapshot(v) for v in obj)
+    return copy.deepcopy(obj)
+
+
+def save_checkpoint_file(state, file_path):
+    """ torch.save through a tmp file, os.rename is atomic on the same filesystem. """
+    tmp_file_path = os.path.splitext(os.path.splitext(file_path)[0])[0] + '.tmp'
+    torch.save(state, tmp_file_path)
+    os.rename(tmp_file_path, file_path)
+
+
+def prune_checkpoints(directory, net_type, keep_last_n):
+    """ Remove all but the keep_last_n most recent checkpoints of net_type in directory. 0 keeps everything. """
+    if keep_last_n <= 0:
+        return
+    checkpoint_list = sorted(glob.glob('{}/{}_ep*.pth.tar'.format(directory, net_type)))
+    for path in checkpoint_list[:-keep_last_n]:
+        os.remove(path)
+
+
+def load_delta(net, checkpoint_dict, current_hash=None):
+    """ Load the delta of checkpoint_dict into net, whose other weights must already be the base weights.
+    current_hash is the base hash of net if it is known already. """
+    expected_hash = checkpoint_dict['base_hash']
+    delta = checkpoint_dict['net_delta']
+    if current_hash is None:
+        state_dict = net.state_dict()
+        current_hash = state_dict_hash(state_dict, [k for k in state_dict.keys() if k not in delta])
+    if current_hash != expected_hash:
+        raise ValueError("The base weights do not match the delta checkpoint (base hash {}, expected {}). "
+                         "The delta was trained on top of {}".format(current_hash, expected_hash,
+                                                                     checkpoint_dict.get('base_file')))
+    missing_keys, unexpected_keys = net.load_state_dict(delta, strict=False)
+    if unexpected_keys:
+        raise KeyError("Unexpected keys in the delta checkpoint: {}".format(unexpected_keys))
+
+
+@functools.lru_cache(maxsize=1)
+def _load_base_state_dict(path):
+    return torch.load(path, map_location='cpu')['net']
+
+
+@functools.lru_cache(maxsize=4)
+def _base_state_dict_hash(path, keys):
+    return state_dict_hash(_load_base_state_dict(path), keys)
+
+
+def load_network(net, checkpoint_path, base_checkpoint=None):
+    """ Load a full checkpoint, or the base weights plus a delta checkpoint, into net.
+    args:
+        net - The network.
+        checkpoint_path - Path of the checkpoint.
+        base_checkpoint - Path of the base weights for a delta checkpoint. Defaults to the 'base_file' of the delta.
+    returns:
+        The checkpoint dict.
+    """
+    checkpoint_dict = torch.load(checkpoint_path, map_location='cpu')
+    if 'net_delta' not in checkpoint_dict:
+        net.load_state_dict(checkpoint_dict['net'], strict=True)
+        return checkpoint_dict
+
+    if base_checkpoint is None:
+        base_checkpoint = checkpoint_dict.get('base_file')
+    if not base_checkpoint:
+        raise ValueError("{} is a delta checkpoint, the base weights have to be given".format(checkpoint_path))
+    # the base weights and their hash are cached, the trackers are built once per sequence
+    base_checkpoint = os.path.expanduser(base_checkpoint)
+    base_state_dict = _load_base_state_dict(base_checkpoint)
+    base_keys = tuple(k for k in net.state_dict().keys() if k not in checkpoint_dict['net_delta'])
+    missing_keys = [k for k in base_keys if k not in base_state_dict]
+    if missing_keys:
+        raise KeyError("Keys missing from the base weights {}: {}".format(base_checkpoint, missing_keys))
+    net.load_state_dict(base_state_dict, strict=False)
+    load_delta(net, checkpoint_dict, _base_state_dict_hash(base_checkpoint, base_keys))
+    return checkpoint_dict
@@ -4,6 +4,8 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 
+from lib.utils.amp_utils import fp32_region
+
 
 class FocalLoss(nn.Module, ABC):
     def __init__(self, alpha=2, beta=4):
@@ -12,6 +14,11 @@ class FocalLoss(nn.Module, ABC):
         self.beta = beta
 
     def forward(self, prediction, target):
+        # the logs are computed in fp32, also under autocast
+        with fp32_region(prediction):
+            return self._forward(prediction.float(), target.float())
+
+    def _forward(self, prediction, target):
         positive_index = target.eq(1).float()
         negative_index = target.lt(1).float()
 
@@ -12,18 +12,13 @@ def generate_heatmap(bboxes, patch_size=320, stride=16):
         gaussian_maps: list of generated heatmap
 
     """
-    gaussian_maps = []
     heatmap_size = patch_size // stride
-    for single_patch_bboxes in bboxes:
-        bs = single_patch_bboxes.shape[0]
-        gt_scoremap = torch.zeros(bs, heatmap_size, heatmap_size)
-        classes = torch.arange(bs).to(torch.long)
-        bbox = single_patch_bboxes * heatmap_size
-        wh = bbox[:, 2:]
-        centers_int = (bbox[:, :2] + wh / 2).round()
-        CenterNetHeatMap.generate_score_map(gt_scoremap, classes, wh, centers_int, 0.7)
-        gaussian_maps.append(gt_scoremap.to(bbox.device))
-    return gaussian_maps
+    bbox = bboxes * heatmap_size
+    wh = bbox[..., 2:]
+    centers_int = (bbox[..., :2] + wh / 2).round()
+    # all the maps of the batch at once, on the device of the boxes
+    gaussian_maps = CenterNetHeatMap.generate_score_maps(heatmap_size, wh, centers_int, 0.7)
+    return list(gaussian_maps.unbind(0))
 
 
 class CenterNetHeatMap(object):
@@ -36,6 +31,27 @@ class CenterNetHeatMap(object):
             channel_index = gt_class[i]
             CenterNetHeatMap.draw_gaussian(fmap[channel_index], centers_int[i], radius[i])
 
+    @staticmethod
+    def generate_score_maps(map_size, gt_wh, centers_int, min_overlap):
+        """
+        Batched version of generate_score_map / draw_gaussian, one map per box.
+        gt_wh, centers_int (torch.Tensor): shape of [..., 2]
+        Returns:
+            torch.Tensor of shape [..., map_size, map_size]
+        """
+        radius = CenterNetHeatMap.get_gaussian_radius(gt_wh, min_overlap)
+        radius = torch.clamp_min(radius, 0).type(torch.int).to(gt_wh.dtype)[..., None]
+        sigma = (2 * radius + 1) / 6
+
+        grid = torch.arange(map_size, dtype=gt_wh.dtype, device=gt_wh.device)
+        dx = grid - centers_int[..., 0:1]  # (..., W)
+        dy = grid - centers_int[..., 1:2]  # (..., H)
+        exponent = (dy[..., :, None] ** 2 + dx[..., None, :] ** 2) / (2 * sigma * sigma)[..., None]
+        # support of the drawn gaussian: the (2r+1)x(2r+1) square, without the values under eps (see gaussian2D)
+        inside = ((dy.abs() <= radius)[..., :, None] & (dx.abs() <= radius)[..., None, :] &
+                  (exponent <= -np.log(np.finfo(np.float64).eps)))
+        return torch.where(inside, torch.exp(-exponent), torch.zeros_like(exponent))
+
     @staticmethod
     def get_gaussian_radius(box_size, min_overlap):
         """
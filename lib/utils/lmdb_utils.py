@@ -1,3 +1,4 @@
+import os
 import lmdb
 import numpy as np
 import cv2
@@ -10,12 +11,19 @@ LMDB_FILELISTS = dict()
 
 def get_lmdb_handle(name):
     global LMDB_HANDLES, LMDB_FILELISTS
-    item = LMDB_HANDLES.get(name, None)
+    # lmdb environments must not be shared across fork(), so dataloader workers open their own
+    key = (name, os.getpid())
+    item = LMDB_HANDLES.get(key, None)
     if item is None:
+        # lmdb refuses to open an environment that is still open in the process, which is the case of the one inherited
+        # from the parent in a forked worker. Close the inherited copies first (this does not affect the parent)
+        for inherited_key in [k for k in LMDB_ENVS if k[0] == name]:
+            LMDB_HANDLES.pop(inherited_key).abort()
+            LMDB_ENVS.pop(inherited_key).close()
         env = lmdb.open(name, readonly=True, lock=False, readahead=False, meminit=False)
-        LMDB_ENVS[name] = env
+        LMDB_ENVS[key] = env
         item = env.begin(write=False)
-        LMDB_HANDLES[name] = item
+        LMDB_HANDLES[key] = item
 
     return item
 
@@ -30,6 +38,16 @@ def decode_img(lmdb_fname, key_name):
     return x
 
 
+def decode_img_unchanged(lmdb_fname, key_name):
+    """Decode an encoded image without any conversion (keeps 16-bit depth and the original channel order)."""
+    handle = get_lmdb_handle(lmdb_fname)
+    binfile = handle.get(key_name.encode())
+    if binfile is None:
+        print("Illegal data detected. %s %s" % (lmdb_fname, key_name))
+    s = np.frombuffer(binfile, np.uint8)
+    return cv2.imdecode(s, cv2.IMREAD_UNCHANGED)
+
+
 def decode_str(lmdb_fname, key_name):
     handle = get_lmdb_handle(lmdb_fname)
     binfile = handle.get(key_name.encode())
@@ -0,0 +1,86 @@
+"""
+torch.profiler capture of a range of steps (training iterations or tracked frames).
+
+    profiler = StepProfiler('50:60', out_dir, 'train')
+    for step, data in enumerate(loader, 1):
+        profiler.step(step)
+        ...
+    profiler.close()
+
+profiles the steps 50 to 59 (the range is half-open, as a python slice) with the shapes, the memory and the stacks of
+the ops, then writes to out_dir the Chrome trace (<name>_steps50-60_trace.json, open in chrome://tracing or Perfetto)
+and the operator summary tables (<name>_steps50-60_ops.txt). With an empty range, step() and close() do nothing.
+"""
+import os
+
+import torch
+
+
+def parse_steps(steps):
+    """ (start, stop) of a 'start:stop' range, None for an empty or None range. """
+    if not steps:
+        return None
+    try:
+        start, stop = (int(v) for v in str(steps).split(':'))
+    except ValueError:
+        raise ValueError("Invalid profile steps '{}', expected 'start:stop'".format(steps))
+    if start < 0 or stop <= start:
+        raise ValueError("Invalid profile steps '{}', expected 0 <= start < stop".format(steps))
+    return start, stop
+
+
+class StepProfiler:
+    """ Profiles the steps [start, stop) given as 'start:stop', see the module docstring. """
+
+    def __init__(self, steps, out_dir, name, row_limit=50):
+        self.range = parse_steps(steps)
+        self.out_dir = out_dir
+        self.name = name
+        self.row_limit = row_limit
+        self.profiler = None
+
+    @property
+    def active(self):
+        return self.profiler is not None
+
+    def step(self, step):
+        """ Call at the beginning of each step with its index. """
+        if self.range is None:
+            return
+        start, stop = self.range
+        if step == start and self.profiler is None:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.profiler = torch.profiler.profile(activities=activities, record_shapes=True, profile_memory=True,
+                                                   with_stack=True)
+            self.profiler.__enter__()
+        elif step == stop:
+            self.close()
+
+    def close(self):
+        """ Stop the profiler (if running, e.g. there were fewer steps than stop) and export its results. """
+        if self.profiler is None:
+            return
+        self.profiler.__exit__(None, None, None)
+        profiler, self.profiler = self.profiler, None
+        self._export(profiler)
+
+    def _export(self, profiler):
+        os.makedirs(self.out_dir, exist_ok=True)
+        base_path = os.path.join(self.out_dir, '%s_steps%d-%d' % ((self.name,) + self.range))
+        profiler.export_chrome_trace(base_path + '_trace.json')
+
+        sort_by = 'self_cuda_time_total' if torch.cuda.is_available() else 'self_cpu_time_total'
+        memory_sort_by = 'self_cuda_memory_usage' if torch.cuda.is_available() else 'self_cpu_memory_usage'
+        averages = profiler.key_averages()
+        with open(base_path + '_ops.txt', 'w') as f:
+            f.write('Operators by self time\n')
+            f.write(averages.table(sort_by=sort_by, row_limit=self.row_limit))
+            f.write('\n\nOperators by input shapes\n')
+            f.write(profiler.key_averages(group_by_input_shape=True).table(sort_by=sort_by, row_limit=self.row_limit))
+            f.write('\n\nOperators by memory\n')
+            f.write(averages.table(sort_by=memory_sort_by, row_limit=self.row_limit))
+            f.write('\n\nOperators by stack\n')
+            f.write(profiler.key_averages(group_by_stack_n=5).table(sort_by=sort_by, row_limit=self.row_limit))
+        print('Profile of %s steps %d:%d written to %s_{trace.json,ops.txt}' % ((self.name,) + self.range + (base_path,)))
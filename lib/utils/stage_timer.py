@@ -0,0 +1,124 @@
+"""
+Switchable per-stage timers.
+
+    with stage_timer.timed('decode'):
+        ...
+
+records the duration of the block under 'decode' when the timers are enabled (enable()), and is a shared no-op context
+otherwise, so the timers can stay in the hot paths. The records are kept per process, pop_records() returns and clears
+them. With a CUDA sync device, the device is synchronized before and after each timed block so that the time of the
+kernels is attributed to the block.
+"""
+import time
+from collections import defaultdict
+
+import numpy as np
+import torch
+
+_enabled = False
+_sync_device = None
+_records = defaultdict(list)
+
+
+def enable(flag=True, sync_device=None):
+    """ Enable (or disable) the timers of this process.
+    args:
+        sync_device - CUDA device synchronized around each timed block, None for no synchronization.
+    """
+    global _enabled, _sync_device
+    _enabled = flag
+    _sync_device = sync_device if sync_device is not None and torch.device(sync_device).type == 'cuda' else None
+
+
+def is_enabled():
+    return _enabled
+
+
+def _synchronize():
+    if _sync_device is not None:
+        torch.cuda.synchronize(_sync_device)
+
+
+class _Timer:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        _synchronize()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *args):
+        _synchronize()
+        _records[self.name].append(time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+def timed(name):
+    """ Context timing its block under name, a no-op when the timers are disabled. """
+    if _enabled:
+        return _Timer(name)
+    return _NULL_TIMER
+
+
+def add_record(name, seconds):
+    if _enabled:
+        _records[name].append(seconds)
+
+
+def pop_records():
+    """ Returns the records {name: [seconds, ...]} of this process and clears them. """
+    records = dict(_records)
+    _records.clear()
+    return records
+
+
+def merge_records(records, new_records):
+    """ Extend records with new_records, both {name: [seconds, ...]}. Returns records. """
+    for name, values in new_records.items():
+        records.setdefault(name, []).extend(values)
+    return records
+
+
+def summarize(records, percentiles=(50, 90, 95, 99)):
+    """ {name: {'count', 'total_ms', 'mean_ms', 'p50_ms', ..., 'max_ms'}} of records {name: [seconds, ...]}. """
+    summary = {}
+    for name, values in records.items():
+        if len(values) == 0:
+            continue
+        values_ms = np.asarray(values) * 1000.0
+        stats = {'count': len(values), 'total_ms': float(values_ms.sum()), 'mean_ms': float(values_ms.mean())}
+        for p, v in zip(percentiles, np.percentile(values_ms, percentiles)):
+            stats['p%d_ms' % p] = float(v)
+        stats['max_ms'] = float(values_ms.max())
+        summary[name] = stats
+    return summary
+
+
+def histogram(values, bins=20):
+    """ Histogram {'edges_ms': [bins + 1], 'counts': [bins]} of durations values (seconds). """
+    counts, edges = np.histogram(np.asarray(values) * 1000.0, bins=bins)
+    return {'edges_ms': edges.tolist(), 'counts': counts.tolist()}
+
+
+def report(records, bins=20):
+    """ summarize() of records with the histogram of each stage. """
+    summary = summarize(records)
+    for name, stats in summary.items():
+        stats['histogram'] = histogram(records[name], bins)
+    return summary
@@ -0,0 +1,89 @@
+"""
+Synthetic RGB-D-T sequences in the RGBDT500 layout, for benchmarks that have to run without the real data.
+
+Every sequence has a textured background and one target moving along a smooth path while changing scale. The target
+has its own colour texture, is closer than the background in the 16-bit depth (in mm) and warmer in the infrared.
+The frames are written as <seq>/color, <seq>/depth (uint16) and <seq>/infrared PNG files named %08d.png, with the
+annotation in <seq>/groundtruth.txt: 'frame_name,x,y,w,h' per frame for the training layout, only the 'x,y,w,h' of
+the first frame for the test layout.
+"""
+import os
+
+import cv2
+import numpy as np
+
+
+def _smooth_noise(rng, height, width, scale):
+    """ Low-frequency noise in [0, 1] of shape (height, width). """
+    small = rng.random((max(2, height // scale), max(2, width // scale))).astype(np.float32)
+    noise = cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC)
+    return np.clip(noise, 0.0, 1.0)
+
+
+def generate_sequence(num_frames, height=240, width=320, seed=0):
+    """ Generator of the frames of a sequence.
+    returns:
+        yields (color (H, W, 3) uint8 RGB, depth (H, W) uint16, infrared (H, W, 3) uint8 RGB, box [x, y, w, h])
+    """
+    rng = np.random.default_rng(seed)
+    background = (_smooth_noise(rng, height, width, 16)[..., None] * rng.integers(60, 255, 3)).astype(np.uint8)
+    bg_depth = (2000 + 4000 * np.linspace(0, 1, height, dtype=np.float32)[:, None] +
+                500 * _smooth_noise(rng, height, width, 8)).astype(np.uint16)
+    bg_infrared = (40 + 60 * _smooth_noise(rng, height, width, 32)).astype(np.uint8)
+
+    target_size = np.array([width, height], dtype=np.float64) * rng.uniform(0.1, 0.2)
+    target_texture = (_smooth_noise(rng, 64, 64, 4)[..., None] * rng.integers(60, 255, 3)).astype(np.uint8)
+    target_depth = rng.uniform(800, 1800)
+    phase = rng.uniform(0, 2 * np.pi, 3)
+    period = rng.uniform(0.5, 1.5, 3) * max(num_frames, 1)
+
+    for i in range(num_frames):
+        t = 2 * np.pi * i / period
+        scale = 1.0 + 0.3 * np.sin(t[2] + phase[2])
+        w, h = np.maximum(target_size * scale, 4)
+        cx = width / 2 + (width / 2 - w / 2 - 1) * 0.8 * np.sin(t[0] + phase[0])
+        cy = height / 2 + (height / 2 - h / 2 - 1) * 0.8 * np.sin(t[1] + phase[1])
+        x0, y0 = int(round(cx - w / 2)), int(round(cy - h / 2))
+        x1, y1 = int(round(cx + w / 2)), int(round(cy + h / 2))
+
+        color = background.copy()
+        depth = bg_depth.copy()
+        infrared = bg_infrared.copy()
+        color[y0:y1, x0:x1] = cv2.resize(target_texture, (x1 - x0, y1 - y0), interpolation=cv2.INTER_LINEAR)
+        depth[y0:y1, x0:x1] = int(target_depth)
+        infrared[y0:y1, x0:x1] = 220
+        noise = rng.integers(-8, 9, (height, width, 1))
+        color = np.clip(color.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+        infrared = np.repeat(infrared[..., None], 3, axis=2)
+        yield color, depth, infrared, [x0, y0, x1 - x0, y1 - y0]
+
+
+def write_sequence(seq_dir, num_frames, height=240, width=320, seed=0, layout='train'):
+    """ Write a sequence in the RGBDT500 layout ('train' or 'test', see the module docstring). """
+    for modality in ('color', 'depth', 'infrared'):
+        os.makedirs(os.path.join(seq_dir, modality), exist_ok=True)
+    lines = []
+    for i, (color, depth, infrared, box) in enumerate(generate_sequence(num_frames, height, width, seed)):
+        frame_name = '%08d.png' % (i + 1)
+        cv2.imwrite(os.path.join(seq_dir, 'color', frame_name), cv2.cvtColor(color, cv2.COLOR_RGB2BGR))
+        cv2.imwrite(os.path.join(seq_dir, 'depth', frame_name), depth)
+        cv2.imwrite(os.path.join(seq_dir, 'infrared', frame_name), cv2.cvtColor(infrared, cv2.COLOR_RGB2BGR))
+        if layout == 'train':
+            lines.append('{},{},{},{},{}'.format(frame_name, *box))
+        elif i == 0:
+            lines.append('{},{},{},{}'.format(*box))
+    with open(os.path.join(seq_dir, 'groundtruth.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+
+
+def write_dataset(root, num_sequences, num_frames, height=240, width=320, seed=0, layout='train'):
+    """ Write num_sequences sequences named 001, 002, ... under root. Existing sequences are kept. Returns the
+    sequence names. """
+    sequence_list = []
+    for k in range(num_sequences):
+        seq_name = '%03d' % (k + 1)
+        seq_dir = os.path.join(root, seq_name)
+        if not os.path.isfile(os.path.join(seq_dir, 'groundtruth.txt')):
+            write_sequence(seq_dir, num_frames, height, width, seed + k, layout)
+        sequence_list.append(seq_name)
+    return sequence_list
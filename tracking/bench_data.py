@@ -0,0 +1,203 @@
+"""
+Benchmark of the training data pipeline (TrackingSampler + processing + LTRLoader) without the model.
+
+The training loader is built from an experiment yaml as in training, for every combination of the swept number of
+workers, batch size and storage backend ('png' files or 'lmdb'). For each one the tool reports the samples/s, the
+batch latency and the per-stage latency percentiles (decode, colormap, crop, transform, collate) measured with
+lib.utils.stage_timer in the workers, and the peak RSS of the process and its workers.
+
+Without --data_dir, a synthetic RGB-D-T training set (lib/utils/synthetic_rgbdt.py) is generated in --work_dir, so the
+benchmark runs anywhere. e.g.
+    python tracking/bench_data.py --config baseline --num_workers 0,4,8 --batch_sizes 16,32 --backends png,lmdb
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+import resource
+
+import numpy as np
+import _init_paths
+from lib.config.rdtt.config import cfg, update_config_from_file
+from lib.train.base_functions import update_settings, build_dataloaders
+from lib.utils import stage_timer
+from lib.utils.synthetic_rgbdt import write_dataset
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the training data loader.')
+    parser.add_argument('--config', type=str, default='baseline', help='yaml configure file name (experiments/rdtt).')
+    parser.add_argument('--data_dir', type=str, default=None, help='RGBDT training root. Synthetic data if not set.')
+    parser.add_argument('--lmdb_dir', type=str, default=None, help='LMDB of the training set (lmdb backend). '
+                                                                    'Packed into --work_dir if not set.')
+    parser.add_argument('--work_dir', type=str, default='./output/bench_data', help='Synthetic data and results.')
+    parser.add_argument('--num_workers', type=str, default='0,4', help='Comma separated NUM_WORKER values.')
+    parser.add_argument('--batch_sizes', type=str, default=None, help='Comma separated batch sizes. '
+                                                                      'Default: TRAIN.BATCH_SIZE of the config.')
+    parser.add_argument('--backends', type=str, default='png', help="Comma separated storage backends, png or lmdb.")
+    parser.add_argument('--num_batches', type=int, default=20, help='Number of measured batches per configuration.')
+    parser.add_argument('--warmup', type=int, default=3, help='Number of batches not measured (worker start-up).')
+    parser.add_argument('--num_sequences', type=int, default=8, help='Synthetic data: number of sequences.')
+    parser.add_argument('--num_frames', type=int, default=100, help='Synthetic data: frames per sequence.')
+    parser.add_argument('--frame_size', type=str, default='480x640', help='Synthetic data: HxW of the frames.')
+    parser.add_argument('--output', type=str, default=None, help='Result json. Default: <work_dir>/bench_data.json.')
+    return parser.parse_args()
+
+
+class _TimedCollate:
+    """ Collate function returning (batch, stage timer records of the process since the previous batch). The records
+    of the dataset calls of a batch are made in the same worker as its collation. """
+
+    def __init__(self, collate_fn):
+        self.collate_fn = collate_fn
+
+    def __call__(self, batch):
+        with stage_timer.timed('collate'):
+            batch = self.collate_fn(batch)
+        return batch, stage_timer.pop_records()
+
+
+class _TimedWorkerInit:
+    """ Enables the stage timers in the workers before calling the worker_init_fn of the loader. """
+
+    def __init__(self, worker_init_fn):
+        self.worker_init_fn = worker_init_fn
+
+    def __call__(self, worker_id):
+        stage_timer.enable()
+        if self.worker_init_fn is not None:
+            self.worker_init_fn(worker_id)
+
+
+def _read_rss_kb(pid):
+    with open('/proc/{}/status'.format(pid)) as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1])
+    return 0
+
+
+def _children(pid):
+    children = []
+    task_dir = '/proc/{}/task'.format(pid)
+    for tid in os.listdir(task_dir):
+        with open(os.path.join(task_dir, tid, 'children')) as f:
+            children += [int(c) for c in f.read().split()]
+    return children
+
+
+def process_tree_rss_mb():
+    """ Resident memory of this process and its (worker) children in MB. Shared memory is counted once per process.
+    Falls back to the peak RSS of this process where /proc is not available. """
+    try:
+        pids, total_kb = [os.getpid()], 0
+        while pids:
+            pid = pids.pop()
+            total_kb += _read_rss_kb(pid)
+            pids += _children(pid)
+        return total_kb / 1024.0
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024.0 ** 2 if sys.platform == 'darwin' else peak / 1024.0
+
+
+def _percentiles_ms(values):
+    values_ms = np.asarray(values) * 1000.0
+    return {'p50_ms': float(np.percentile(values_ms, 50)), 'p95_ms': float(np.percentile(values_ms, 95)),
+            'p99_ms': float(np.percentile(values_ms, 99)), 'mean_ms': float(values_ms.mean())}
+
+
+def make_settings(data_dir, lmdb_dir, use_lmdb):
+    settings = argparse.Namespace()
+    settings.env = argparse.Namespace(rgbdt_dir=data_dir, rgbdt_lmdb_dir=lmdb_dir)
+    settings.use_lmdb = use_lmdb
+    settings.local_rank = -1
+    update_settings(settings, cfg)
+    return settings
+
+
+def run_config(data_dir, lmdb_dir, backend, num_workers, batch_size, num_batches, warmup):
+    cfg.TRAIN.NUM_WORKER = num_workers
+    cfg.TRAIN.BATCH_SIZE = batch_size
+    cfg.DATA.TRAIN.DATASETS_NAME = ['rgbdt']
+    cfg.DATA.TRAIN.DATASETS_RATIO = [1]
+    cfg.DATA.TRAIN.SAMPLE_PER_EPOCH = (num_batches + warmup) * batch_size
+    cfg.DATA.VAL.DATASETS_NAME = [None]
+    settings = make_settings(data_dir, lmdb_dir, backend == 'lmdb')
+    loader, _ = build_dataloaders(cfg, settings)
+    loader.collate_fn = _TimedCollate(loader.collate_fn)
+    loader.worker_init_fn = _TimedWorkerInit(loader.worker_init_fn)
+
+    stage_timer.enable()
+    stage_timer.pop_records()
+    records, batch_times, peak_rss = {}, [], process_tree_rss_mb()
+    start = time.perf_counter()
+    prev = start
+    for i, (batch, batch_records) in enumerate(loader):
+        now = time.perf_counter()
+        if i < warmup:
+            start = now
+        else:
+            batch_times.append(now - prev)
+            stage_timer.merge_records(records, batch_records)
+        prev = now
+        peak_rss = max(peak_rss, process_tree_rss_mb())
+    elapsed = prev - start
+    stage_timer.enable(False)
+
+    num_samples = len(batch_times) * batch_size
+    return {'backend': backend, 'num_workers': num_workers, 'batch_size': batch_size,
+            'num_batches': len(batch_times),
+            'samples_per_s': num_samples / elapsed if elapsed > 0 else None,
+            'batch_latency': _percentiles_ms(batch_times) if batch_times else None,
+            'stages': stage_timer.summarize(records),
+            'peak_rss_mb': peak_rss}
+
+
+def prepare_data(args):
+    data_dir, lmdb_dir = args.data_dir, args.lmdb_dir
+    if data_dir is None:
+        height, width = (int(v) for v in args.frame_size.split('x'))
+        data_dir = os.path.join(args.work_dir, 'synthetic_train')
+        print('Generating the synthetic training set in %s' % data_dir)
+        write_dataset(data_dir, args.num_sequences, args.num_frames, height, width)
+    if 'lmdb' in args.backends.split(',') and lmdb_dir is None:
+        lmdb_dir = os.path.join(os.path.abspath(args.work_dir), 'lmdb')
+        if not os.path.isdir(lmdb_dir):
+            subprocess.check_call([sys.executable, os.path.join(os.path.dirname(__file__), 'create_rgbdt_lmdb.py'),
+                                   '--data_dir', data_dir, '--save_dir', lmdb_dir, '--num_workers', '2',
+                                   '--map_size', '64'])
+    return data_dir, lmdb_dir
+
+
+def main():
+    args = parse_args()
+    prj_dir = os.path.join(os.path.dirname(__file__), '..')
+    update_config_from_file(os.path.join(prj_dir, 'experiments/rdtt/%s.yaml' % args.config))
+    os.makedirs(args.work_dir, exist_ok=True)
+    data_dir, lmdb_dir = prepare_data(args)
+
+    num_workers_list = [int(v) for v in args.num_workers.split(',')]
+    batch_sizes = [int(v) for v in args.batch_sizes.split(',')] if args.batch_sizes else [cfg.TRAIN.BATCH_SIZE]
+    backends = args.backends.split(',')
+
+    results = []
+    for backend, num_workers, batch_size in itertools.product(backends, num_workers_list, batch_sizes):
+        result = run_config(data_dir, lmdb_dir, backend, num_workers, batch_size, args.num_batches, args.warmup)
+        results.append(result)
+        stages = '  '.join('%s %.2f/%.2f' % (name, s['p50_ms'], s['p95_ms']) for name, s in result['stages'].items())
+        print('[%s workers=%d batch=%d] %.1f samples/s, peak RSS %.0f MB | p50/p95 ms: %s' % (
+            backend, num_workers, batch_size, result['samples_per_s'] or 0, result['peak_rss_mb'], stages))
+
+    output = args.output or os.path.join(args.work_dir, 'bench_data.json')
+    with open(output, 'w') as f:
+        json.dump({'config': args.config, 'data_dir': data_dir, 'synthetic': args.data_dir is None,
+                   'results': results}, f, indent=2)
+    print('Results written to %s' % output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+"""
+End-to-end latency benchmark of the RDTTrack tracker on synthetic RGB-D-T sequences.
+
+Synthetic sequences (colour, 16-bit depth and infrared with a moving target, lib/utils/synthetic_rgbdt.py) are
+generated in memory and merged into the 9-channel tracker input as in the evaluation (depth colour map included). The
+tracker is run in every combination of the swept device, precision, batch size and backend:
+    batch size  - number of sequences tracked in lockstep, with one batched forward of the network per step.
+    backend     - 'eager', or 'compile' for the static-shape compiled network of the tracker (TEST.COMPILE).
+
+The first --warmup steps of every configuration (and the initialization frames) are not measured. Per configuration,
+the tool reports the p50/p95/p99 latency of a tracking step (search crop, forward, box decoding), the throughput in
+frames/s, the peak memory during the configuration and with --stage_timers the latency of each stage
+(lib/utils/stage_timer.py). Everything is written with the environment to a JSON file, e.g.
+    python tracking/bench_tracker.py --config baseline --devices cuda --precisions fp32,fp16 --batch_sizes 1,4
+A checkpoint is not needed, the latency does not depend on the weights.
+"""
+import gc
+import os
+import sys
+import copy
+import json
+import time
+import argparse
+import itertools
+import platform
+import resource
+
+import numpy as np
+import torch
+import _init_paths
+from lib.test.parameter.rdtt import parameters
+from lib.test.tracker import rdtt as rdtt_tracker
+from lib.test.tracker.rdtt import RDTTrack, track_batch
+from lib.test.evaluation.tracker import merge_rgbdt_image
+from lib.utils import stage_timer
+from lib.utils.synthetic_rgbdt import generate_sequence
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Benchmark the latency of the RDTTrack tracker.')
+    parser.add_argument('--config', type=str, default='baseline', help='yaml configure file name (experiments/rdtt).')
+    parser.add_argument('--checkpoint', type=str, default=None, help='Tracker checkpoint. Initial weights if not set.')
+    parser.add_argument('--devices', type=str, default='cuda', help='Comma separated devices, e.g. cuda,cpu.')
+    parser.add_argument('--precisions', type=str, default='fp32', help='Comma separated precisions, fp32/bf16/fp16.')
+    parser.add_argument('--batch_sizes', type=str, default='1', help='Comma separated numbers of sequences tracked '
+                                                                     'in lockstep.')
+    parser.add_argument('--backends', type=str, default='eager', help='Comma separated backends, eager or compile.')
+    parser.add_argument('--num_frames', type=int, default=100, help='Frames per sequence, initialization included.')
+    parser.add_argument('--warmup', type=int, default=10, help='Number of tracking steps not measured.')
+    parser.add_argument('--frame_size', type=str, default='480x640', help='HxW of the synthetic frames.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the synthetic sequences.')
+    parser.add_argument('--stage_timers', action='store_true', help='Also report the per-stage latencies '
+                                                                     '(TEST.STAGE_TIMERS).')
+    parser.add_argument('--output', type=str, default='./output/bench_tracker.json', help='Result json.')
+    return parser.parse_args()
+
+
+def synthetic_frames(num_frames, height, width, seed):
+    """ Generator of the (9-channel image, ground truth box) of a synthetic sequence. """
+    for color, depth, infrared, box in generate_sequence(num_frames, height, width, seed):
+        yield merge_rgbdt_image(color, depth, infrared), box
+
+
+def rss_mb():
+    """ Current resident memory of the process in MB. Falls back to the peak RSS of the process (over the whole sweep)
+    where /proc is not available. """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except (OSError, ValueError):
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024.0 ** 2 if sys.platform == 'darwin' else peak / 1024.0
+
+
+def environment_info():
+    info = {'torch': torch.__version__, 'python': platform.python_version(), 'platform': platform.platform(),
+            'cpu_count': os.cpu_count(), 'num_threads': torch.get_num_threads()}
+    if torch.cuda.is_available():
+        info['cuda'] = torch.version.cuda
+        info['gpu'] = torch.cuda.get_device_name()
+    return info
+
+
+def build_tracker(params, device, precision, backend, stage_timers=False):
+    params = copy.copy(params)
+    params.cfg = copy.deepcopy(params.cfg)
+    params.cfg.TEST.DEVICE = device
+    params.cfg.TEST.PRECISION = precision
+    params.cfg.TEST.STAGE_TIMERS = stage_timers
+    if backend not in ('eager', 'compile'):
+        raise ValueError("Unknown backend '{}', expected eager or compile".format(backend))
+    # the compiled network is warmed up by the tracker, its compilation is not measured
+    params.cfg.TEST.COMPILE = backend == 'compile'
+    return RDTTrack(params)
+
+
+def run_config(params, device, precision, batch_size, backend, args):
+    height, width = (int(v) for v in args.frame_size.split('x'))
+    tracker = build_tracker(params, device, precision, backend, args.stage_timers)
+    sync = torch.cuda.synchronize if tracker.device.type == 'cuda' else (lambda: None)
+    if tracker.device.type == 'cuda':
+        torch.cuda.reset_peak_memory_stats(tracker.device)
+
+    # the trackers of the batch share the network
+    sequences = [synthetic_frames(args.num_frames, height, width, args.seed + i) for i in range(batch_size)]
+    trackers = [tracker] + [copy.copy(tracker) for _ in range(batch_size - 1)]
+    for t, sequence in zip(trackers, sequences):
+        image, box = next(sequence)
+        t.initialize(image, {'init_bbox': box})
+
+    # peak of the resident memory sampled during the configuration
+    step_times, peak_rss = [], rss_mb()
+    for step, frames in enumerate(zip(*sequences)):
+        images = [image for image, _ in frames]
+        if step == args.warmup:
+            stage_timer.pop_records()
+        sync()
+        start = time.perf_counter()
+        if batch_size == 1:
+            tracker.track(images[0])
+        else:
+            track_batch(trackers, images)
+        sync()
+        if step >= args.warmup:
+            step_times.append(time.perf_counter() - start)
+        peak_rss = max(peak_rss, rss_mb())
+
+    if not step_times:
+        raise ValueError("No measured step, --num_frames has to be larger than --warmup + 1")
+    step_times_ms = np.asarray(step_times) * 1000.0
+    result = {'device': device, 'precision': precision, 'batch_size': batch_size, 'backend': backend,
+              'num_steps': len(step_times),
+              'latency_ms': {'p50': float(np.percentile(step_times_ms, 50)),
+                             'p95': float(np.percentile(step_times_ms, 95)),
+                             'p99': float(np.percentile(step_times_ms, 99)),
+                             'mean': float(step_times_ms.mean()), 'max': float(step_times_ms.max())},
+              'frames_per_s': batch_size * len(step_times) / float(np.sum(step_times)),
+              'peak_rss_mb': peak_rss}
+    if tracker.device.type == 'cuda':
+        result['peak_cuda_mb'] = torch.cuda.max_memory_allocated(tracker.device) / 1024.0 ** 2
+    if args.stage_timers:
+        result['stages'] = stage_timer.summarize(stage_timer.pop_records())
+        stage_timer.enable(False)
+    return result
+
+
+def main():
+    args = parse_args()
+    params = parameters(args.config)
+    params.checkpoint = args.checkpoint
+    params.debug = 0
+
+    results = []
+    for device, precision, batch_size, backend in itertools.product(
+            args.devices.split(','), args.precisions.split(','),
+            [int(v) for v in args.batch_sizes.split(',')], args.backends.split(',')):
+        if torch.device(device).type == 'cuda' and not torch.cuda.is_available():
+            print('[%s] skipped, CUDA is not available' % device)
+            continue
+        try:
+            result = run_config(params, device, precision, batch_size, backend, args)
+        except (RuntimeError, ValueError) as e:
+            # e.g. a precision or backend not supported on the device, reported in the results
+            result = {'device': device, 'precision': precision, 'batch_size': batch_size, 'backend': backend,
+                      'error': str(e)}
+            print('[%s %s batch=%d %s] failed: %s' % (device, precision, batch_size, backend, e))
+        else:
+            print('[%s %s batch=%d %s] p50/p95/p99 %.2f/%.2f/%.2f ms, %.1f frames/s, peak RSS %.0f MB%s' % (
+                device, precision, batch_size, backend, result['latency_ms']['p50'], result['latency_ms']['p95'],
+                result['latency_ms']['p99'], result['frames_per_s'], result['peak_rss_mb'],
+                ', peak CUDA %.0f MB' % result['peak_cuda_mb'] if 'peak_cuda_mb' in result else ''))
+        results.append(result)
+        # release the (compiled) network of the configuration before measuring the next one
+        rdtt_tracker._compiled_networks.clear()
+        gc.collect()
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    output_dir = os.path.dirname(os.path.abspath(args.output))
+    os.makedirs(output_dir, exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'config': args.config, 'checkpoint': args.checkpoint, 'frame_size': args.frame_size,
+                   'num_frames': args.num_frames, 'warmup': args.warmup, 'environment': environment_info(),
+                   'results': results}, f, indent=2)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
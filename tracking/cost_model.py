@@ -0,0 +1,278 @@
+"""
+Cost model of the candidate elimination (CE_LOC, CE_KEEP_RATIO) and prompt (TRAIN.PROMPT.TYPE) configurations.
+
+For the experiment yaml, the tool reports per layer the analytic token counts (template, search tokens in and out of
+the candidate elimination), the FLOPs (2 x multiply-accumulates of the matmuls and convolutions, the element-wise ops
+are not counted), the peak activation memory of the layer in inference, and the CPU latency of each block measured
+with lib.utils.stage_timer. The totals include the patch embeddings, the prompt blocks, the head and the parameters.
+
+It then sweeps the grid of CE locations x keep ratios (the same ratio at every location) x prompt types, estimates
+the FLOPs and the latency of each configuration, and marks the speed/size Pareto front: the configurations for which
+no other one is both faster and keeps at least as many search tokens at the output of the backbone. The latency of a
+configuration is estimated from the attention and MLP latencies measured at several token counts (quadratic and linear
+fits) plus the measured cost of the other stages, without training nor building the configurations. The activation
+memory of the sweep is the sum over the layers (what training keeps for the backward pass, without checkpointing). e.g.
+    python tracking/cost_model.py --config baseline --ce_locs "3,6,9;2,5,8;4,8" --keep_ratios 0.5,0.6,0.7,0.8,1.0
+"""
+import os
+import math
+import json
+import time
+import argparse
+import itertools
+
+import numpy as np
+import torch
+import _init_paths
+from lib.config.rdtt.config import cfg, update_config_from_file
+from lib.models.rdtt import build_rdttrack
+from lib.utils import stage_timer
+
+PROMPT_HIDE_CHANNEL = 8  # hide_channel of Prompt_block and DepthIR_ort_block
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='FLOPs/latency cost model of CE and prompt configurations.')
+    parser.add_argument('--config', type=str, default='baseline', help='yaml configure file name (experiments/rdtt).')
+    parser.add_argument('--ce_locs', type=str, default=None,
+                        help='Semicolon separated CE locations, e.g. "3,6,9;4,8". Default: MODEL.BACKBONE.CE_LOC.')
+    parser.add_argument('--keep_ratios', type=str, default='0.5,0.6,0.7,0.8,0.9,1.0',
+                        help='Comma separated keep ratios, applied at every CE location.')
+    parser.add_argument('--prompt_types', type=str, default=None,
+                        help='Comma separated prompt types (rdtt_shaw, rdtt_deep). Default: TRAIN.PROMPT.TYPE.')
+    parser.add_argument('--precision', type=str, default='fp32', choices=['fp32', 'bf16', 'fp16'],
+                        help='Element size of the activation memory.')
+    parser.add_argument('--num_threads', type=int, default=0, help='torch threads of the measurements (0: default).')
+    parser.add_argument('--reps', type=int, default=5, help='Measured repetitions.')
+    parser.add_argument('--no_measure', action='store_true', help='Analytic costs only, no latency.')
+    parser.add_argument('--output', type=str, default='./output/cost_model.json', help='Result json.')
+    return parser.parse_args()
+
+
+def architecture(net):
+    """ Dimensions of the backbone and head of the built network. """
+    backbone = net.backbone
+    block = backbone.blocks[0]
+    return {'dim': backbone.embed_dim, 'depth': len(backbone.blocks), 'num_heads': block.attn.num_heads,
+            'mlp_hidden': block.mlp.fc1.out_features, 'patch_size': backbone.patch_size,
+            'num_template': backbone.num_patches_template, 'num_search': backbone.num_patches_search,
+            'head_channels': net.box_head.conv1_ctr[0].out_channels if hasattr(net.box_head, 'conv1_ctr') else 0,
+            'feat_sz': net.box_head.feat_sz}
+
+
+def token_flow(num_template, num_search, depth, ce_loc, keep_ratios):
+    """ Per layer (template tokens, search tokens in, search tokens out), as in candidate_elimination. """
+    keep = dict(zip(ce_loc or [], keep_ratios or []))
+    flow, num_s = [], num_search
+    for i in range(depth):
+        num_out = math.ceil(keep[i] * num_s) if keep.get(i, 1.0) < 1 else num_s
+        flow.append((num_template, num_s, num_out))
+        num_s = num_out
+    return flow
+
+
+def prompt_flops(arch, num_tokens, depth_ir=False):
+    """ Prompt_block (and DepthIR_ort_block) 1x1 convolutions on num_tokens tokens. """
+    d, h = arch['dim'], PROMPT_HIDE_CHANNEL
+    flops = 2 * num_tokens * (2 * d * h + h * d)
+    if depth_ir:
+        flops += 2 * num_tokens * (2 * d * h + 2 * h * d)
+    return flops
+
+
+def layer_costs(arch, flow, prompt_type, bytes_per_elem):
+    """ Per layer FLOPs and peak activation memory (the attention maps before and after softmax, qkv, the MLP hidden
+    activation and the residual stream) of a batch of one. """
+    d, heads, hidden = arch['dim'], arch['num_heads'], arch['mlp_hidden']
+    layers = []
+    for i, (num_z, num_in, num_out) in enumerate(flow):
+        n_in, n_out = num_z + num_in, num_z + num_out
+        attn = 2 * n_in * d * 3 * d + 2 * 2 * n_in * n_in * d + 2 * n_in * d * d
+        mlp = 2 * 2 * n_out * d * hidden
+        prompt = prompt_flops(arch, num_z + arch['num_search']) if prompt_type == 'rdtt_deep' and i >= 1 else 0
+        activation = (2 * heads * n_in * n_in + 3 * n_in * d + n_out * hidden + 2 * n_in * d) * bytes_per_elem
+        layers.append({'layer': i, 'template_tokens': num_z, 'search_tokens_in': num_in, 'search_tokens_out': num_out,
+                       'flops_attn': attn, 'flops_mlp': mlp, 'flops_prompt': prompt, 'flops': attn + mlp + prompt,
+                       'activation_mb': activation / 1024.0 ** 2})
+    return layers
+
+
+def static_flops(arch):
+    """ FLOPs of the patch embeddings (3 modalities of the template and the search region), the input prompt
+    (prompt_blocks[0] and DepthIR_ORT) and the center head. """
+    d, p = arch['dim'], arch['patch_size']
+    num_tokens = arch['num_template'] + arch['num_search']
+    patch_embed = 3 * 2 * num_tokens * 3 * p * p * d
+    input_prompt = prompt_flops(arch, num_tokens, depth_ir=True)
+    c, hw = arch['head_channels'], arch['feat_sz'] ** 2
+    channels = [d, c, c // 2, c // 4, c // 8]
+    branch = sum(2 * hw * 9 * cin * cout for cin, cout in zip(channels[:-1], channels[1:]))
+    head = 3 * branch + 2 * hw * (c // 8) * (1 + 2 + 2)
+    return {'patch_embed': patch_embed, 'input_prompt': input_prompt, 'head': head}
+
+
+def count_parameters(net):
+    total = sum(p.numel() for p in net.parameters())
+    trainable = sum(p.numel() for n, p in net.named_parameters() if 'prompt' in n or 'DepthIR_ORT' in n)
+    return {'total': total, 'trainable': trainable, 'total_mb': total * 4 / 1024.0 ** 2}
+
+
+def _median_time(fn, reps):
+    times = []
+    for _ in range(reps + 1):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times[1:])) * 1000.0
+
+
+@torch.no_grad()
+def measure_network(net, arch, reps):
+    """ Measured latency (ms, median) of each stage of a forward pass of the network with its own CE configuration,
+    recorded by the stage timers. """
+    size_z = int(round(arch['num_template'] ** 0.5)) * arch['patch_size']
+    size_x = int(round(arch['num_search'] ** 0.5)) * arch['patch_size']
+    template, search = torch.randn(1, 9, size_z, size_z), torch.randn(1, 9, size_x, size_x)
+    net(template=template, search=search)
+    stage_timer.enable()
+    stage_timer.pop_records()
+    total = _median_time(lambda: net(template=template, search=search), reps)
+    records = stage_timer.pop_records()
+    stage_timer.enable(False)
+    stages = {name: float(np.median(values)) * 1000.0 for name, values in records.items()}
+    # the first prompt_blocks record of every forward is the input prompt, the others are the deep prompt layers
+    prompt = np.asarray(records.get('prompt_blocks', [])) * 1000.0
+    if len(prompt):
+        prompt = prompt.reshape(-1, len(prompt) // (reps + 1))
+        stages['input_prompt'] = float(np.median(prompt[:, 0]))
+        stages['deep_prompt'] = float(np.median(prompt[:, 1:].sum(axis=1))) if prompt.shape[1] > 1 else 0.0
+        stages.pop('prompt_blocks')
+    stages['network'] = total
+    return stages
+
+
+@torch.no_grad()
+def fit_block_latency(net, arch, reps):
+    """ Fits the latency (ms) of the attention part of a block as a quadratic function of its number of tokens, the
+    MLP part as a linear one, and measures the deep prompt layer. """
+    block = net.backbone.blocks[0]
+    num_z, num_x, d = arch['num_template'], arch['num_search'], arch['dim']
+    counts = sorted(set(num_z + max(1, int(num_x * r)) for r in (0.2, 0.4, 0.6, 0.8, 1.0)))
+    attn_ms, mlp_ms = [], []
+    for n in counts:
+        x = torch.randn(1, n, d)
+        attn_ms.append(_median_time(lambda: block.attn(block.norm1(x), None, True), reps))
+        mlp_ms.append(_median_time(lambda: block.mlp(block.norm2(x)), reps))
+    prompt_ms = 0.0
+    if hasattr(net.backbone, 'prompt_blocks'):
+        prompt_block, side = net.backbone.prompt_blocks[0], int(round(num_x ** 0.5))
+        side_z = int(round(num_z ** 0.5))
+        z_feat, x_feat = torch.randn(1, 2 * d, side_z, side_z), torch.randn(1, 2 * d, side, side)
+        prompt_ms = _median_time(lambda: (prompt_block(z_feat), prompt_block(x_feat)), reps)
+    return {'attn': np.polyfit(counts, attn_ms, 2).tolist(), 'mlp': np.polyfit(counts, mlp_ms, 1).tolist(),
+            'deep_prompt_layer': prompt_ms, 'token_counts': counts}
+
+
+def estimate_latency(layers, fits, static_ms, prompt_type):
+    latency = static_ms
+    for layer in layers:
+        n_in = layer['template_tokens'] + layer['search_tokens_in']
+        n_out = layer['template_tokens'] + layer['search_tokens_out']
+        latency += np.polyval(fits['attn'], n_in) + np.polyval(fits['mlp'], n_out)
+        if prompt_type == 'rdtt_deep' and layer['layer'] >= 1:
+            latency += fits['deep_prompt_layer']
+    return float(latency)
+
+
+def pareto_front(rows):
+    """ Marks the rows not dominated in (latency or FLOPs lower, output search tokens higher). """
+    key = 'latency_ms' if all(r.get('latency_ms') is not None for r in rows) else 'gflops'
+    best_tokens = -1
+    for row in sorted(rows, key=lambda r: (r[key], -r['search_tokens_out'])):
+        row['pareto'] = row['search_tokens_out'] > best_tokens
+        best_tokens = max(best_tokens, row['search_tokens_out'])
+    return key
+
+
+def main():
+    args = parse_args()
+    if args.num_threads > 0:
+        torch.set_num_threads(args.num_threads)
+    prj_dir = os.path.join(os.path.dirname(__file__), '..')
+    update_config_from_file(os.path.join(prj_dir, 'experiments/rdtt/%s.yaml' % args.config))
+    bytes_per_elem = 4 if args.precision == 'fp32' else 2
+
+    net = build_rdttrack(cfg, training=False).eval()
+    arch = architecture(net)
+    ce_loc, keep_ratios = list(cfg.MODEL.BACKBONE.CE_LOC or []), list(cfg.MODEL.BACKBONE.CE_KEEP_RATIO or [])
+    prompt_type = cfg.TRAIN.PROMPT.TYPE
+
+    # per layer report of the yaml configuration
+    layers = layer_costs(arch, token_flow(arch['num_template'], arch['num_search'], arch['depth'], ce_loc,
+                                          keep_ratios), prompt_type, bytes_per_elem)
+    static = static_flops(arch)
+    report = {'config': args.config, 'architecture': arch, 'ce_loc': ce_loc, 'ce_keep_ratio': keep_ratios,
+              'prompt_type': prompt_type, 'parameters': count_parameters(net), 'static_flops': static,
+              'layers': layers, 'gflops': (sum(l['flops'] for l in layers) + sum(static.values())) / 1e9,
+              'peak_activation_mb': max(l['activation_mb'] for l in layers)}
+    fits, static_ms = None, 0.0
+    if not args.no_measure:
+        stages = measure_network(net, arch, args.reps)
+        for layer in layers:
+            layer['measured_ms'] = stages.get('ce_block%02d' % layer['layer'])
+        report['measured_ms'] = stages
+        fits = fit_block_latency(net, arch, args.reps)
+        report['latency_fits'] = fits
+        static_ms = stages.get('patch_embed', 0.0) + stages.get('input_prompt', 0.0) + stages.get('forward_head', 0.0)
+        # what the fits do not model (candidate elimination, token recovery, norms), measured on the yaml configuration
+        fits['unmodelled_ms'] = stages['network'] - estimate_latency(layers, fits, static_ms, prompt_type)
+        static_ms += fits['unmodelled_ms']
+
+    print('%s: %s, CE_LOC %s, CE_KEEP_RATIO %s, %d + %d tokens' % (args.config, prompt_type, ce_loc, keep_ratios,
+                                                                   arch['num_template'], arch['num_search']))
+    print('layer  search in -> out   GFLOPs   act MB   measured ms')
+    for layer in layers:
+        print('%5d  %9d -> %-4d  %7.2f  %7.1f   %s' % (
+            layer['layer'], layer['search_tokens_in'], layer['search_tokens_out'], layer['flops'] / 1e9,
+            layer['activation_mb'], '%.2f' % layer['measured_ms'] if layer.get('measured_ms') is not None else '-'))
+    print('total %.2f GFLOPs (patch embed %.2f, input prompt %.2f, head %.2f), %.1fM parameters (%.2fM trainable)%s' % (
+        report['gflops'], static['patch_embed'] / 1e9, static['input_prompt'] / 1e9, static['head'] / 1e9,
+        report['parameters']['total'] / 1e6, report['parameters']['trainable'] / 1e6,
+        ', measured %.1f ms' % report['measured_ms']['network'] if 'measured_ms' in report else ''))
+
+    # sweep
+    ce_locs = [[int(v) for v in locs.split(',') if v] for locs in args.ce_locs.split(';')] if args.ce_locs \
+        else [ce_loc]
+    ratios = [float(v) for v in args.keep_ratios.split(',')]
+    prompt_types = args.prompt_types.split(',') if args.prompt_types else [prompt_type]
+    rows = []
+    for locs, ratio, p_type in itertools.product(ce_locs, ratios, prompt_types):
+        flow = token_flow(arch['num_template'], arch['num_search'], arch['depth'], locs, [ratio] * len(locs))
+        sweep_layers = layer_costs(arch, flow, p_type, bytes_per_elem)
+        rows.append({'ce_loc': locs, 'keep_ratio': ratio, 'prompt_type': p_type,
+                     'search_tokens_out': flow[-1][2],
+                     'search_tokens_total': sum(num_in for _, num_in, _ in flow),
+                     'gflops': (sum(l['flops'] for l in sweep_layers) + sum(static.values())) / 1e9,
+                     'peak_activation_mb': max(l['activation_mb'] for l in sweep_layers),
+                     'total_activation_mb': sum(l['activation_mb'] for l in sweep_layers),
+                     'latency_ms': estimate_latency(sweep_layers, fits, static_ms, p_type) if fits else None})
+    key = pareto_front(rows)
+    rows.sort(key=lambda r: r[key])
+    report['sweep'] = rows
+
+    print('\nPareto table (* on the front of %s vs search tokens out)' % key)
+    print('   CE_LOC         keep  prompt     tokens out  GFLOPs  sum act MB  est. ms')
+    for row in rows:
+        print('%s  %-13s  %.2f  %-10s %10d  %6.2f  %10.1f  %s' % (
+            '*' if row['pareto'] else ' ', ','.join(str(v) for v in row['ce_loc']) or '-', row['keep_ratio'],
+            row['prompt_type'], row['search_tokens_out'], row['gflops'], row['total_activation_mb'],
+            '%.1f' % row['latency_ms'] if row['latency_ms'] is not None else '-'))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
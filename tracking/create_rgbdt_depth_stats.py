@@ -0,0 +1,46 @@
+"""
+Precompute the per-frame depth statistics used by the RGBDT training loader.
+
+For every sequence a depth_stats.txt is written next to groundtruth.txt with one line per frame:
+frame_name,median,clip,min,max (clip = min(3 * median, 10000)). The loader then maps the raw depth to uint8 with a
+look-up table instead of computing a median and a min-max normalization on every frame it samples.
+"""
+import os
+import argparse
+from multiprocessing import Pool
+import cv2
+import _init_paths
+from lib.train.dataset.rgbdt import compute_depth_stats
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Precompute per-frame depth statistics of the RGBDT training set.')
+    parser.add_argument('--data_dir', type=str, required=True, help='RGBDT training root (one folder per sequence).')
+    parser.add_argument('--num_workers', type=int, default=8, help='Number of processes.')
+    return parser.parse_args()
+
+
+def _process_sequence(seq_path):
+    depth_dir = os.path.join(seq_path, 'depth')
+    lines = []
+    for frame_name in sorted(os.listdir(depth_dir)):
+        dp = cv2.imread(os.path.join(depth_dir, frame_name), -1)
+        median, clip, min_depth, max_depth = compute_depth_stats(dp)
+        lines.append('{},{},{},{},{}'.format(frame_name, median, clip, min_depth, max_depth))
+    with open(os.path.join(seq_path, 'depth_stats.txt'), 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return seq_path
+
+
+def main():
+    args = parse_args()
+    data_dir = os.path.realpath(args.data_dir)
+    seq_paths = sorted(os.path.join(data_dir, d) for d in os.listdir(data_dir)
+                       if os.path.isdir(os.path.join(data_dir, d)))
+    with Pool(args.num_workers) as pool:
+        for i, seq_path in enumerate(pool.imap_unordered(_process_sequence, seq_paths), 1):
+            print('[%d / %d] %s' % (i, len(seq_paths), seq_path))
+
+
+if __name__ == '__main__':
+    main()
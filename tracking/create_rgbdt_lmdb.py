@@ -0,0 +1,89 @@
+"""
+Pack the RGBDT training set into a single LMDB so that training does not touch three small PNG files per frame.
+
+The original PNG bytes are stored unchanged (the depth stays raw 16-bit), so decoding from the LMDB gives exactly
+the same frames as reading the files. depth_stats.txt files (tracking/create_rgbdt_depth_stats.py) are packed too
+when present, so run that tool first. Use the result with `--use_lmdb 1` after setting `rgbdt_lmdb_dir` in
+lib/train/admin/local.py.
+"""
+import os
+import argparse
+from multiprocessing import Pool
+import lmdb
+
+MODALITIES = ('color', 'depth', 'infrared')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Pack the RGBDT training set into a LMDB.')
+    parser.add_argument('--data_dir', type=str, required=True, help='RGBDT training root (one folder per sequence).')
+    parser.add_argument('--save_dir', type=str, required=True, help='Path of the output lmdb.')
+    parser.add_argument('--num_workers', type=int, default=8, help='Number of reading processes.')
+    parser.add_argument('--chunk_size', type=int, default=64, help='Frames packed per worker task / write transaction.')
+    parser.add_argument('--map_size', type=int, default=1024, help='Maximum lmdb size in GB.')
+    return parser.parse_args()
+
+
+def _read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def _read_chunk(task):
+    """ Read the raw bytes of a chunk of frames of one sequence. Returns a list of (key, value). """
+    data_dir, seq_name, frame_names = task
+    items = []
+    for frame_name in frame_names:
+        for modality in MODALITIES:
+            key = '/'.join((seq_name, modality, frame_name))
+            items.append((key, _read_file(os.path.join(data_dir, seq_name, modality, frame_name))))
+    return items
+
+
+def _read_annotations(task):
+    """ Read the per-sequence text files (annotations and depth statistics). Returns a list of (key, value). """
+    data_dir, seq_name = task
+    items = [(seq_name + '/groundtruth.txt', _read_file(os.path.join(data_dir, seq_name, 'groundtruth.txt')))]
+    depth_stats_file = os.path.join(data_dir, seq_name, 'depth_stats.txt')
+    if os.path.isfile(depth_stats_file):
+        items.append((seq_name + '/depth_stats.txt', _read_file(depth_stats_file)))
+    return items
+
+
+def main():
+    args = parse_args()
+    data_dir = os.path.realpath(args.data_dir)
+    sequence_list = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+
+    frame_tasks = []
+    for seq_name in sequence_list:
+        frame_names = sorted(os.listdir(os.path.join(data_dir, seq_name, 'color')))
+        for i in range(0, len(frame_names), args.chunk_size):
+            frame_tasks.append((data_dir, seq_name, frame_names[i:i + args.chunk_size]))
+
+    env = lmdb.open(args.save_dir, map_size=args.map_size * 1024 ** 3, subdir=True)
+    with Pool(args.num_workers) as pool:
+        anno_results = pool.imap_unordered(_read_annotations, [(data_dir, s) for s in sequence_list])
+        frame_results = pool.imap_unordered(_read_chunk, frame_tasks)
+        num_chunks = 0
+        for items in anno_results:
+            with env.begin(write=True) as txn:
+                for key, value in items:
+                    txn.put(key.encode(), value)
+        # lmdb has a single writer, the workers only read and the writes are batched per chunk
+        for items in frame_results:
+            with env.begin(write=True) as txn:
+                for key, value in items:
+                    txn.put(key.encode(), value)
+            num_chunks += 1
+            if num_chunks % 100 == 0 or num_chunks == len(frame_tasks):
+                print('packed %d / %d chunks' % (num_chunks, len(frame_tasks)))
+
+    with env.begin(write=True) as txn:
+        txn.put('list.txt'.encode(), '\n'.join(sequence_list).encode())
+    env.close()
+    print('Done. %d sequences packed into %s' % (len(sequence_list), args.save_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -11,7 +11,7 @@ from lib.test.evaluation.running import run_dataset
 from lib.test.evaluation.tracker import Tracker, trackerlist
 
 def run_tracker(tracker_name, tracker_param, run_id=None, dataset_name='otb', sequence=None, debug=0, threads=0,
-                num_gpus=8):
+                num_gpus=8, profile_steps=None):
     """Run tracker on sequence or dataset.
     args:
         tracker_name: Name of tracking method.
@@ -21,6 +21,7 @@ def run_tracker(tracker_name, tracker_param, run_id=None, dataset_name='otb', se
         sequence: Sequence number or name.
         debug: Debug level.
         threads: Number of threads.
+        profile_steps: 'start:stop' range of frames of each sequence profiled with torch.profiler.
     """
 
     dataset = get_dataset(dataset_name)
@@ -29,6 +30,9 @@ def run_tracker(tracker_name, tracker_param, run_id=None, dataset_name='otb', se
         dataset = [dataset[sequence]]
 
     trackers = [Tracker(tracker_name, tracker_param, dataset_name, run_id)]
+    if profile_steps:
+        for tracker in trackers:
+            tracker.params.profile_steps = profile_steps
     # trackers = [tuple([tracker_name, tracker_param, dataset_name, ep_id]) for ep_id in run_id]
 
     run_dataset(dataset, trackers, debug, threads, num_gpus=num_gpus)
@@ -44,6 +48,8 @@ def main():
     parser.add_argument('--debug', type=int, default=0, help='Debug level.')
     parser.add_argument('--threads', type=int, default=0, help='Number of threads.')
     parser.add_argument('--num_gpus', type=int, default=8)
+    parser.add_argument('--profile-steps', type=str, default=None,
+                        help="profile the frames 'start:stop' of each sequence with torch.profiler, e.g. 50:60")
 
     args = parser.parse_args()
 
@@ -53,7 +59,7 @@ def main():
         seq_name = args.sequence
 
     run_tracker(args.tracker_name, args.tracker_param, args.runid, args.dataset_name, seq_name, args.debug,
-                args.threads, num_gpus=args.num_gpus)
+                args.threads, num_gpus=args.num_gpus, profile_steps=args.profile_steps)
 
 
 if __name__ == '__main__':
@@ -13,8 +13,8 @@ def parse_args():
     parser.add_argument('--script', type=str,  default='rdtt', help='training script name')
     parser.add_argument('--config', type=str, help='yaml configure file name')
     parser.add_argument('--save_dir', type=str, default='./output', help='root directory to save checkpoints, logs, and tensorboard')
-    parser.add_argument('--mode', type=str, choices=["single", "multiple", "multi_node"], default="multiple",
-                        help="train on single gpu or multiple gpus")
+    parser.add_argument('--mode', type=str, choices=["single", "multiple", "multi_node", "cpu"], default="multiple",
+                        help="train on single gpu, multiple gpus or cpu processes (gloo, one or more nodes)")
     parser.add_argument('--nproc_per_node', type=int, default=torch.cuda.device_count(), help="number of GPUs per node")  # specify when mode is multiple
     parser.add_argument('--use_lmdb', type=int, choices=[0, 1], default=0)  # whether datasets are in lmdb format
     parser.add_argument('--script_prv', type=str, help='training script name')
@@ -30,6 +30,11 @@ def parse_args():
     parser.add_argument('--world-size', type=int, help='Number of processes participating in the job.')
     parser.add_argument('--ip', type=str, default='127.0.0.1', help='IP of the current rank 0.')
     parser.add_argument('--port', type=int, default='20000', help='Port of the current rank 0.')
+    # for cpu mode
+    parser.add_argument('--num_threads', type=int, default=0, help='torch threads per process in cpu mode (0: default)')
+    # profiling
+    parser.add_argument('--profile-steps', type=str, default=None,
+                        help="profile the training steps 'start:stop' with torch.profiler, e.g. 50:60")
 
     args = parser.parse_args()
 
@@ -56,8 +61,19 @@ def main():
                     "--distill %d --script_teacher %s --config_teacher %s" \
                     % (args.nproc_per_node, args.ip, args.port, args.world_size, args.rank, args.script, args.config, args.save_dir, args.use_lmdb, args.script_prv, args.config_prv, args.use_wandb,
                        args.distill, args.script_teacher, args.config_teacher)
+    elif args.mode == "cpu":
+        # --nproc_per_node processes per node, --world-size nodes (1 if not given)
+        train_cmd = "torchrun --nproc_per_node %d --nnodes %d --node_rank %d --master_addr %s --master_port %d " \
+                    "lib/train/run_training.py --backend gloo --device cpu --num_threads %d " \
+                    "--script %s --config %s --save_dir %s --use_lmdb %d --script_prv %s --config_prv %s --use_wandb %d " \
+                    "--distill %d --script_teacher %s --config_teacher %s" \
+                    % (max(args.nproc_per_node, 1), args.world_size or 1, args.rank or 0, args.ip, args.port, args.num_threads,
+                       args.script, args.config, args.save_dir, args.use_lmdb, args.script_prv, args.config_prv,
+                       args.use_wandb, args.distill, args.script_teacher, args.config_teacher)
     else:
-        raise ValueError("mode should be 'single' or 'multiple' or 'multi_node'.")
+        raise ValueError("mode should be 'single', 'multiple', 'multi_node' or 'cpu'.")
+    if args.profile_steps:
+        train_cmd += " --profile-steps %s" % args.profile_steps
     os.system(train_cmd)
 
 